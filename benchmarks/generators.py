@@ -0,0 +1,123 @@
+import hashlib
+import os
+import random
+
+import yaml
+
+from randrctl.profile import hash
+
+# resolutions of generated modes, the rest are derived from them
+BASE_MODES = [(3840, 2160), (2560, 1440), (1920, 1200), (1920, 1080), (1680, 1050), (1600, 900), (1366, 768),
+              (1280, 1024), (1280, 720), (1024, 768), (800, 600), (640, 480)]
+RATES = ['60.00', '59.94', '50.00']
+
+
+def output_name(i: int) -> str:
+    return 'DP{}'.format(i)
+
+
+def is_connected(i: int) -> bool:
+    # every fourth output is disconnected
+    return i % 4 != 3
+
+
+def edid(i: int) -> str:
+    """
+    :return: deterministic fake EDID of a display connected to i-th output as it's printed by xrandr (8 lines)
+    """
+    digest = b''.join(hashlib.sha256('{}:{}'.format(i, n).encode()).digest()[:16] for n in range(8))
+    return digest.hex()
+
+
+def modes(n_modes: int) -> list:
+    """
+    :return: list of n_modes distinct mode names, largest first
+    """
+    result = []
+    for n in range(n_modes):
+        w, h = BASE_MODES[n % len(BASE_MODES)]
+        shrink = 8 * (n // len(BASE_MODES))
+        result.append('{}x{}'.format(w - shrink, h - shrink))
+    return result
+
+
+def xrandr_outputs(n_outputs: int, n_modes: int):
+    """
+    Generates output of xrandr -q and xrandr -q --verbose for n_outputs outputs supporting n_modes modes each.
+    Connected outputs are active and placed left to right in their first mode.
+    :return: tuple (query_text, verbose_text)
+    """
+    mode_names = modes(n_modes)
+    width, height = map(int, mode_names[0].split('x'))
+    screen = 'Screen 0: minimum 320 x 200, current {} x {}, maximum 32767 x 32767'.format(width * n_outputs, height)
+    query = [screen]
+    verbose = [screen]
+    for i in range(n_outputs):
+        name = output_name(i)
+        if not is_connected(i):
+            query.append('{} disconnected (normal left inverted right x axis y axis)'.format(name))
+            verbose.append('{} disconnected (normal left inverted right x axis y axis)'.format(name))
+            verbose.extend(['\tIdentifier: 0x{:x}'.format(0x42 + i), '\tCRTCs:      0 1'])
+            continue
+
+        geometry = '{}+{}+0'.format(mode_names[0], width * i)
+        header = '{} connected {}{} (normal left inverted right x axis y axis) 510mm x 290mm'.format(
+            name, 'primary ' if i == 0 else '', geometry)
+        query.append(header)
+        verbose.append(header)
+        verbose.extend([
+            '\tIdentifier: 0x{:x}'.format(0x42 + i),
+            '\tTimestamp:  12345678',
+            '\tSubpixel:   unknown',
+            '\tCRTC:       {}'.format(i),
+            '\tCRTCs:      {}'.format(i),
+            '\tEDID: ',
+        ])
+        data = edid(i)
+        verbose.extend('\t\t' + data[n:n + 32] for n in range(0, len(data), 32))
+        verbose.extend(['\tBroadcast RGB: Automatic ', '\t\tsupported: Automatic, Full, Limited 16:235'])
+
+        for n, mode in enumerate(mode_names):
+            flags = '*+' if n == 0 else '  '
+            query.append('   {:<14}{}{}  {}'.format(mode, RATES[0], flags, '    '.join(RATES[1:])))
+            w, h = mode.split('x')
+            for rate in RATES:
+                verbose.append('  {} (0x{:x}) 148.500MHz +HSync +VSync{}'.format(
+                    mode, 0x48 + n, ' *current +preferred' if n == 0 and rate == RATES[0] else ''))
+                verbose.append('        h: width  {} start 2008 end 2052 total 2200 skew    0 clock  67.50KHz'.format(w))
+                verbose.append('        v: height {} start 1084 end 1089 total 1125           clock  {}Hz'.format(h, rate))
+    return '\n'.join(query) + '\n', '\n'.join(verbose) + '\n'
+
+
+def profile_catalogue(directory: str, n_profiles: int, n_outputs: int = 4, n_modes: int = 16, seed: int = 0):
+    """
+    Writes n_profiles profiles to directory. Every profile matches a random subset of outputs generated by
+    xrandr_outputs(n_outputs, n_modes) with a mix of empty, edid, prefers and supports rules
+    """
+    rnd = random.Random(seed)
+    connected = [i for i in range(n_outputs) if is_connected(i)]
+    mode_names = modes(n_modes)
+    os.makedirs(directory, exist_ok=True)
+    dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+    for n in range(n_profiles):
+        used = rnd.sample(connected, rnd.randint(1, len(connected)))
+        match = dict()
+        outputs = dict()
+        x = 0
+        for i in used:
+            rule = dict()
+            kind = rnd.randrange(4)
+            if kind == 1:
+                rule['edid'] = hash(edid(i) if rnd.random() < 0.9 else edid(i + n_outputs))
+            elif kind == 2:
+                rule['prefers'] = rnd.choice(mode_names[:2])
+            elif kind == 3:
+                rule['supports'] = rnd.choice(mode_names)
+            match[output_name(i)] = rule
+            mode = rnd.choice(mode_names)
+            outputs[output_name(i)] = {'mode': mode, 'pos': '{}x0'.format(x), 'rate': rnd.choice(RATES)}
+            x += int(mode.split('x')[0])
+        profile = {'match': match, 'outputs': outputs, 'primary': output_name(used[0]),
+                   'priority': rnd.randint(0, 200)}
+        with open(os.path.join(directory, 'profile-{:05d}'.format(n)), 'w') as f:
+            yaml.dump(profile, f, Dumper=dumper)
@@ -0,0 +1,162 @@
+# End-to-end hotplug latency: runs the real `randrctl -d auto` entry point the way udev does, against a stub xrandr
+# replaying synthetic output and a fake config home, and reports latency percentiles over many runs.
+#
+#   python -m benchmarks.hotplug [--runs 50] [--profiles 100]
+#
+# Timestamps of xrandr invocations are recorded by the stub, so time to the first xrandr call (interpreter start, cli,
+# display detection, config loading) and time to the modeset are reported separately from the total.
+import argparse
+import getpass
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generators import profile_catalogue, xrandr_outputs
+from randrctl.cache import CACHE_DIR_ENV
+from randrctl.displays import LOGIND_SESSIONS_DIR_ENV, UTMP_FILE_ENV, X11_SOCKET_DIR_ENV
+
+STUB = '''#!/bin/bash
+dir="$(dirname "$0")"
+echo "${EPOCHREALTIME:-$(date +%s.%N)} $*" >> "$dir/calls"
+case " $* " in
+    *" --verbose "*) cat "$dir/verbose" ;;
+    *" -q "*) cat "$dir/query" ;;
+esac
+exit 0
+'''
+
+
+
+class Sandbox:
+    """
+    Directory with stub xrandr, fake X socket, logind session of the current user, config home and caches
+    """
+
+    def __init__(self, n_outputs: int, n_modes: int, n_profiles: int):
+        self.dir = tempfile.mkdtemp(prefix='randrctl-hotplug-')
+        self.bin = self._mkdir('bin')
+        self.socket_dir = self._mkdir('X11-unix')
+        self.sessions_dir = self._mkdir('sessions')
+        self.runtime_dir = self._mkdir('runtime')
+        self.cache_dir = self._mkdir('cache')
+        self.config_home = self._mkdir('config')
+        self.calls = os.path.join(self.bin, 'calls')
+
+        stub = os.path.join(self.bin, 'xrandr')
+        with open(stub, 'w') as f:
+            f.write(STUB)
+        os.chmod(stub, stat.S_IRWXU)
+        query, verbose = xrandr_outputs(n_outputs, n_modes)
+        self._write(os.path.join(self.bin, 'query'), query)
+        self._write(os.path.join(self.bin, 'verbose'), verbose)
+
+        self._write(os.path.join(self.socket_dir, 'X0'), '')
+        self._write(os.path.join(self.sessions_dir, '1'), 'USER={}\nDISPLAY=:0\n'.format(getpass.getuser()))
+        profile_catalogue(os.path.join(self.config_home, 'randrctl', 'profiles'), n_profiles, n_outputs, n_modes)
+
+    def _mkdir(self, name: str) -> str:
+        path = os.path.join(self.dir, name)
+        os.makedirs(path)
+        return path
+
+    def _write(self, path: str, content: str):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def env(self) -> dict:
+        env = dict((k, v) for k, v in os.environ.items() if k not in ('DISPLAY', 'XAUTHORITY', 'RANDRCTL_TRACE'))
+        env['PATH'] = self.bin + os.pathsep + env.get('PATH', '')
+        env['XDG_CONFIG_HOME'] = self.config_home
+        env['XDG_RUNTIME_DIR'] = self.runtime_dir
+        env['LC_ALL'] = 'C'
+        # udev runs randrctl without DISPLAY, so displays and their owners are detected. Locations of X sockets and
+        # login records are replaced with fake ones and caches are kept in the sandbox
+        env[X11_SOCKET_DIR_ENV] = self.socket_dir
+        env[UTMP_FILE_ENV] = os.path.join(self.dir, 'utmp')
+        env[LOGIND_SESSIONS_DIR_ENV] = self.sessions_dir
+        env[CACHE_DIR_ENV] = self.cache_dir
+        return env
+
+    def argv(self, randrctl_args: list) -> list:
+        return [sys.executable, '-m', 'randrctl'] + randrctl_args
+
+    def xrandr_calls(self) -> list:
+        """
+        :return: list of (timestamp, args) of xrandr calls since the last reset
+        """
+        try:
+            with open(self.calls) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        return [(float(ts), args.split()) for ts, _, args in (line.partition(' ') for line in lines)]
+
+    def reset(self):
+        if os.path.exists(self.calls):
+            os.unlink(self.calls)
+
+    def cleanup(self):
+        shutil.rmtree(self.dir)
+
+
+def run_once(sandbox: Sandbox, randrctl_args: list) -> dict:
+    """
+    :return: {phase: seconds since start} for total, first xrandr call and modeset (None if it didn't happen)
+    """
+    sandbox.reset()
+    env = sandbox.env()
+    argv = sandbox.argv(randrctl_args)
+    start = time.time()
+    p = subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    total = time.time() - start
+    if p.returncode != 0:
+        raise RuntimeError('randrctl failed: {}'.format(p.stderr.decode()))
+
+    calls = sandbox.xrandr_calls()
+    modesets = [ts for ts, args in calls if '-q' not in args]
+    return {
+        'total': total,
+        'first xrandr': calls[0][0] - start if calls else None,
+        'modeset': modesets[0] - start if modesets else None,
+    }
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.hotplug', description='randrctl hotplug latency')
+    parser.add_argument('--runs', type=int, default=50, help='number of measured runs (default: %(default)s)')
+    parser.add_argument('--profiles', type=int, default=100, help='profiles in config home (default: %(default)s)')
+    parser.add_argument('--outputs', type=int, default=4, help='outputs reported by xrandr (default: %(default)s)')
+    parser.add_argument('--modes', type=int, default=16, help='modes per output (default: %(default)s)')
+    args = parser.parse_args()
+
+    sandbox = Sandbox(args.outputs, args.modes, args.profiles)
+    try:
+        # the first run populates caches (display owners, profile names), like the first hotplug after login
+        cold = run_once(sandbox, ['-d', 'auto'])
+        results = [run_once(sandbox, ['-d', 'auto']) for _ in range(args.runs)]
+    finally:
+        sandbox.cleanup()
+
+    print('{:<14} {:>10} {:>10} {:>10} {:>10}'.format('ms', 'cold', 'p50', 'p95', 'max'))
+    for phase in ('first xrandr', 'modeset', 'total'):
+        values = [r[phase] for r in results if r[phase] is not None]
+        if not values:
+            print('{:<14} {:>10}'.format(phase, 'never'))
+            continue
+        print('{:<14} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            phase, (cold[phase] or float('nan')) * 1000, percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+            max(values) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
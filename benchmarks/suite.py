@@ -0,0 +1,162 @@
+# Benchmarks of parsing, profile loading and matching on synthetic xrandr outputs and profile catalogues.
+#
+#   python -m benchmarks.suite                  compare with benchmarks/baseline.json
+#   python -m benchmarks.suite --save           record new baseline
+#   python -m benchmarks.suite --full           include catalogues of 10k and 50k profiles
+#
+# Exits with 1 if any phase is slower or takes more memory than baseline by more than threshold.
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.generators import profile_catalogue, xrandr_outputs
+from randrctl.parser import parse
+from randrctl.profile import ProfileManager, ProfileMatcher
+from randrctl.xrandr import Xrandr
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# (outputs, modes)
+XRANDR_SIZES = [(4, 16), (16, 64), (64, 256)]
+PROFILE_SIZES = [10, 1000]
+FULL_PROFILE_SIZES = PROFILE_SIZES + [10000, 50000]
+# slow phases are repeated until this much time is spent
+TIME_BUDGET = 2.0
+
+
+def measure(fn, repeat: int) -> dict:
+    """
+    :return: {'time': best of up to repeat runs in seconds, 'peak': peak memory allocated by a single run in bytes}
+    """
+    best = float('inf')
+    spent = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent > TIME_BUDGET:
+            break
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'time': best, 'peak': peak}
+
+
+def xrandr_phases(n_outputs: int, n_modes: int):
+    xrandr = Xrandr(None, None)
+    query, verbose = (output.encode() for output in xrandr_outputs(n_outputs, n_modes))
+    records = parse(verbose)
+    size = 'outputs={},modes={}'.format(n_outputs, n_modes)
+    return [
+        ('parse_query[{}]'.format(size), lambda: parse(query)),
+        ('parse_verbose[{}]'.format(size), lambda: parse(verbose)),
+        ('outputs[{}]'.format(size), lambda: xrandr._outputs(records)),
+    ]
+
+
+def profile_phases(directory: str, n_profiles: int):
+    profile_dir = os.path.join(directory, str(n_profiles))
+    profile_catalogue(profile_dir, n_profiles)
+    manager = ProfileManager([profile_dir], profile_dir)
+
+    xrandr = Xrandr(None, None)
+    _, verbose = xrandr_outputs(4, 16)
+    connected = [o for o in xrandr._outputs(parse(verbose)) if o.display is not None]
+    profiles = manager.read_all()
+    size = 'profiles={}'.format(n_profiles)
+    return [
+        ('read_all[{}]'.format(size), manager.read_all),
+        ('match[{}]'.format(size), lambda: ProfileMatcher().match(profiles, connected)),
+    ]
+
+
+def run(profile_sizes: list, repeat: int) -> dict:
+    results = dict()
+    directory = tempfile.mkdtemp(prefix='randrctl-bench-')
+    try:
+        phases = []
+        for n_outputs, n_modes in XRANDR_SIZES:
+            phases.extend(xrandr_phases(n_outputs, n_modes))
+        for n_profiles in profile_sizes:
+            phases.extend(profile_phases(directory, n_profiles))
+        for name, fn in phases:
+            results[name] = measure(fn, repeat)
+            sys.stderr.write('.')
+            sys.stderr.flush()
+        sys.stderr.write('\n')
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints results along with baseline.
+    :return: list of regressed phases
+    """
+    regressions = []
+    print('{:<50} {:>12} {:>12} {:>8} {:>12} {:>12} {:>8}'.format(
+        'phase', 'time, ms', 'baseline', 'ratio', 'peak, KiB', 'baseline', 'ratio'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        cells = []
+        regressed = False
+        for key, scale in (('time', 1000), ('peak', 1 / 1024)):
+            value = result[key]
+            if base and base[key]:
+                ratio = value / base[key]
+                regressed = regressed or ratio > threshold
+                cells.extend([value * scale, base[key] * scale, '{:.2f}'.format(ratio)])
+            else:
+                cells.extend([value * scale, float('nan'), '-'])
+        print('{:<50} {:>12.3f} {:>12.3f} {:>8} {:>12.1f} {:>12.1f} {:>8}{}'.format(
+            name, *cells, '  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.suite', description='randrctl benchmarks')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--save', action='store_true', help='save results as new baseline')
+    parser.add_argument('--full', action='store_true', help='include catalogues of 10k and 50k profiles')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per phase, the best one is taken')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='ratio to baseline considered a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = run(FULL_PROFILE_SIZES if args.full else PROFILE_SIZES, args.repeat)
+
+    baseline = dict()
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    if regressions:
+        print('{} phase(s) regressed by more than {}x'.format(len(regressions), args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import time
+from concurrent.futures import Executor
+from typing import List, Optional
+
+from randrctl.ctl import DEFAULT_HOOK_TIMEOUT, ROLLBACK_PROFILE, Hook, Hooks
+from randrctl.exception import ImpossibleProfileException, XrandrException, XrandrTimeoutException
+from randrctl.metrics import Metrics, APPLY_DURATION, AUTO, HOOK_DURATION, HOOK_FAILURES, LAST_SWITCH, \
+    MATCH_DURATION, READ_PROFILES_DURATION, ROLLBACK_DURATION, ROLLBACKS, SWITCHES, TimedIterator
+from randrctl.model import Profile, XrandrConnection, PRIOR_SWITCH, POST_SWITCH, POST_FAIL
+from randrctl.parser import OutputRecord, XrandrParser
+from randrctl.profile import ProfileChecker, ProfileManager, ProfileMatcher
+from randrctl.state import AppliedState
+from randrctl.xrandr import CHUNK_SIZE, Xrandr, XrandrPolicy
+
+logger = logging.getLogger(__name__)
+
+
+async def _terminate(process: asyncio.subprocess.Process):
+    """
+    Kills process along with its children (process is expected to be a session leader) and reaps it
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    await process.wait()
+
+
+class AsyncXrandr(Xrandr):
+    """
+    Asynchronous counterpart of Xrandr. Runs xrandr via asyncio subprocesses and shares parsing with Xrandr.
+    Nothing is cached, every query reflects the current state.
+    """
+
+    def __init__(self, display: Optional[str], xauthority: Optional[str], timeout: Optional[float] = None,
+                 policy: XrandrPolicy = None):
+        """
+        :param timeout: seconds to wait for a single xrandr call before it's killed, overrides timeout of policy
+        """
+        super().__init__(display, xauthority, policy)
+        if timeout is not None:
+            self.policy.timeout = timeout
+
+    async def apply(self, profile: Profile, xrandr_connections: List[XrandrConnection] = None):
+        """
+        Apply given profile by calling xrandr. Current outputs are queried unless passed
+        """
+        logger.debug("Applying profile %s", profile.name)
+
+        if xrandr_connections is None:
+            xrandr_connections = await self.get_all_outputs()
+        args = self._compose_mode_args(profile, xrandr_connections)
+        await self._xrandr(*args)
+
+    async def restore(self, args: list):
+        logger.debug("Restoring previous layout")
+        await self._run(self._command(args))
+
+    async def _xrandr(self, *args):
+        """
+        Perform call to xrandr executable with passed arguments. Transient failures are retried according to policy.
+        Returns list of output lines
+        """
+        args = self._command(args)
+        return await self._retrying(self._run, args)
+
+    async def _run(self, args: list) -> list:
+        process = await self._spawn(args)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), self.policy.timeout)
+        except asyncio.TimeoutError:
+            await _terminate(process)
+            raise XrandrTimeoutException(self.policy.timeout, args)
+        except asyncio.CancelledError:
+            await _terminate(process)
+            raise
+        return self._output_lines(args, stdout, stderr)
+
+    async def _retrying(self, call, args: list):
+        attempt = 0
+        while True:
+            try:
+                return await call(args)
+            except XrandrException as e:
+                if not self.policy.retryable(e, attempt):
+                    raise
+                delay = self.policy.delay(attempt)
+                logger.warning("xrandr failed: %s. Retrying in %.2fs", str(e).strip(), delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _spawn(self, args: list) -> asyncio.subprocess.Process:
+        return await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                    env=self.env, start_new_session=True)
+
+    async def _query(self) -> List[OutputRecord]:
+        """
+        Runs xrandr -q --verbose, its output is parsed while it's read
+        """
+        return await self._retrying(self._stream, self._command((self.QUERY_KEY, self.VERBOSE_KEY)))
+
+    async def _stream(self, args: list) -> List[OutputRecord]:
+        process = await self._spawn(args)
+        try:
+            records, stderr = await asyncio.wait_for(
+                asyncio.gather(self._parse_stream(process.stdout), process.stderr.read()), self.policy.timeout)
+            await process.wait()
+        except asyncio.TimeoutError:
+            await _terminate(process)
+            raise XrandrTimeoutException(self.policy.timeout, args)
+        except asyncio.CancelledError:
+            await _terminate(process)
+            raise
+        if stderr:
+            raise XrandrException(stderr.decode(errors='replace'), args)
+        return records
+
+    async def _parse_stream(self, stream: asyncio.StreamReader) -> List[OutputRecord]:
+        parser = XrandrParser()
+        records = []
+        chunk = await stream.read(CHUNK_SIZE)
+        while chunk:
+            records.extend(parser.feed(chunk))
+            chunk = await stream.read(CHUNK_SIZE)
+        records.extend(parser.close())
+        return records
+
+    async def get_all_outputs(self) -> List[XrandrConnection]:
+        return self._outputs(await self._query())
+
+    async def get_connected_outputs(self) -> List[XrandrConnection]:
+        return list(filter(lambda o: o.display is not None, await self.get_all_outputs()))
+
+
+class AsyncHooks(Hooks):
+    """
+    Asynchronous counterpart of Hooks. Hooks of a stage are awaited concurrently, background hooks are reaped by
+    tasks running on the loop.
+    """
+
+    def __init__(self, prior_switch=None, post_switch=None, post_fail=None,
+                 timeout: Optional[float] = DEFAULT_HOOK_TIMEOUT, env: dict = None, metrics: Metrics = None):
+        super().__init__(prior_switch, post_switch, post_fail, timeout, env, metrics)
+        self._background = set()
+
+    async def prior_switch(self, p: Profile):
+        await self._run_async(PRIOR_SWITCH, self._hooks(PRIOR_SWITCH, p), p)
+
+    async def post_switch(self, p: Profile):
+        await self._run_async(POST_SWITCH, self._hooks(POST_SWITCH, p), p)
+
+    async def post_fail(self, p: Profile, err: str):
+        await self._run_async(POST_FAIL, self._hooks(POST_FAIL, p), p, err)
+
+    async def _run_async(self, stage: str, hooks: List[Hook], p: Profile, err: str = None):
+        if not hooks:
+            return
+        env = self._env(p, err)
+        context = self._context(p, err)
+        with self.metrics.time(HOOK_DURATION, stage=stage):
+            succeeded = await asyncio.gather(*(self._run_one(hook, env, context) for hook in hooks))
+        failures = succeeded.count(False)
+        if failures:
+            self.metrics.inc(HOOK_FAILURES, failures, stage=stage)
+
+    async def _run_one(self, hook: Hook, env: dict, context: bytes) -> bool:
+        """
+        :return: False if hook failed
+        """
+        try:
+            logger.debug("Calling '%s'", hook)
+            if hook.shell:
+                process = await asyncio.create_subprocess_shell(hook.command, env=env, stdin=subprocess.PIPE,
+                                                                start_new_session=True)
+            else:
+                process = await asyncio.create_subprocess_exec(*hook.command, env=env, stdin=subprocess.PIPE,
+                                                               start_new_session=True)
+        except Exception as e:
+            logger.warning("Error while executing hook '%s': %s", hook, str(e))
+            return False
+
+        try:
+            process.stdin.write(context)
+            process.stdin.close()
+        except OSError:
+            # hook is not interested in context
+            pass
+
+        if not hook.wait:
+            task = asyncio.ensure_future(process.wait())
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            return True
+
+        try:
+            await asyncio.wait_for(process.wait(), hook.timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Hook '%s' timed out after %ss, killing it", hook, hook.timeout)
+            await _terminate(process)
+        except asyncio.CancelledError:
+            await _terminate(process)
+            raise
+        return process.returncode == 0
+
+
+class AsyncRandrCtl:
+    """
+    Asynchronous facade for embedding randrctl into event loop based applications.
+    Blocking profile I/O is offloaded to executor, xrandr and hooks run as asyncio subprocesses.
+    """
+
+    def __init__(self, profile_manager: ProfileManager, xrandr: AsyncXrandr, hooks: AsyncHooks,
+                 executor: Executor = None, metrics: Metrics = None, state: AppliedState = None):
+        """
+        :param executor: executor for profile I/O, loop's default executor if None
+        :param state: where to persist successfully applied profile, not persisted if None
+        """
+        self.profile_manager = profile_manager
+        self.xrandr = xrandr
+        self.hooks = hooks
+        self.executor = executor
+        self.metrics = metrics or Metrics()
+        self.state = state
+
+    async def _in_executor(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _apply(self, p: Profile, connected_outputs: List[XrandrConnection] = None):
+        try:
+            await self.hooks.prior_switch(p)
+            all_outputs = await self.xrandr.get_all_outputs()
+            rollback_args = self._rollback_args(all_outputs)
+            try:
+                with self.metrics.time(APPLY_DURATION):
+                    await self.xrandr.apply(p, all_outputs)
+            except XrandrException as e:
+                # X server is likely to be wedged if xrandr timed out, rollback would hang too
+                if rollback_args and not isinstance(e, XrandrTimeoutException):
+                    await self._rollback(rollback_args)
+                raise
+            await self.hooks.post_switch(p)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.metrics.inc(SWITCHES, profile=p.name, outcome='failure')
+            await self.hooks.post_fail(p, str(e))
+            raise e
+        self.metrics.inc(SWITCHES, profile=p.name, outcome='success')
+        self.metrics.set(LAST_SWITCH, time.time())
+        if self.state is not None:
+            if connected_outputs is None:
+                connected_outputs = await self.xrandr.get_connected_outputs()
+            await self._in_executor(self.state.save, p, connected_outputs)
+
+    def _rollback_args(self, xrandr_connections: List[XrandrConnection]) -> Optional[list]:
+        snapshot = self.profile_manager.profile_from_xrandr(xrandr_connections, ROLLBACK_PROFILE)
+        if not snapshot.outputs:
+            return None
+        return self.xrandr.restore_args(snapshot, xrandr_connections)
+
+    async def _rollback(self, rollback_args: list):
+        start = time.perf_counter()
+        try:
+            await self.xrandr.restore(rollback_args)
+        except XrandrException as e:
+            self.metrics.inc(ROLLBACKS, outcome='failure')
+            logger.error("Failed to restore previous layout: %s", str(e).strip())
+        else:
+            elapsed = time.perf_counter() - start
+            self.metrics.inc(ROLLBACKS, outcome='success')
+            self.metrics.observe(ROLLBACK_DURATION, elapsed)
+            logger.warning("Restored previous layout in %.0fms", elapsed * 1000)
+
+    async def switch_to(self, profile_name: str, check: bool = False):
+        """
+        Apply profile settings by profile name
+        :param check: refuse profile if connected hardware can't apply it
+        """
+        try:
+            p = await self._in_executor(self.profile_manager.read_one, profile_name)
+            if check:
+                problems = ProfileChecker(await self.xrandr.get_all_outputs()).check(p)
+                if problems:
+                    self.metrics.inc(SWITCHES, profile=p.name, outcome='refused')
+                    raise ImpossibleProfileException(p.name, problems)
+            await self._apply(p)
+        finally:
+            await self._in_executor(self.metrics.flush)
+
+    async def switch_auto(self, check: bool = False) -> Optional[Profile]:
+        """
+        Try to find profile by display EDID and apply it
+        :param check: skip matching profiles which connected hardware can't apply
+        :return: applied profile or None if nothing matches
+        """
+        try:
+            all_outputs = await self.xrandr.get_all_outputs()
+            xrandr_outputs = list(filter(lambda o: o.display is not None, all_outputs))
+
+            # profiles are streamed from disk, only the best match is kept unless it may be refused. Reading is
+            # measured separately from matching
+            profiles = TimedIterator(self.profile_manager.iter_profiles())
+            start = time.monotonic()
+            matches = await self._in_executor(ProfileMatcher().top, profiles, xrandr_outputs, None if check else 1)
+            matching = None
+            checker = ProfileChecker(all_outputs) if check else None
+            for _, p in matches:
+                problems = checker.check(p) if checker else None
+                if not problems:
+                    matching = p
+                    break
+                logger.warning("Skipping profile %s: %s", p.name, '; '.join(problems))
+            self.metrics.observe(READ_PROFILES_DURATION, profiles.elapsed)
+            self.metrics.observe(MATCH_DURATION, time.monotonic() - start - profiles.elapsed)
+
+            if matching is not None:
+                self.metrics.inc(AUTO, outcome='matched')
+                await self._apply(matching, xrandr_outputs)
+            else:
+                self.metrics.inc(AUTO, outcome='unmatched')
+                logger.warning("No matching profile found")
+            return matching
+        finally:
+            await self._in_executor(self.metrics.flush)
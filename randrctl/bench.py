@@ -0,0 +1,135 @@
+# On-machine benchmark of every phase randrctl goes through on hotplug.
+#
+#   randrctl bench -n 20
+#
+# Phases are timed on the live system: real config, profiles and X server. Nothing is applied, the switch is composed
+# up to xrandr arguments only. Results are printed as a table and as JSON to be attached to bug reports.
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Optional
+
+import randrctl
+from randrctl import context
+from randrctl.exception import RandrCtlException
+from randrctl.parser import parse
+from randrctl.profile import ProfileMatcher
+from randrctl.xrandr import Xrandr
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ITERATIONS = 10
+
+# in the order they are executed, every phase depends on the preceding ones
+PHASES = ['import', 'config', 'catalogue', 'xrandr -q', 'xrandr -q --verbose', 'parse', 'match', 'compose']
+
+# modules imported by randrctl auto
+IMPORT_STATEMENT = 'import randrctl.cli, randrctl.context'
+
+
+class _PhaseFailed(Exception):
+    pass
+
+
+def _version() -> Optional[str]:
+    from importlib import metadata
+    try:
+        return metadata.version("randrctl")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _import():
+    """
+    Starts fresh interpreter importing randrctl the same way it's done when randrctl is executed
+    """
+    # make sure this very randrctl is imported, even if it's not installed
+    source_root = os.path.dirname(os.path.dirname(os.path.abspath(randrctl.__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [source_root, env.get('PYTHONPATH')]))
+    subprocess.run([sys.executable, '-c', IMPORT_STATEMENT], env=env, check=True)
+
+
+def run(display: Optional[str], xauthority: Optional[str], iterations: int = DEFAULT_ITERATIONS, config_dirs=None,
+        cache_dir: str = None) -> dict:
+    """
+    Times every phase iterations times. If a phase fails, the rest is skipped
+    :return: dict with environment description and {phase: {min_ms, median_ms, max_ms} or {error}} under 'phases'
+    """
+    phases = dict()
+    result = {
+        'version': _version(),
+        'python': platform.python_version(),
+        'iterations': iterations,
+        'profiles': None,
+        'outputs': None,
+        'phases': phases,
+    }
+
+    def measure(name: str, fn: Callable):
+        times = []
+        value = None
+        try:
+            for _ in range(iterations):
+                start = time.perf_counter()
+                value = fn()
+                times.append(time.perf_counter() - start)
+        except (RandrCtlException, OSError, subprocess.CalledProcessError) as e:
+            logger.error("%s failed: %s", name, e)
+            phases[name] = {'error': str(e).strip()}
+            raise _PhaseFailed(name)
+        phases[name] = {
+            'min_ms': round(min(times) * 1000, 3),
+            'median_ms': round(statistics.median(times) * 1000, 3),
+            'max_ms': round(max(times) * 1000, 3),
+        }
+        return value
+
+    try:
+        measure('import', _import)
+        ctl = measure('config', lambda: context.build(display, xauthority, config_dirs, cache_dir))
+        result['profiles'] = measure('catalogue', lambda: sum(1 for _ in ctl.profile_manager.iter_profiles()))
+
+        # caching and retrying facades of Xrandr are bypassed, so every iteration calls xrandr
+        xrandr = ctl.xrandr
+        measure('xrandr -q', lambda: xrandr._run(xrandr._command((Xrandr.QUERY_KEY,))))
+        lines = measure('xrandr -q --verbose', lambda: xrandr._run(xrandr._command((Xrandr.QUERY_KEY,
+                                                                                     Xrandr.VERBOSE_KEY))))
+        outputs = measure('parse', lambda: xrandr._outputs(parse(lines)))
+        connected = [o for o in outputs if o.display is not None]
+        result['outputs'] = len(connected)
+
+        # profiles are read while matched, the same way auto does it
+        best = measure('match', lambda: ProfileMatcher().find_best(ctl.profile_manager.iter_profiles(), connected))
+        # compose something even if nothing matches
+        target = best or next(ctl.profile_manager.iter_profiles(), None)
+        if target is not None:
+            measure('compose', lambda: xrandr._compose_mode_args(target, outputs))
+    except _PhaseFailed:
+        pass
+
+    return result
+
+
+def format_table(result: dict) -> str:
+    """
+    :return: human readable table of phase timings
+    """
+    width = max(map(len, PHASES))
+    lines = ['{:<{w}} {:>10} {:>10} {:>10}'.format('phase', 'min ms', 'median ms', 'max ms', w=width)]
+    for name in PHASES:
+        phase = result['phases'].get(name)
+        if phase is None:
+            lines.append('{:<{w}} {}'.format(name, 'skipped', w=width))
+        elif 'error' in phase:
+            lines.append('{:<{w}} failed: {}'.format(name, phase['error'], w=width))
+        else:
+            lines.append('{:<{w}} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                name, phase['min_ms'], phase['median_ms'], phase['max_ms'], w=width))
+    lines.append('{} iterations, {} profiles, {} connected outputs, python {}, randrctl {}'.format(
+        result['iterations'], result['profiles'], result['outputs'], result['python'], result['version']))
+    return '\n'.join(lines)
@@ -0,0 +1,196 @@
+import fcntl
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_LOCATION = ".cache/randrctl"
+PROFILE_NAMES = "profiles"
+PROFILE_DIRS = "profile_dirs"
+GENERATION = "generation"
+# generation of profile catalogue the names were read at
+PROFILE_NAMES_GENERATION = "profiles_generation"
+# overrides cache location for every user, e.g. to keep caches of a sandboxed run away from the real ones
+CACHE_DIR_ENV = "RANDRCTL_CACHE_DIR"
+
+
+def default_cache_dir(owner_home: str = None):
+    """
+    :return: directory to keep randrctl caches in
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    if owner_home is None:
+        if os.environ.get('XDG_CACHE_HOME'):
+            return os.path.join(os.environ['XDG_CACHE_HOME'], 'randrctl')
+        owner_home = os.path.expanduser('~')
+    return os.path.join(owner_home, DEFAULT_CACHE_LOCATION)
+
+
+def makedirs(directory: str):
+    """
+    Creates directory along with missing parents. When executed by root (e.g. from udev rule on behalf of display
+    owner), created directories are given to the owner of the closest existing parent, so user's files don't become
+    root-owned
+    """
+    missing = []
+    existing = directory
+    while not os.path.isdir(existing):
+        missing.append(existing)
+        existing = os.path.dirname(existing)
+    os.makedirs(directory, exist_ok=True)
+    if missing and os.geteuid() == 0:
+        st = os.stat(existing)
+        for created in reversed(missing):
+            os.chown(created, st.st_uid, st.st_gid)
+
+
+def _inherit_owner(fd: int, directory: str):
+    """
+    Gives file to the owner of the directory it is created in, when executed by root
+    """
+    if os.geteuid() == 0:
+        st = os.stat(directory)
+        os.fchown(fd, st.st_uid, st.st_gid)
+
+
+def write_atomically(path: str, content: str, durable: bool = False, mode: int = None):
+    """
+    Writes file content via temporary file, so readers never see partially written file.
+    File and missing directories belong to the owner of the parent directory, even if written by root
+    :param durable: fsync file and directory, so neither old nor new content is lost on power failure
+    :param mode: permissions of the file, 0600 if None
+    """
+    directory = os.path.dirname(path)
+    makedirs(directory)
+    # temporary file is hidden, readers of directories skip it
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            _inherit_owner(f.fileno(), directory)
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+            f.write(content)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if durable:
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class CatalogueGeneration:
+    """
+    Counter bumped every time randrctl writes a profile. Caches derived from profiles can be invalidated by comparing
+    a single number instead of checking every profile file. Readers never lock, concurrent writers are serialized
+    """
+
+    def __init__(self, cache_dir: str):
+        self.path = os.path.join(cache_dir, GENERATION)
+
+    def current(self) -> int:
+        """
+        :return: current generation, 0 if profiles were never written
+        """
+        try:
+            with open(self.path) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self) -> int:
+        """
+        :return: new generation
+        """
+        makedirs(os.path.dirname(self.path))
+        with open(self.path + '.lock', 'a') as lock:
+            _inherit_owner(lock.fileno(), os.path.dirname(self.path))
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            generation = self.current() + 1
+            write_atomically(self.path, '%d\n' % generation)
+        logger.debug("Profile catalogue generation is %d", generation)
+        return generation
+
+
+class ProfileNameCache:
+    """
+    Plain-text list of profile names, one per line. Shell completion reads it directly, without starting python.
+    Along with the names, the list of profile directories and the catalogue generation are stored. Cache is stale if
+    profiles were written by randrctl since (generation differs), or if any of the directories is newer than the list
+    of names (profiles created or removed by hand).
+    """
+
+    def __init__(self, cache_dir: str, profile_dirs: list, generation: CatalogueGeneration = None):
+        self.profile_dirs = profile_dirs
+        self.generation = generation
+        self.names_file = os.path.join(cache_dir, PROFILE_NAMES)
+        self.dirs_file = os.path.join(cache_dir, PROFILE_DIRS)
+        self.generation_file = os.path.join(cache_dir, PROFILE_NAMES_GENERATION)
+
+    def is_fresh(self) -> bool:
+        try:
+            if self.generation is not None:
+                # writes by randrctl are detected without stat'ing directories, regardless of mtime granularity
+                with open(self.generation_file) as f:
+                    if int(f.read()) != self.generation.current():
+                        return False
+            cached_at = os.stat(self.names_file).st_mtime_ns
+            with open(self.dirs_file) as f:
+                cached_dirs = f.read().splitlines()
+        except (OSError, ValueError):
+            return False
+
+        if cached_dirs != self.profile_dirs:
+            return False
+
+        for profile_dir in self.profile_dirs:
+            try:
+                if os.stat(profile_dir).st_mtime_ns > cached_at:
+                    return False
+            except FileNotFoundError:
+                pass
+        return True
+
+    def names(self) -> list:
+        """
+        :return: sorted list of profile names, cache is refreshed if stale
+        """
+        if self.is_fresh():
+            try:
+                with open(self.names_file) as f:
+                    return f.read().splitlines()
+            except OSError:
+                pass
+        return self.update()
+
+    def update(self) -> list:
+        """
+        Rescans profile directories and rewrites the cache
+        :return: sorted list of profile names
+        """
+        # read before scanning, profiles written meanwhile make the cache stale
+        generation = self.generation.current() if self.generation is not None else None
+        names = set()
+        for profile_dir in self.profile_dirs:
+            if os.path.isdir(profile_dir):
+                names.update(entry for entry in os.listdir(profile_dir)
+                             if not entry.startswith('.') and os.path.isfile(os.path.join(profile_dir, entry)))
+        names = sorted(names)
+
+        try:
+            write_atomically(self.dirs_file, ''.join(d + '\n' for d in self.profile_dirs))
+            if generation is not None:
+                write_atomically(self.generation_file, '%d\n' % generation)
+            # names are written last, their mtime is compared with mtimes of directories
+            write_atomically(self.names_file, ''.join(n + '\n' for n in names))
+        except OSError as e:
+            logger.debug("Cannot update profile names cache: %s", e)
+        return names
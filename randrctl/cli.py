@@ -1,34 +1,40 @@
-import pwd
-import sys
-from os import path
-
-import argcomplete
 import argparse
-import glob
 import logging
 import os
-import pkg_resources
-import re
-import shutil
-import subprocess
-import textwrap
-
-from randrctl import context, XAUTHORITY, DISPLAY
-from randrctl.ctl import RandrCtl
+import sys
+
+from randrctl import XAUTHORITY, DISPLAY, trace
 from randrctl.exception import RandrCtlException
 
+# Modules that are expensive to import (yaml, argcomplete, subprocess, etc.) are imported lazily, only by the code paths
+# that need them. randrctl is executed on every hotplug, so startup time matters.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from randrctl.ctl import RandrCtl
+
 AUTO = 'auto'
+BENCH = 'bench'
+CHECK = 'check'
 DUMP = 'dump'
 LIST = 'list'
 SHOW = 'show'
+STATUS = 'status'
 SWITCH_TO = 'switch-to'
 VERSION = 'version'
+WATCH = 'watch'
 
 SETUP = 'setup'
 SETUP_COMPLETION = 'completion'
 SETUP_UDEV = 'udev'
 SETUP_CONFIG = 'config'
 
+COMMANDS = {AUTO, BENCH, CHECK, DUMP, LIST, SHOW, STATUS, SWITCH_TO, VERSION, WATCH, SETUP}
+STANDALONE_COMMANDS = {BENCH, STATUS, VERSION, SETUP}
+# commands accepting profile name
+PROFILE_COMMANDS = {CHECK, DUMP, SHOW, SWITCH_TO}
+
+COMPLETION_SHELLS = ['bash', 'zsh', 'fish']
+
 
 logger = logging.getLogger('randrctl')
 
@@ -36,16 +42,16 @@ logger = logging.getLogger('randrctl')
 # CLI parser
 
 
-def potential_profiles(config_dirs: list):
-    profile_dirs = map(lambda config_dir: os.path.join(config_dir, context.PROFILE_DIR_NAME), config_dirs)
-    existing = filter(lambda profile_dir: os.path.isdir(profile_dir), profile_dirs)
-    listings = map(lambda profile_dir: os.listdir(profile_dir), existing)
-    flat_listing = [item for sublist in listings for item in sublist]
-    return sorted(flat_listing)
+def complete_profiles(prefix, parsed_args, **kwargs):
+    from randrctl import context
+    return (profile for profile in context.profile_name_cache().names() if profile.startswith(prefix))
 
 
-def complete_profiles(prefix, parsed_args, **kwargs):
-    return (profile for profile in potential_profiles(context.default_config_dirs()) if profile.startswith(prefix))
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 def args_parser():
@@ -54,6 +60,9 @@ def args_parser():
     parser.add_argument('-d', help='allow X display detection', default=False, action='store_const', const=True,
                         dest='detect_display')
 
+    parser.add_argument('-a', '--all-displays', help='run command against every X display concurrently',
+                        default=False, action='store_const', const=True, dest='all_displays')
+
     parser.add_argument('-x', help='be verbose', default=False, action='store_const', const=True,
                         dest='debug')
 
@@ -66,6 +75,8 @@ def args_parser():
 
     # switch-to
     command_switch_to = commands_parsers.add_parser(SWITCH_TO, help='switch to profile')
+    command_switch_to.add_argument('--check', action='store_const', const=True, default=False,
+                                   help='refuse profile if connected displays can\'t apply it', dest='check')
     command_switch_to.add_argument('profile_name',
                                    help='name of the profile to switch to').completer = complete_profiles
 
@@ -83,6 +94,8 @@ def args_parser():
                               help='long listing', dest='long_listing')
     group.add_argument('-s', action='store_const', const=True, default=False,
                               help='scored listing', dest='scored_listing')
+    command_list.add_argument('-f', '--format', choices=['text', 'jsonl'], default='text',
+                              help='output format, jsonl prints JSON object per profile as soon as it is read')
 
     # dump
     command_dump = commands_parsers.add_parser(DUMP,
@@ -102,6 +115,49 @@ def args_parser():
     # auto
     command_auto = commands_parsers.add_parser(AUTO,
                                                help='automatically switch to the best matching profile')
+    command_auto.add_argument('--check', action='store_const', const=True, default=False,
+                              help='skip profiles connected displays can\'t apply', dest='check')
+
+    # watch
+    command_watch = commands_parsers.add_parser(WATCH, help='switch automatically whenever displays are connected or '
+                                                            'disconnected, without udev',
+                                                description='Subscribes to RandR events of X server and switches to '
+                                                            'the best matching profile on start and whenever outputs '
+                                                            'are connected or disconnected. Runs in foreground until '
+                                                            'X server exits.')
+    command_watch.add_argument('--check', action='store_const', const=True, default=False,
+                               help='skip profiles connected displays can\'t apply', dest='check')
+    command_watch.add_argument('--debounce', type=float, default=0.5, metavar='SECONDS', dest='debounce',
+                               help='wait until outputs don\'t change for this long before switching')
+
+    # check
+    command_check = commands_parsers.add_parser(CHECK, help='check that profiles can be applied',
+                                                description='Checks that outputs, modes, rates and CRTCs requested by '
+                                                            'profiles are supported by connected displays. Exits '
+                                                            'with 1 if any profile can\'t be applied.')
+    command_check.add_argument('-i', '--input', default=None, dest='recorded', metavar='FILE',
+                               help='check against output of "xrandr -q --verbose" saved to FILE instead of '
+                                    'connected displays')
+    command_check.add_argument('profile_names', help='names of profiles to check. Check all if omitted',
+                               nargs='*').completer = complete_profiles
+
+    # bench
+    command_bench = commands_parsers.add_parser(BENCH, help='measure time spent in every phase of switching',
+                                                description='Times import, config and profile loading, xrandr '
+                                                            'queries, parsing, matching and composing of xrandr '
+                                                            'arguments on this machine. Nothing is applied. Prints a '
+                                                            'table and JSON to attach to bug reports.')
+    # default is resolved by cmd_bench, importing bench here would slow down every command
+    command_bench.add_argument('-n', '--iterations', type=positive_int, default=None, dest='iterations',
+                               help='number of times every phase is executed')
+
+    # status
+    command_status = commands_parsers.add_parser(STATUS, help='show last applied profile without querying X server',
+                                                 description='Prints name of the last successfully applied profile. '
+                                                             '"(outdated)" is appended if displays were connected or '
+                                                             'disconnected since.')
+    command_status.add_argument('-j', '--json', action='store_const', const=True, default=False,
+                                help='print state as JSON', dest='json')
 
     # version
     command_version = commands_parsers.add_parser(VERSION, help='print version information and exit')
@@ -118,23 +174,33 @@ def args_parser():
         description='udev rule is required to notify randrctl about displays being attached or detached, so it can'
                     ' react by applying appropriate profile.'
     )
-    command_setup_tasks.add_parser(
+    command_setup_completion = command_setup_tasks.add_parser(
         SETUP_COMPLETION, formatter_class=argparse.RawDescriptionHelpFormatter,
-        help='setup bash completion',
+        help='setup shell completion',
         usage='randrctl setup completion > /usr/share/bash-completion/completions/randrctl',
-        description=textwrap.dedent('''\
-        or:
-        randrctl setup completion > ~/.bashrc_randrctl 
-        echo "source ~/.bashrc_randrctl" >> ~/.bashrc
-        ''')
+        description='or:\n'
+                    'randrctl setup completion > ~/.bashrc_randrctl\n'
+                    'echo "source ~/.bashrc_randrctl" >> ~/.bashrc\n'
+                    '\n'
+                    'randrctl setup completion -s zsh > ~/.zshrc_randrctl\n'
+                    'echo "source ~/.zshrc_randrctl" >> ~/.zshrc\n'
+                    '\n'
+                    'randrctl setup completion -s fish > ~/.config/fish/completions/randrctl.fish\n'
+                    '\n'
+                    'Profile names are completed from the cache without starting randrctl.'
     )
+    command_setup_completion.add_argument('-s', '--shell', choices=COMPLETION_SHELLS, default='bash',
+                                          help='shell to generate completion for', dest='shell')
     command_setup_tasks.add_parser(
         SETUP_CONFIG,
         help="create exemplary config.yaml",
         usage="randrctl setup config > ${XDG_CONFIG_HOME:-$HOME/.config}/randrctl/config.yaml",
     )
 
-    argcomplete.autocomplete(parser)
+    if '_ARGCOMPLETE' in os.environ:
+        # we're invoked by the shell to complete command line
+        import argcomplete
+        argcomplete.autocomplete(parser)
 
     return parser
 
@@ -142,22 +208,46 @@ def args_parser():
 # Commands
 
 
-def cmd_list(randrctl: RandrCtl, args: argparse.Namespace):
+def cmd_list(randrctl: 'RandrCtl', args: argparse.Namespace):
+    jsonl = args.format == 'jsonl'
     if args.long_listing:
-        randrctl.list_all_long()
+        randrctl.list_all_long(jsonl=jsonl)
     elif args.scored_listing:
-        randrctl.list_all_scored()
+        randrctl.list_all_scored(jsonl=jsonl)
     else:
-        randrctl.list_all()
+        randrctl.list_all(jsonl=jsonl)
     return 0
 
 
-def cmd_switch_to(randrctl: RandrCtl, args: argparse.Namespace):
-    randrctl.switch_to(args.profile_name)
+def cmd_switch_to(randrctl: 'RandrCtl', args: argparse.Namespace):
+    randrctl.switch_to(args.profile_name, check=args.check)
     return 0
 
 
-def cmd_show(randrctl: RandrCtl, args: argparse.Namespace):
+def cmd_watch(randrctl: 'RandrCtl', args: argparse.Namespace):
+    from randrctl import context, hotplug
+    from randrctl.randr import RandrEvents
+
+    display = randrctl.xrandr.env.get(DISPLAY)
+    xauthority = randrctl.xrandr.env.get(XAUTHORITY)
+    events = RandrEvents(display, xauthority)
+    catalogue = context.watch_catalogue(randrctl, display, xauthority)
+    try:
+        hotplug.watch(randrctl, events, catalogue, args.debounce, args.check)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        events.close()
+        if catalogue is not None:
+            catalogue.close()
+    return 0
+
+
+def cmd_check(randrctl: 'RandrCtl', args: argparse.Namespace):
+    return 1 if randrctl.check(args.profile_names, args.recorded) else 0
+
+
+def cmd_show(randrctl: 'RandrCtl', args: argparse.Namespace):
     if args.profile_name:
         randrctl.print(args.profile_name, json_compatible=args.json)
     else:
@@ -165,7 +255,7 @@ def cmd_show(randrctl: RandrCtl, args: argparse.Namespace):
     return 0
 
 
-def cmd_dump(randrctl: RandrCtl, args: argparse.Namespace):
+def cmd_dump(randrctl: 'RandrCtl', args: argparse.Namespace):
     randrctl.dump_current(name=args.profile_name, to_file=True,
                           include_supports_rule=args.match_supports,
                           include_preferred_rule=args.match_preferred,
@@ -178,17 +268,47 @@ def cmd_dump(randrctl: RandrCtl, args: argparse.Namespace):
     return 0
 
 
-def cmd_auto(randrctl: RandrCtl, args: argparse.Namespace):
-    randrctl.switch_auto()
+def cmd_auto(randrctl: 'RandrCtl', args: argparse.Namespace):
+    randrctl.switch_auto(check=args.check)
     return 0
 
 
-def cmd_version(randrctl: RandrCtl, args: argparse.Namespace):
-    print(pkg_resources.get_distribution("randrctl").version)
+def cmd_bench(randrctl: 'RandrCtl', args: argparse.Namespace):
+    import json
+    from randrctl import bench
+
+    iterations = bench.DEFAULT_ITERATIONS if args.iterations is None else args.iterations
+    result = bench.run(getenv(DISPLAY), getenv(XAUTHORITY), iterations)
+    print(bench.format_table(result))
+    print()
+    print(json.dumps(result))
+    return 1 if any('error' in phase for phase in result['phases'].values()) else 0
+
+
+def cmd_status(randrctl: 'RandrCtl', args: argparse.Namespace):
+    from randrctl.cache import default_cache_dir
+    from randrctl.state import AppliedState
+
+    state = AppliedState(default_cache_dir(), os.environ.get(DISPLAY)).status()
+    if args.json:
+        import json
+        print(json.dumps(state))
+    elif state is not None:
+        print(state['profile'] + (' (outdated)' if state['stale'] else ''))
+    return 0 if state is not None else 1
+
+
+def cmd_version(randrctl: 'RandrCtl', args: argparse.Namespace):
+    from importlib import metadata
+    try:
+        print(metadata.version("randrctl"))
+    except metadata.PackageNotFoundError:
+        logger.error("randrctl is not installed, version is unknown")
+        return 1
     return 0
 
 
-def cmd_setup(randrctl: RandrCtl, args: argparse.Namespace):
+def cmd_setup(randrctl: 'RandrCtl', args: argparse.Namespace):
     if args.task is None:
         sys.stderr.write(f"Available subcommands: {SETUP_COMPLETION}, {SETUP_CONFIG}, {SETUP_UDEV}\n")
         return 1
@@ -207,40 +327,87 @@ def cmd_setup(randrctl: RandrCtl, args: argparse.Namespace):
 
 
 def cmd_setup_completion(args: argparse.Namespace):
-    print(argcomplete.shellcode('randrctl', True, 'bash', None))
+    from randrctl.cache import GENERATION, PROFILE_NAMES, PROFILE_NAMES_GENERATION, PROFILE_DIRS
+
+    # profile names are completed by the script itself from the cache, the rest is delegated to argcomplete
+    if args.shell == 'zsh':
+        # zsh executes the bash script through bashcompinit
+        script = read_resource('setup/completion.zsh') + read_resource('setup/completion.bash')
+    else:
+        script = read_resource(f'setup/completion.{args.shell}')
+    script = script.replace('@COMMANDS@', ' '.join(sorted(COMMANDS)))
+    script = script.replace('@PROFILE_COMMANDS@', ' '.join(sorted(PROFILE_COMMANDS)))
+    script = script.replace('@PROFILE_CACHE@', PROFILE_NAMES)
+    script = script.replace('@PROFILE_DIRS_CACHE@', PROFILE_DIRS)
+    script = script.replace('@PROFILE_GENERATION_CACHE@', PROFILE_NAMES_GENERATION)
+    script = script.replace('@GENERATION@', GENERATION)
+
+    if args.shell in ('bash', 'zsh'):
+        try:
+            import argcomplete
+            fallback = argcomplete.shellcode(['randrctl'], True, 'bash', None)
+        except ImportError:
+            logger.warning("argcomplete is not installed, only profile names will be completed")
+            fallback = ''
+        script = script.replace('@ARGCOMPLETE@', fallback)
+
+    sys.stdout.write(script)
     return 0
 
 
 def cmd_setup_config(args: argparse.Namespace):
-    with (open(pkg_resources.resource_filename('randrctl', 'setup/config.yaml'), 'r')) as f:
-        shutil.copyfileobj(f, sys.stdout)
+    print_resource('setup/config.yaml')
     return 0
 
 
 def cmd_setup_udev(args: argparse.Namespace):
-    with (open(pkg_resources.resource_filename('randrctl', 'setup/99-randrctl.rules'), 'r')) as f:
-        shutil.copyfileobj(f, sys.stdout)
+    print_resource('setup/99-randrctl.rules')
     return 0
 
 
-# Main logic
+def print_resource(name: str):
+    sys.stdout.write(read_resource(name))
+
 
+def read_resource(name: str):
+    from importlib import resources
+    return resources.files('randrctl').joinpath(name).read_text()
 
-def find_display_owner(display: str):
-    regex = f"\({display}[.\d]?\)"
-    matcher = re.compile(regex)
-    # run /usr/bin/who. It output current display and screen as (:DISPLAY.SCREEN)
-    # TODO is there a better way to do this in python?
-    for line in subprocess.run('/usr/bin/who', stdout=subprocess.PIPE).stdout.decode('utf-8').splitlines():
-        if matcher.search(line):
-            username = line[0:line.find(' ')]
-            return pwd.getpwnam(username)
+
+# Main logic
 
 
-def x_displays():
-    # Find all local displays by inspecting X sockets. Return as :0, :1, etc.
-    # https://stackoverflow.com/questions/11367354/obtaining-list-of-all-xorg-displays
-    return list(map(lambda socket: ':' + socket[16:], glob.glob('/tmp/.X11-unix/X*')))
+def run_on_displays(cmd, args: argparse.Namespace, displays: list, owners: dict) -> dict:
+    """
+    Runs command against every display concurrently, one worker per display. Every display is configured according
+    to its owner's configuration.
+    :param owners: {display: pwd.struct_passwd}
+    :return: {display: (exit_code, error message or None)}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from randrctl import context
+    from randrctl.cache import default_cache_dir
+
+    def run(display: str):
+        owner = owners.get(display)
+        if owner is None:
+            return 1, "owner is unknown"
+        logger.debug("%s owner is '%s' with HOME '%s'", display, owner.pw_name, owner.pw_dir)
+        try:
+            randrctl = context.build(
+                display=display,
+                xauthority=os.path.join(owner.pw_dir, ".Xauthority"),
+                config_dirs=context.default_config_dirs(owner_home=owner.pw_dir),
+                cache_dir=default_cache_dir(owner_home=owner.pw_dir),
+            )
+            return cmd(randrctl, args), None
+        except Exception as e:
+            # failure on one display must not affect the others
+            logger.error("%s: %s", display, e)
+            return 1, str(e)
+
+    with ThreadPoolExecutor(max_workers=len(displays)) as executor:
+        return dict(zip(displays, executor.map(run, displays)))
 
 
 def configure_logging(args: argparse.Namespace):
@@ -261,18 +428,23 @@ def getenv(variable: str):
 
 
 def main():
-    parser = args_parser()
-    args = parser.parse_args(sys.argv[1:])
+    with trace.span('parse arguments'):
+        parser = args_parser()
+        args = parser.parse_args(sys.argv[1:])
 
     configure_logging(args)
 
     commands = {
         AUTO: cmd_auto,
+        BENCH: cmd_bench,
+        CHECK: cmd_check,
         DUMP: cmd_dump,
         LIST: cmd_list,
         SHOW: cmd_show,
+        STATUS: cmd_status,
         SWITCH_TO: cmd_switch_to,
         VERSION: cmd_version,
+        WATCH: cmd_watch,
         SETUP: cmd_setup,
     }
     cmd = commands.get(args.command)
@@ -280,23 +452,52 @@ def main():
         parser.print_help()
         return 1
 
+    with trace.span(args.command):
+        return run(cmd, args)
+
+
+def run(cmd, args: argparse.Namespace):
+    if args.command in STANDALONE_COMMANDS:
+        # these don't need X display nor configuration, or set them up on their own
+        return cmd(None, args)
+
     display = getenv(DISPLAY)
     xauthority = getenv(XAUTHORITY)
 
+    from randrctl import context
+    from randrctl.cache import default_cache_dir
+
+    if args.all_displays:
+        from randrctl.displays import DisplayOwners, x_displays
+        displays = x_displays()
+        if not displays:
+            logger.error("No X displays found")
+            return 1
+        results = run_on_displays(cmd, args, displays, DisplayOwners().owners(displays))
+        for display, (result, error) in results.items():
+            sys.stderr.write(f"{display}\t{'ok' if result == 0 else 'failed'}{': ' + error if error else ''}\n")
+        return 0 if all(result == 0 for result, _ in results.values()) else 1
+
     if not display and args.detect_display:
         # likely we are executed from UDEV rule
+        from randrctl.displays import DisplayOwners, x_displays
         displays = x_displays()
+        owners = DisplayOwners().owners(displays)
         for display in displays:
             logger.debug("Trying DISPLAY %s", display)
-            owner = find_display_owner(display)
+            owner = owners.get(display)
+            if owner is None:
+                logger.debug("%s has no owner", display)
+                continue
             logger.debug("%s owner is '%s' with HOME '%s'", display, owner.pw_name, owner.pw_dir)
             try:
                 os.environ[DISPLAY] = display
-                os.environ[XAUTHORITY] = path.join(owner.pw_dir, ".Xauthority")
+                os.environ[XAUTHORITY] = os.path.join(owner.pw_dir, ".Xauthority")
                 randrctl = context.build(
                     display=display,
                     xauthority=xauthority,
                     config_dirs=context.default_config_dirs(owner_home=owner.pw_dir),
+                    cache_dir=default_cache_dir(owner_home=owner.pw_dir),
                 )
                 result = cmd(randrctl, args)
                 # exit as soon as first execution succeeds
@@ -6,9 +6,14 @@ import yaml
 
 from yaml import load, YAMLError
 
-from randrctl.ctl import Hooks, RandrCtl
-from randrctl.profile import ProfileManager
-from randrctl.xrandr import Xrandr
+from randrctl import DISPLAY, XAUTHORITY, trace
+from randrctl.cache import CatalogueGeneration, ProfileNameCache, default_cache_dir
+from randrctl.ctl import DEFAULT_HOOK_TIMEOUT, Hooks, RandrCtl
+from randrctl.metrics import Metrics, TextfileMetrics
+from randrctl.profile import ProfileIndex, ProfileManager
+from randrctl.state import AppliedState
+from randrctl.xrandr import DEFAULT_XRANDR_BACKOFF, DEFAULT_XRANDR_RETRIES, DEFAULT_XRANDR_TIMEOUT, Xrandr, \
+    XrandrPolicy
 
 logger = logging.getLogger(__name__)
 
@@ -57,37 +62,131 @@ def configs(config_dirs: list):
             with open(config_file, 'r') as stream:
                 try:
                     logger.debug("reading configuration from %s", config_file)
-                    cfg = load(stream, Loader=yaml.FullLoader)
+                    with trace.span('load config', path=config_file):
+                        cfg = load(stream, Loader=yaml.FullLoader)
                     if cfg:
                         yield (randrctl_home, cfg)
                 except YAMLError as e:
                     logger.warning("error reading configuration file %s", config_file)
 
 
-def build(display: str, xauthority: str = None, config_dirs=None):
+def profile_dirs(config_dirs: list):
     """
-    Builds a RandrCtl instance and all its dependencies given a list of config directories
-    :param: display - display
-    :return: new ready to use RandrCtl instance
+    :return: list of all potential profile directories, existing or not
+    """
+    return [os.path.join(config_dir, PROFILE_DIR_NAME) for config_dir in config_dirs]
+
+
+def profile_name_cache(config_dirs=None, cache_dir: str = None):
+    """
+    :return: cache of profile names across all config directories
+    """
+    if config_dirs is None:
+        config_dirs = default_config_dirs()
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    return ProfileNameCache(cache_dir, profile_dirs(config_dirs), CatalogueGeneration(cache_dir))
+
+
+def _components(display: str, xauthority: str, config_dirs, cache_dir: str):
+    """
+    Reads configuration and returns a tuple (profile_manager, hooks_args, metrics, state, xrandr_policy) shared by
+    synchronous and asynchronous facades
     """
     if config_dirs is None:
         config_dirs = default_config_dirs()
 
     (primary_config_dir, config) = next(configs(config_dirs), (config_dirs[0], dict()))
 
-    prior_switch = config.get('hooks', dict()).get('prior_switch', None)
-    post_switch = config.get('hooks', dict()).get('post_switch', None)
-    post_fail = config.get('hooks', dict()).get('post_fail', None)
-    hooks = Hooks(prior_switch, post_switch, post_fail)
+    hooks_config = config.get('hooks', dict())
+    prior_switch = hooks_config.get('prior_switch', None)
+    post_switch = hooks_config.get('post_switch', None)
+    post_fail = hooks_config.get('post_fail', None)
+    timeout = hooks_config.get('timeout', DEFAULT_HOOK_TIMEOUT)
+    hooks_env = dict()
+    if display:
+        hooks_env[DISPLAY] = display
+    if xauthority:
+        hooks_env[XAUTHORITY] = xauthority
+
+    metrics = Metrics()
+    metrics_textfile = config.get('metrics', dict()).get('textfile')
+    if metrics_textfile:
+        metrics = TextfileMetrics(metrics_textfile)
 
     profile_read_locations = [os.path.join(primary_config_dir, PROFILE_DIR_NAME)]
     profile_write_location = os.path.join(primary_config_dir, PROFILE_DIR_NAME)
-    profile_manager = ProfileManager(profile_read_locations, profile_write_location)
+    cache_dir = cache_dir or default_cache_dir()
+    name_cache = profile_name_cache(config_dirs, cache_dir)
+    profile_manager = ProfileManager(profile_read_locations, profile_write_location, name_cache, name_cache.generation)
 
-    xrandr = Xrandr(display, xauthority)
+    state = AppliedState(cache_dir, display)
 
-    return RandrCtl(profile_manager, xrandr, hooks)
+    xrandr_config = config.get('xrandr', dict())
+    xrandr_policy = XrandrPolicy(xrandr_config.get('timeout', DEFAULT_XRANDR_TIMEOUT),
+                                 xrandr_config.get('retries', DEFAULT_XRANDR_RETRIES),
+                                 xrandr_config.get('backoff', DEFAULT_XRANDR_BACKOFF),
+                                 xrandr_config.get('retry_on', None))
 
+    return (profile_manager, (prior_switch, post_switch, post_fail, timeout, hooks_env, metrics), metrics, state,
+            xrandr_policy)
 
 
+def build(display: str, xauthority: str = None, config_dirs=None, cache_dir: str = None):
+    """
+    Builds a RandrCtl instance and all its dependencies given a list of config directories
+    :param: display - display
+    :return: new ready to use RandrCtl instance
+    """
+    with trace.span('build context'):
+        profile_manager, hooks_args, metrics, state, xrandr_policy = _components(display, xauthority, config_dirs,
+                                                                                 cache_dir)
+        hooks = Hooks(*hooks_args)
+        xrandr = Xrandr(display, xauthority, xrandr_policy)
+
+    return RandrCtl(profile_manager, xrandr, hooks, metrics, state)
+
+
+def build_async(display: str, xauthority: str = None, config_dirs=None, cache_dir: str = None,
+                xrandr_timeout: float = None, executor=None):
+    """
+    Builds an AsyncRandrCtl instance and all its dependencies given a list of config directories
+    :param: display - display
+    :param: xrandr_timeout - seconds to wait for a single xrandr call, overrides xrandr.timeout of config
+    :param: executor - executor for blocking profile I/O, default executor of the loop if None
+    :return: new ready to use AsyncRandrCtl instance
+    """
+    from randrctl.aio import AsyncHooks, AsyncRandrCtl, AsyncXrandr
+
+    profile_manager, hooks_args, metrics, state, xrandr_policy = _components(display, xauthority, config_dirs,
+                                                                             cache_dir)
+    hooks = AsyncHooks(*hooks_args)
+    xrandr = AsyncXrandr(display, xauthority, xrandr_timeout, xrandr_policy)
+
+    return AsyncRandrCtl(profile_manager, xrandr, hooks, executor, metrics, state)
+
+
+def watch_catalogue(randrctl: RandrCtl, display: str, xauthority: str = None, config_dirs=None, cache_dir: str = None):
+    """
+    Makes randrctl use in-memory profile index, which is kept up to date by watching profile and config directories.
+    Hooks and metrics are rebuilt when config changes. Intended for long-running processes
+    :return: CatalogueWatcher to be polled for changes, None if directories can't be watched
+    """
+    from randrctl.inotify import CatalogueWatcher
+
+    if config_dirs is None:
+        config_dirs = default_config_dirs()
 
+    def reload():
+        _, hooks_args, metrics, _, _ = _components(display, xauthority, config_dirs, cache_dir)
+        randrctl.hooks = Hooks(*hooks_args)
+        randrctl.metrics = metrics
+
+    index = ProfileIndex(randrctl.profile_manager)
+    try:
+        watcher = CatalogueWatcher(index, config_dirs, reload)
+    except OSError as e:
+        logger.warning("Cannot watch profiles for changes: %s", e)
+        return None
+    randrctl.profile_manager.index = index
+    return watcher
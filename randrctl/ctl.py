@@ -1,47 +1,206 @@
+import json
 import logging
 import os
+import signal
 import subprocess
+import time
+from typing import List, Optional
 
-from randrctl.model import Profile
-from randrctl.profile import ProfileManager, ProfileMatcher
+from randrctl import trace
+from randrctl.exception import ImpossibleProfileException, ValidationException, XrandrException, \
+    XrandrTimeoutException
+from randrctl.metrics import Metrics, APPLY_DURATION, AUTO, HOOK_DURATION, HOOK_FAILURES, LAST_SWITCH, \
+    MATCH_DURATION, READ_PROFILES_DURATION, ROLLBACK_DURATION, ROLLBACKS, SWITCHES, TimedIterator
+from randrctl.model import Profile, PRIOR_SWITCH, POST_SWITCH, POST_FAIL
+from randrctl.profile import ProfileChecker, ProfileManager, ProfileMatcher
+from randrctl.state import AppliedState
 from randrctl.xrandr import Xrandr
 
 logger = logging.getLogger(__name__)
 
 
+DEFAULT_HOOK_TIMEOUT = 30
+# name of in-memory profile capturing layout preceding switch
+ROLLBACK_PROFILE = 'rollback'
+
+
+class Hook:
+    """
+    Single hook command. A string is executed by the shell, a list is executed directly as argv without the shell
+    """
+
+    def __init__(self, command, timeout: Optional[float] = DEFAULT_HOOK_TIMEOUT, wait: bool = True):
+        self.command = command
+        self.timeout = timeout
+        self.wait = wait
+
+    @property
+    def shell(self):
+        return isinstance(self.command, str)
+
+    @staticmethod
+    def from_config(entry, timeout: Optional[float] = DEFAULT_HOOK_TIMEOUT) -> List['Hook']:
+        """
+        Parses hook definition from config. Definition is either a shell command string, a dict with 'command',
+        'timeout' and 'wait' keys, or a list of those. Within a list, a nested list is treated as argv
+        :return: list of hooks, empty if nothing is defined
+        """
+        if entry is None:
+            return []
+        if isinstance(entry, str):
+            return [Hook(entry, timeout)] if entry.strip() else []
+        if isinstance(entry, dict):
+            command = entry.get('command')
+            if not command:
+                return []
+            return [Hook(command if isinstance(command, str) else list(map(str, command)),
+                         entry.get('timeout', timeout), entry.get('wait', True))]
+        if isinstance(entry, list):
+            hooks = []
+            for e in entry:
+                if isinstance(e, list):
+                    # nested list is an argv
+                    hooks.append(Hook(list(map(str, e)), timeout))
+                else:
+                    hooks.extend(Hook.from_config(e, timeout))
+            return hooks
+        raise ValidationException("Invalid hook definition {}".format(entry))
+
+    def __repr__(self):
+        return str(self.command)
+
+
 class Hooks:
     """
-    Intercepts calls to xrandr to support prior-, post-switch and post-fail hooks
+    Intercepts calls to xrandr to support prior-, post-switch and post-fail hooks.
+    All hooks of a stage are started concurrently. Hooks with wait=True are awaited (and killed when they exceed their
+    timeout), the others are left running in background and don't delay the return
     """
 
-    def __init__(self, prior_switch: str, post_switch: str, post_fail: str):
-        self._prior_switch = prior_switch
-        self._post_switch = post_switch
-        self._post_fail = post_fail
+    def __init__(self, prior_switch=None, post_switch=None, post_fail=None,
+                 timeout: Optional[float] = DEFAULT_HOOK_TIMEOUT, env: dict = None, metrics: Metrics = None):
+        """
+        :param env: variables to set for hooks on top of current environment (e.g. DISPLAY of the hooks' X server)
+        """
+        self._timeout = timeout
+        self._env_overrides = env or dict()
+        self.metrics = metrics or Metrics()
+        self._global = {
+            PRIOR_SWITCH: Hook.from_config(prior_switch, timeout),
+            POST_SWITCH: Hook.from_config(post_switch, timeout),
+            POST_FAIL: Hook.from_config(post_fail, timeout),
+        }
 
     def prior_switch(self, p: Profile):
-        if self._prior_switch:
-            self._hook(self._prior_switch, p)
+        self._run(PRIOR_SWITCH, self._hooks(PRIOR_SWITCH, p), p)
 
     def post_switch(self, p: Profile):
-        if self._post_switch:
-            self._hook(self._post_switch, p)
+        self._run(POST_SWITCH, self._hooks(POST_SWITCH, p), p)
 
     def post_fail(self, p: Profile, err: str):
-        if self._post_fail:
-            self._hook(self._post_fail, p, err)
+        self._run(POST_FAIL, self._hooks(POST_FAIL, p), p, err)
+
+    def _hooks(self, stage: str, p: Profile) -> List[Hook]:
+        """
+        Global hooks of the stage followed by the hooks defined in the profile itself
+        """
+        hooks = self._global[stage]
+        if p.hooks and p.hooks.get(stage):
+            try:
+                hooks = hooks + Hook.from_config(p.hooks[stage], self._timeout)
+            except ValidationException as e:
+                logger.warning("Ignoring %s hooks of profile %s: %s", stage, p.name, e)
+        return hooks
+
+    def _env(self, p: Profile, err: str = None):
+        env = os.environ.copy()
+        env.update(self._env_overrides)
+        env["randr_profile"] = p.name
+        if p.outputs:
+            env["randr_outputs"] = " ".join(p.outputs)
+        if p.primary:
+            env["randr_primary"] = p.primary
+        if err:
+            env["randr_error"] = err
+        return env
+
+    def _context(self, p: Profile, err: str = None) -> bytes:
+        """
+        Structured context passed to hooks via stdin as JSON
+        """
+        context = {
+            'profile': p.name,
+            'primary': p.primary,
+            'outputs': dict(map(lambda kv: (kv[0], kv[1].to_dict()), p.outputs.items())) if p.outputs else {},
+        }
+        if err:
+            context['error'] = err
+        return json.dumps(context).encode()
+
+    def _run(self, stage: str, hooks: List[Hook], p: Profile, err: str = None):
+        if not hooks:
+            return
+        with self.metrics.time(HOOK_DURATION, stage=stage):
+            failures = self._run_concurrently(hooks, p, err)
+        if failures:
+            self.metrics.inc(HOOK_FAILURES, failures, stage=stage)
 
-    def _hook(self, hook: str, p: Profile, err: str = None):
-        if hook is not None and len(hook.strip()) > 0:
+    def _run_concurrently(self, hooks: List[Hook], p: Profile, err: str = None) -> int:
+        """
+        :return: number of hooks that failed
+        """
+        env = self._env(p, err)
+        context = self._context(p, err)
+        failures = 0
+        started = []
+        for hook in hooks:
+            start = time.perf_counter_ns()
+            process = self._start(hook, env, context)
+            if process is None:
+                failures += 1
+            elif hook.wait:
+                started.append((hook, process, start))
+            else:
+                trace.record('hook', start, time.perf_counter_ns(), command=str(hook), background=True)
+
+        for hook, process, start in started:
+            timeout = None if hook.timeout is None else max(0, hook.timeout - (time.perf_counter_ns() - start) / 1e9)
             try:
-                env = os.environ.copy()
-                env["randr_profile"] = p.name
-                if err:
-                    env["randr_error"] = err
-                logger.debug("Calling '%s'", hook)
-                subprocess.run(hook, env=env, shell=True)
-            except Exception as e:
-                logger.warning("Error while executing hook '%s': %s", hook, str(e))
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning("Hook '%s' timed out after %ss, killing it", hook, hook.timeout)
+                self._kill(process)
+            if process.returncode != 0:
+                failures += 1
+            # hooks run concurrently, so every hook gets its own track named after the process
+            trace.name_thread(process.pid, str(hook))
+            trace.record('hook', start, time.perf_counter_ns(), tid=process.pid, command=str(hook),
+                         returncode=process.returncode)
+        return failures
+
+    def _start(self, hook: Hook, env: dict, context: bytes) -> Optional[subprocess.Popen]:
+        try:
+            logger.debug("Calling '%s'", hook)
+            # own session, so a timed out hook can be killed along with its children
+            process = subprocess.Popen(hook.command, env=env, shell=hook.shell, stdin=subprocess.PIPE,
+                                       start_new_session=True)
+        except Exception as e:
+            logger.warning("Error while executing hook '%s': %s", hook, str(e))
+            return None
+        try:
+            process.stdin.write(context)
+            process.stdin.close()
+        except OSError:
+            # hook is not interested in context
+            pass
+        return process
+
+    def _kill(self, process: subprocess.Popen):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        process.wait()
 
 
 class RandrCtl:
@@ -49,41 +208,151 @@ class RandrCtl:
     Facade that ties all the classes together and provides simple interface
     """
 
-    def __init__(self, profile_manager: ProfileManager, xrandr: Xrandr, hooks: Hooks):
+    def __init__(self, profile_manager: ProfileManager, xrandr: Xrandr, hooks: Hooks, metrics: Metrics = None,
+                 state: AppliedState = None):
+        """
+        :param state: where to persist successfully applied profile, not persisted if None
+        """
         self.profile_manager = profile_manager
         self.xrandr = xrandr
         self.hooks = hooks
+        self.metrics = metrics or Metrics()
+        self.state = state
 
-    def _apply(self, p: Profile):
+    def _apply(self, p: Profile, connected_outputs: list = None):
         try:
             self.hooks.prior_switch(p)
-            self.xrandr.apply(p)
+            rollback_args = self._rollback_args(self.xrandr.get_all_outputs())
+            try:
+                with self.metrics.time(APPLY_DURATION):
+                    self.xrandr.apply(p)
+            except XrandrException as e:
+                # X server is likely to be wedged if xrandr timed out, rollback would hang too
+                if rollback_args and not isinstance(e, XrandrTimeoutException):
+                    self._rollback(rollback_args)
+                raise
             self.hooks.post_switch(p)
         except Exception as e:
+            self.metrics.inc(SWITCHES, profile=p.name, outcome='failure')
             self.hooks.post_fail(p, str(e))
             raise e
+        self.metrics.inc(SWITCHES, profile=p.name, outcome='success')
+        self.metrics.set(LAST_SWITCH, time.time())
+        if self.state is not None:
+            # xrandr query results are cached, this doesn't call xrandr again
+            self.state.save(p, connected_outputs or self.xrandr.get_connected_outputs())
+
+    def _rollback_args(self, xrandr_connections: list) -> Optional[list]:
+        """
+        Captures current layout before switch, so it can be restored in a single xrandr call if switch fails
+        :return: arguments of xrandr call restoring current layout, None if there's nothing to restore
+        """
+        snapshot = self.profile_manager.profile_from_xrandr(xrandr_connections, ROLLBACK_PROFILE)
+        if not snapshot.outputs:
+            return None
+        return self.xrandr.restore_args(snapshot, xrandr_connections)
 
-    def switch_to(self, profile_name):
+    def _rollback(self, rollback_args: list):
+        """
+        Restores layout preceding failed switch reporting time and outcome. Rollback failure is logged, but isn't
+        propagated, so the original error is reported
+        """
+        start = time.perf_counter()
+        try:
+            with trace.span('rollback'):
+                self.xrandr.restore(rollback_args)
+        except XrandrException as e:
+            self.metrics.inc(ROLLBACKS, outcome='failure')
+            logger.error("Failed to restore previous layout: %s", str(e).strip())
+        else:
+            elapsed = time.perf_counter() - start
+            self.metrics.inc(ROLLBACKS, outcome='success')
+            self.metrics.observe(ROLLBACK_DURATION, elapsed)
+            logger.warning("Restored previous layout in %.0fms", elapsed * 1000)
+
+    def switch_to(self, profile_name, check: bool = False):
         """
         Apply profile settings by profile name
+        :param check: refuse profile if connected hardware can't apply it
         """
-        p = self.profile_manager.read_one(profile_name)
-        self._apply(p)
+        try:
+            p = self.profile_manager.read_one(profile_name)
+            if check:
+                problems = ProfileChecker(self.xrandr.get_all_outputs()).check(p)
+                if problems:
+                    self.metrics.inc(SWITCHES, profile=p.name, outcome='refused')
+                    raise ImpossibleProfileException(p.name, problems)
+            self._apply(p)
+        finally:
+            self.metrics.flush()
 
-    def switch_auto(self):
+    def switch_auto(self, check: bool = False):
         """
         Try to find profile by display EDID and apply it
+        :param check: skip matching profiles which connected hardware can't apply
         """
-        profiles = self.profile_manager.read_all()
-        xrandr_outputs = self.xrandr.get_connected_outputs()
+        try:
+            xrandr_outputs = self.xrandr.get_connected_outputs()
+            # profiles are read while they are matched, reading is measured separately
+            profiles = TimedIterator(self.profile_manager.iter_profiles())
 
-        profileMatcher = ProfileMatcher()
-        matching = profileMatcher.find_best(profiles, xrandr_outputs)
+            profileMatcher = ProfileMatcher()
+            start = time.monotonic()
+            if check:
+                # best match may be refused, so every match is kept, but not the rest of profiles
+                matching = self._find_applicable(profileMatcher.top(profiles, xrandr_outputs, None))
+            else:
+                matching = profileMatcher.find_best(profiles, xrandr_outputs)
+            self.metrics.observe(READ_PROFILES_DURATION, profiles.elapsed)
+            self.metrics.observe(MATCH_DURATION, time.monotonic() - start - profiles.elapsed)
 
-        if matching is not None:
-            self._apply(matching)
+            if matching is not None:
+                self.metrics.inc(AUTO, outcome='matched')
+                self._apply(matching, xrandr_outputs)
+            else:
+                self.metrics.inc(AUTO, outcome='unmatched')
+                logger.warning("No matching profile found")
+        finally:
+            self.metrics.flush()
+
+    def _find_applicable(self, matching: list) -> Optional[Profile]:
+        """
+        :param matching: list of (score, profile) sorted from the best match
+        :return: the best matching profile connected hardware can apply
+        """
+        checker = ProfileChecker(self.xrandr.get_all_outputs())
+        for _, p in matching:
+            problems = checker.check(p)
+            if not problems:
+                return p
+            logger.warning("Skipping profile %s: %s", p.name, '; '.join(problems))
+        return None
+
+    def check(self, profile_names: list = None, recorded: str = None) -> int:
+        """
+        Checks profiles against connected hardware and prints problems found
+        :param profile_names: profiles to check, all if empty
+        :param recorded: path to saved output of xrandr -q --verbose to check against instead of connected hardware
+        :return: number of profiles that can't be applied
+        """
+        if profile_names:
+            profiles = [self.profile_manager.read_one(name) for name in profile_names]
+        else:
+            profiles = self.profile_manager.read_all()
+        if recorded is not None:
+            xrandr_outputs = self.xrandr.recorded_outputs(recorded)
         else:
-            logger.warning("No matching profile found")
+            xrandr_outputs = self.xrandr.get_all_outputs()
+
+        impossible = 0
+        for p, problems in ProfileChecker(xrandr_outputs).check_all(profiles):
+            if problems:
+                impossible += 1
+                for problem in problems:
+                    print("{}: {}".format(p.name, problem))
+            else:
+                print("{}: ok".format(p.name))
+        return impossible
 
     def dump_current(self, name: str, to_file: bool = False,
                      include_supports_rule: bool = True,
@@ -127,36 +396,53 @@ class RandrCtl:
         p = self.profile_manager.read_one(name)
         self.profile_manager.print(p, yaml_flow_style=json_compatible)
 
-    def list_all(self):
+    def list_all(self, jsonl: bool = False):
         """
-        List all available profiles
+        List all available profiles. Every profile is printed as soon as it's read
+        :param jsonl: print JSON object per line
         """
-        profiles = self.profile_manager.read_all()
-        for p in profiles:
-            print(p.name)
+        for p in self.profile_manager.iter_profiles():
+            _print_line({'name': p.name} if jsonl else p.name, jsonl)
+        if self.profile_manager.name_cache:
+            # keep shell completion in sync with what is listed
+            self.profile_manager.name_cache.names()
 
-    def list_all_long(self):
+    def list_all_long(self, jsonl: bool = False):
         """
         List all available profiles along with some details
+        :param jsonl: print JSON object with the whole profile per line
         """
-        profiles = self.profile_manager.read_all()
-        for p in profiles:
+        for p in self.profile_manager.iter_profiles():
+            if jsonl:
+                _print_line(p.to_dict(), jsonl)
+                continue
             print(p.name)
             for o in p.outputs:
                 print('  ', o)
+        if self.profile_manager.name_cache:
+            # keep shell completion in sync with what is listed
+            self.profile_manager.name_cache.names()
 
-    def list_all_scored(self):
+    def list_all_scored(self, jsonl: bool = False):
         """
         List matched profiles with scores
+        :param jsonl: print JSON object per line as soon as profile is scored, unsorted
         """
-        profiles = self.profile_manager.read_all()
         xrandr_outputs = self.xrandr.get_connected_outputs()
+        profiles = self.profile_manager.iter_profiles()
 
         profileMatcher = ProfileMatcher()
-        matching = profileMatcher.match(profiles, xrandr_outputs)
+        if jsonl:
+            for score, p in profileMatcher.iter_matches(profiles, xrandr_outputs):
+                _print_line({'name': p.name, 'score': score}, jsonl)
+            return
 
-        for score, p in matching:
+        for score, p in profileMatcher.top(profiles, xrandr_outputs, None):
             print(p.name, score)
 
 
-
+def _print_line(value, jsonl: bool):
+    """
+    Prints value as a line of text or JSON. Output is flushed, so consumers see every line as soon as it's printed
+    """
+    print(json.dumps(value) if jsonl else value, flush=True)
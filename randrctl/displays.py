@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import pwd
+import struct
+
+from randrctl.cache import default_cache_dir, write_atomically
+
+logger = logging.getLogger(__name__)
+
+X11_SOCKET_DIR = "/tmp/.X11-unix"
+UTMP_FILE = "/run/utmp"
+LOGIND_SESSIONS_DIR = "/run/systemd/sessions"
+OWNERS_CACHE_NAME = "display_owners.json"
+
+# override locations above, e.g. to run against fake X sockets and login records
+X11_SOCKET_DIR_ENV = "RANDRCTL_X11_SOCKET_DIR"
+UTMP_FILE_ENV = "RANDRCTL_UTMP_FILE"
+LOGIND_SESSIONS_DIR_ENV = "RANDRCTL_LOGIND_SESSIONS_DIR"
+
+# struct utmp from glibc on Linux (see utmp(5)): type, pid, line, id, user, host, exit status, session, time, address
+UTMP_STRUCT = struct.Struct('<h2xi32s4s32s256shhiii16s20s')
+USER_PROCESS = 7
+
+
+def default_runtime_dir():
+    """
+    :return: directory for runtime state. It's wiped on reboot
+    """
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'randrctl')
+    if os.geteuid() == 0:
+        # udev
+        return '/run/randrctl'
+    return default_cache_dir()
+
+
+def _location(variable: str, default: str) -> str:
+    return os.environ.get(variable) or default
+
+
+def x_displays(socket_dir: str = None):
+    """
+    Find all local displays by inspecting X sockets
+    https://stackoverflow.com/questions/11367354/obtaining-list-of-all-xorg-displays
+    :param socket_dir: directory with X sockets, $RANDRCTL_X11_SOCKET_DIR or /tmp/.X11-unix if None
+    :return: list of displays as :0, :1, etc.
+    """
+    socket_dir = socket_dir or _location(X11_SOCKET_DIR_ENV, X11_SOCKET_DIR)
+    try:
+        sockets = sorted(entry for entry in os.listdir(socket_dir) if entry.startswith('X'))
+    except OSError:
+        return []
+    return [':' + socket[1:] for socket in sockets]
+
+
+def _display_of(value: str):
+    """
+    Normalizes :0.0 or :0 into :0. Returns None if value doesn't look like a local display
+    """
+    if not value.startswith(':'):
+        return None
+    return value.split('.', 1)[0]
+
+
+def utmp_display_users(utmp_file: str = UTMP_FILE) -> dict:
+    """
+    Reads utmp directly (this is what who does) and returns {display: username} for every logged in X session
+    """
+    users = dict()
+    try:
+        with open(utmp_file, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.debug("Cannot read %s: %s", utmp_file, e)
+        return users
+
+    for offset in range(0, len(data) - UTMP_STRUCT.size + 1, UTMP_STRUCT.size):
+        record = UTMP_STRUCT.unpack_from(data, offset)
+        if record[0] != USER_PROCESS:
+            continue
+        line, user, host = map(lambda b: b.split(b'\0', 1)[0].decode(errors='replace'),
+                               (record[2], record[4], record[5]))
+        display = _display_of(host) or _display_of(line)
+        if display and user:
+            users[display] = user
+    return users
+
+
+def logind_display_users(sessions_dir: str = LOGIND_SESSIONS_DIR) -> dict:
+    """
+    Reads session files of systemd-logind and returns {display: username} for every session with DISPLAY set
+    """
+    users = dict()
+    try:
+        sessions = os.listdir(sessions_dir)
+    except OSError:
+        return users
+
+    for session in sessions:
+        session_file = os.path.join(sessions_dir, session)
+        try:
+            with open(session_file) as f:
+                fields = dict(line.rstrip('\n').split('=', 1) for line in f if '=' in line)
+        except OSError:
+            continue
+        display = _display_of(fields.get('DISPLAY', ''))
+        if display and fields.get('USER'):
+            users[display] = fields['USER']
+    return users
+
+
+class DisplayOwners:
+    """
+    Resolves owners of X displays without spawning any processes.
+    Resolved mapping is cached in runtime dir. Cache is valid as long as X sockets and login records are unchanged.
+    """
+
+    def __init__(self, runtime_dir: str = None, socket_dir: str = None, utmp_file: str = None,
+                 sessions_dir: str = None):
+        """
+        Locations that are None are taken from environment variables (RANDRCTL_X11_SOCKET_DIR, RANDRCTL_UTMP_FILE,
+        RANDRCTL_LOGIND_SESSIONS_DIR) or system defaults
+        """
+        self.cache_file = os.path.join(runtime_dir or default_runtime_dir(), OWNERS_CACHE_NAME)
+        self.socket_dir = socket_dir or _location(X11_SOCKET_DIR_ENV, X11_SOCKET_DIR)
+        self.utmp_file = utmp_file or _location(UTMP_FILE_ENV, UTMP_FILE)
+        self.sessions_dir = sessions_dir or _location(LOGIND_SESSIONS_DIR_ENV, LOGIND_SESSIONS_DIR)
+
+    def _key(self, displays: list):
+        key = []
+        for display in displays:
+            key.append(self._stamp(os.path.join(self.socket_dir, 'X' + display[1:])))
+        key.append(self._stamp(self.utmp_file))
+        key.append(self._stamp(self.sessions_dir))
+        return key
+
+    def _stamp(self, path: str):
+        try:
+            st = os.stat(path)
+            return [path, st.st_ino, st.st_mtime_ns]
+        except OSError:
+            return [path, None, None]
+
+    def _read_cache(self, key: list):
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return cached['owners']
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _write_cache(self, key: list, owners: dict):
+        try:
+            write_atomically(self.cache_file, json.dumps({'key': key, 'owners': owners}))
+        except OSError as e:
+            logger.debug("Cannot cache display owners: %s", e)
+
+    def usernames(self, displays: list) -> dict:
+        """
+        :return: {display: username}. Displays without known owner are omitted
+        """
+        key = self._key(displays)
+        owners = self._read_cache(key)
+        if owners is not None:
+            logger.debug("Display owners from cache: %s", owners)
+            return owners
+
+        users = logind_display_users(self.sessions_dir)
+        users.update(utmp_display_users(self.utmp_file))
+        owners = dict((display, users[display]) for display in displays if display in users)
+        logger.debug("Resolved display owners: %s", owners)
+        self._write_cache(key, owners)
+        return owners
+
+    def owners(self, displays: list) -> dict:
+        """
+        :return: {display: pwd.struct_passwd}. Displays without known owner are omitted
+        """
+        result = dict()
+        for display, username in self.usernames(displays).items():
+            try:
+                result[display] = pwd.getpwnam(username)
+            except KeyError:
+                logger.warning("Unknown user '%s' owns display %s", username, display)
+        return result
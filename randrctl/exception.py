@@ -40,6 +40,17 @@ class NoSuchProfileException(RandrCtlException):
         Exception.__init__(self, "No profile '{}' found under {}".format(self.name, self.search_locations))
 
 
+class ImpossibleProfileException(RandrCtlException):
+    """
+    Thrown when profile requests outputs, modes, rates or CRTCs that connected hardware doesn't support
+    """
+
+    def __init__(self, name: str, problems: list):
+        self.name = name
+        self.problems = problems
+        Exception.__init__(self, "Profile '{}' can't be applied: {}".format(self.name, '; '.join(self.problems)))
+
+
 class XrandrException(RandrCtlException):
     """
     is thrown when call to xrandr fails
@@ -48,3 +59,19 @@ class XrandrException(RandrCtlException):
     def __init__(self, err: str, args: list):
         self.args = args
         Exception.__init__(self, err)
+
+
+class XrandrTimeoutException(XrandrException):
+    """
+    is thrown when xrandr doesn't finish in time and is killed
+    """
+
+    def __init__(self, timeout: float, args: list):
+        self.timeout = timeout
+        XrandrException.__init__(self, "xrandr timed out after {}s".format(timeout), args)
+
+
+class XConnectionException(RandrCtlException):
+    """
+    is thrown when connection to X server fails or X server doesn't support RandR 1.2
+    """
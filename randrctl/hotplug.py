@@ -0,0 +1,53 @@
+import logging
+import select
+import time
+from typing import Optional
+
+from randrctl.ctl import RandrCtl
+from randrctl.exception import RandrCtlException, XConnectionException
+from randrctl.inotify import CatalogueWatcher
+from randrctl.randr import CONNECTION_NAMES, RandrEvents
+
+logger = logging.getLogger(__name__)
+
+# docks report outputs one by one, switch happens once they settle
+DEFAULT_DEBOUNCE = 0.5
+
+
+def watch(randrctl: RandrCtl, events: RandrEvents, catalogue: Optional[CatalogueWatcher] = None,
+          debounce: float = DEFAULT_DEBOUNCE, check: bool = False):
+    """
+    Switches to the best matching profile on start and then whenever outputs are connected or disconnected, until X
+    server closes connection. Switch happens when no outputs change for debounce seconds
+    :param catalogue: watcher keeping profiles and configuration up to date
+    :param check: skip matching profiles which connected hardware can't apply
+    """
+    sources = [events] + ([catalogue] if catalogue is not None else [])
+    # connections might have changed while nobody was watching
+    deadline = time.monotonic()
+    while True:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        readable, _, _ = select.select(sources, [], [], timeout)
+
+        if catalogue is not None and catalogue in readable:
+            catalogue.process()
+
+        if events in readable:
+            try:
+                changes = events.read()
+            except XConnectionException as e:
+                logger.info("Stopped watching: %s", e)
+                return
+            if changes:
+                logger.info("%s", ', '.join('{} {}'.format(name, CONNECTION_NAMES.get(connection, connection))
+                                            for name, connection in changes))
+                deadline = time.monotonic() + debounce
+
+        if deadline is not None and time.monotonic() >= deadline:
+            deadline = None
+            randrctl.xrandr.refresh()
+            try:
+                randrctl.switch_auto(check=check)
+            except RandrCtlException as e:
+                # keep watching, the next hotplug may succeed
+                logger.error(e)
@@ -0,0 +1,159 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+from typing import Callable, Dict, List, Tuple
+
+from randrctl.context import CONFIG_NAME
+from randrctl.profile import ProfileIndex, is_profile_name
+
+logger = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# file is complete when it's closed after writing or renamed into directory (atomic writes)
+CHANGED = IN_CLOSE_WRITE | IN_MOVED_TO
+REMOVED = IN_DELETE | IN_MOVED_FROM
+WATCH_MASK = CHANGED | REMOVED | IN_ONLYDIR
+
+EVENT = struct.Struct('iIII')
+BUFFER_SIZE = 64 * (EVENT.size + 256)
+
+
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, "inotify is not supported")
+    return libc
+
+
+class Inotify:
+    """
+    Thin wrapper over inotify(7). Descriptor is non-blocking, so it can be polled along with other descriptors
+    """
+
+    def __init__(self):
+        self._libc = _libc()
+        self.fd = self._check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def _check(self, result: int) -> int:
+        if result < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        return result
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """
+        :return: watch descriptor
+        """
+        return self._check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask)))
+
+    def read(self) -> List[Tuple[int, int, str]]:
+        """
+        :return: list of pending events (watch descriptor, mask, name), empty if there are none
+        """
+        try:
+            data = os.read(self.fd, BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class CatalogueWatcher:
+    """
+    Keeps profile index and configuration up to date by watching profile and config directories. Only the profile file
+    that changed is read again. Directories are watched if they exist when watcher is created
+    """
+
+    def __init__(self, index: ProfileIndex, config_dirs: list, on_config_change: Callable[[], None]):
+        """
+        :param on_config_change: called when config.yaml is changed in any of config dirs
+        """
+        self.index = index
+        self.on_config_change = on_config_change
+        self.inotify = Inotify()
+        # {watch descriptor: (directory, True if profile directory)}
+        self._watches: Dict[int, Tuple[str, bool]] = dict()
+        for profile_dir in index.profile_manager.read_locations:
+            self._watch(profile_dir, True)
+        for config_dir in config_dirs:
+            self._watch(config_dir, False)
+        index.load()
+
+    def _watch(self, directory: str, profiles: bool):
+        try:
+            self._watches[self.inotify.add_watch(directory, WATCH_MASK)] = (directory, profiles)
+            logger.debug("Watching %s", directory)
+        except OSError as e:
+            logger.debug("Cannot watch %s: %s", directory, e)
+
+    def fileno(self) -> int:
+        return self.inotify.fileno()
+
+    def process(self) -> bool:
+        """
+        Applies pending changes
+        :return: True if profiles or configuration changed
+        """
+        profiles_changed = False
+        config_changed = False
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # some events are lost, start over
+                logger.warning("Too many changes in profile directories, reloading all profiles")
+                self.index.load()
+                profiles_changed = config_changed = True
+                continue
+            watch = self._watches.get(wd)
+            if watch is None or mask & IN_ISDIR:
+                continue
+            directory, profiles = watch
+            if profiles:
+                if not is_profile_name(name):
+                    continue
+                path = os.path.join(directory, name)
+                if mask & CHANGED:
+                    self.index.update(path)
+                else:
+                    self.index.remove(path)
+                profiles_changed = True
+            elif name == CONFIG_NAME:
+                config_changed = True
+
+        if profiles_changed and self.index.profile_manager.name_cache:
+            self.index.profile_manager.name_cache.update()
+        if config_changed:
+            logger.info("Configuration changed, reloading")
+            self.on_config_change()
+        return profiles_changed or config_changed
+
+    def close(self):
+        self.inotify.close()
+
@@ -0,0 +1,225 @@
+import logging
+import os
+import re
+import time
+
+from randrctl.cache import write_atomically
+
+logger = logging.getLogger(__name__)
+
+SWITCHES = 'randrctl_switches_total'
+AUTO = 'randrctl_auto_total'
+HOOK_FAILURES = 'randrctl_hook_failures_total'
+LAST_SWITCH = 'randrctl_last_switch_timestamp_seconds'
+MATCH_DURATION = 'randrctl_match_duration_seconds'
+READ_PROFILES_DURATION = 'randrctl_read_profiles_duration_seconds'
+APPLY_DURATION = 'randrctl_xrandr_apply_duration_seconds'
+HOOK_DURATION = 'randrctl_hook_duration_seconds'
+ROLLBACKS = 'randrctl_rollbacks_total'
+ROLLBACK_DURATION = 'randrctl_rollback_duration_seconds'
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# name: (type, help)
+FAMILIES = {
+    SWITCHES: (COUNTER, 'Profile switches by profile and outcome'),
+    AUTO: (COUNTER, 'Auto-switch attempts by outcome'),
+    HOOK_FAILURES: (COUNTER, 'Hooks that failed, timed out or could not be started'),
+    LAST_SWITCH: (GAUGE, 'Time of the last successful switch'),
+    MATCH_DURATION: (HISTOGRAM, 'Time spent matching profiles to connected outputs, reading excluded'),
+    READ_PROFILES_DURATION: (HISTOGRAM, 'Time spent reading and parsing profiles while matching'),
+    APPLY_DURATION: (HISTOGRAM, 'Time spent applying profile with xrandr'),
+    HOOK_DURATION: (HISTOGRAM, 'Time spent executing hooks of a stage'),
+    ROLLBACKS: (COUNTER, 'Rollbacks to the layout preceding failed switch by outcome'),
+    ROLLBACK_DURATION: (HISTOGRAM, 'Time spent restoring the layout preceding failed switch'),
+}
+
+# collector usually runs as its own user, so the file must be readable by everyone
+TEXTFILE_MODE = 0o644
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+SAMPLE_REGEX = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+LABEL_REGEX = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+class Timer:
+    def __init__(self, metrics: 'Metrics', name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.monotonic() - self.start, **self.labels)
+        return False
+
+
+class TimedIterator:
+    """
+    Sums up time spent producing items of wrapped iterator. Tells producing (e.g. reading profiles) apart from
+    consuming, when the two are interleaved
+    """
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.monotonic()
+        try:
+            return next(self.iterator)
+        finally:
+            self.elapsed += time.monotonic() - start
+
+
+class Metrics:
+    """
+    Metrics sink that discards everything. Used when metrics are not configured
+    """
+
+    def inc(self, name: str, value: float = 1, **labels):
+        pass
+
+    def set(self, name: str, value: float, **labels):
+        pass
+
+    def observe(self, name: str, seconds: float, **labels):
+        pass
+
+    def time(self, name: str, **labels):
+        """
+        Context manager observing duration of enclosed block
+        """
+        return Timer(self, name, labels)
+
+    def flush(self):
+        pass
+
+
+class TextfileMetrics(Metrics):
+    """
+    Keeps metrics in a file for node_exporter textfile collector.
+    Updates are accumulated in memory and merged into the file on flush. The file is locked while being updated and
+    replaced atomically, so concurrent randrctl processes don't lose updates and collector never sees partial file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.lock')
+        self._increments = []
+        self._gauges = []
+        self._observations = []
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self._increments.append((name, labels, value))
+
+    def set(self, name: str, value: float, **labels):
+        self._gauges.append((name, labels, value))
+
+    def observe(self, name: str, seconds: float, **labels):
+        self._observations.append((name, labels, seconds))
+
+    def flush(self):
+        if not (self._increments or self._gauges or self._observations):
+            return
+        import fcntl
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.lock_path, 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                samples = self._read()
+                self._merge(samples)
+                write_atomically(self.path, self._format(samples), mode=TEXTFILE_MODE)
+        except OSError as e:
+            logger.warning("Cannot write metrics to %s: %s", self.path, e)
+        self._increments, self._gauges, self._observations = [], [], []
+
+    def _merge(self, samples: dict):
+        for name, labels, value in self._increments:
+            key = _key(name, labels)
+            samples[key] = samples.get(key, 0) + value
+        for name, labels, value in self._gauges:
+            samples[_key(name, labels)] = value
+        for name, labels, seconds in self._observations:
+            for bucket in BUCKETS + (float('inf'),):
+                key = _key(name + '_bucket', dict(labels, le=_format_value(bucket)))
+                samples[key] = samples.get(key, 0) + (1 if seconds <= bucket else 0)
+            for suffix, value in (('_sum', seconds), ('_count', 1)):
+                key = _key(name + suffix, labels)
+                samples[key] = samples.get(key, 0) + value
+
+    def _read(self) -> dict:
+        samples = dict()
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return samples
+
+        for line in lines:
+            if not line or line.startswith('#'):
+                continue
+            m = SAMPLE_REGEX.match(line)
+            if m is None:
+                continue
+            labels = dict((k, _unescape(v)) for k, v in LABEL_REGEX.findall(m.group('labels') or ''))
+            try:
+                samples[_key(m.group('name'), labels)] = float(m.group('value'))
+            except ValueError:
+                continue
+        return samples
+
+    def _format(self, samples: dict) -> str:
+        lines = []
+        for family, (kind, help) in FAMILIES.items():
+            names = (family + '_bucket', family + '_sum', family + '_count') if kind == HISTOGRAM else (family,)
+            family_samples = sorted(filter(lambda key: key[0] in names, samples),
+                                    key=lambda key: (names.index(key[0]), _sort_labels(key[1])))
+            if not family_samples:
+                continue
+            lines.append('# HELP {} {}'.format(family, help))
+            lines.append('# TYPE {} {}'.format(family, kind))
+            for name, labels in family_samples:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(samples[(name, labels)])))
+        return ''.join(line + '\n' for line in lines)
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def _sort_labels(labels: tuple):
+    # buckets are sorted numerically
+    return tuple((k, float(v)) if k == 'le' else (k, v) for k, v in labels)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
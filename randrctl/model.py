@@ -1,29 +1,219 @@
-class Display:
+import re
+from typing import Optional, Tuple
+
+PRIOR_SWITCH = 'prior_switch'
+POST_SWITCH = 'post_switch'
+POST_FAIL = 'post_fail'
+HOOK_STAGES = (PRIOR_SWITCH, POST_SWITCH, POST_FAIL)
+
+SIZE_REGEX = re.compile(r'^(\d+)x(\d+)')
+POS_REGEX = re.compile(r'^(-?\d+)x(-?\d+)$')
+PANNING_REGEX = re.compile(r'^(\d+)x(\d+)(?:\+(-?\d+)\+(-?\d+))?')
+SCALE_REGEX = re.compile(r'^(\d*\.?\d+)(?:x(\d*\.?\d+))?$')
+
+
+# Geometry is parsed leniently: mode names are arbitrary (e.g. 1920x1080i or custom modelines), so values that can't be
+# parsed are kept as strings with numeric form set to None.
+
+def parse_size(s: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Parses size or mode name (i.e. 1920x1080) into (width, height)
+    """
+    m = SIZE_REGEX.match(s) if s else None
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def parse_pos(s: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Parses position (i.e. 1920x0) into (left, top)
+    """
+    m = POS_REGEX.match(s) if s else None
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def parse_panning(s: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Parses panning (i.e. 1920x1080+0+0 or 1920x1080) into (width, height, left, top)
+    """
+    m = PANNING_REGEX.match(s) if s else None
+    return (int(m.group(1)), int(m.group(2)), int(m.group(3) or 0), int(m.group(4) or 0)) if m else None
+
+
+def parse_scale(s: Optional[str]) -> Optional[Tuple[float, float]]:
+    """
+    Parses scale (i.e. 1.5x1.5 or 1.5) into (x, y)
+    """
+    m = SCALE_REGEX.match(s) if s else None
+    return (float(m.group(1)), float(m.group(2) or m.group(1))) if m else None
+
+
+def parse_rate(s) -> Optional[float]:
+    """
+    Parses refresh rate (i.e. 59.94) into float
+    """
+    try:
+        return float(s) if s else None
+    except ValueError:
+        return None
+
+
+class Parsed:
+    """
+    Attribute keeping canonical string form (as it's passed to xrandr and stored in profiles) along with numeric form
+    parsed on assignment. Owner class must declare slots for both forms: _<name> and the one passed here
+    """
+
+    def __init__(self, parse, parsed_name: str):
+        self.parse = parse
+        self.parsed_name = parsed_name
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj, self.name)
+
+    def __set__(self, obj, value):
+        setattr(obj, self.name, value)
+        setattr(obj, self.parsed_name, self.parse(value))
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+class Model:
+    """
+    Base of model classes. Fields are kept in slots, equality and hashing are defined over fields listed in _fields
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def _key(self) -> tuple:
+        return tuple(getattr(self, f) for f in self._fields)
+
+    def __eq__(self, o: object):
+        return type(o) is type(self) and self._key() == o._key()
+
+    def __hash__(self):
+        return hash(tuple(map(_hashable, self._key())))
+
+    def __repr__(self):
+        return str(dict(zip(self._fields, self._key())))
+
+
+class Mode(Model):
+    """
+    Mode supported by a display at particular refresh rate
+    """
+    __slots__ = ('name', 'rate', 'rate_hz', 'size', 'interlaced', 'current', 'preferred')
+    _fields = ('name', 'rate', 'current', 'preferred')
+
+    def __init__(self, name: str, rate: str = None, current: bool = False, preferred: bool = False):
+        """
+        :param name: mode name as reported by xrandr, i.e. resolution (1920x1080 or 1920x1080i for interlaced)
+        :param rate: refresh rate as reported by xrandr (i.e. 59.94)
+        """
+        self.name = name
+        self.rate = rate
+        self.rate_hz = parse_rate(rate)
+        self.size = parse_size(name)
+        self.interlaced = name.endswith('i')
+        self.current = current
+        self.preferred = preferred
+
+
+class ModeTable(Model):
+    """
+    Modes supported by a display indexed by name and by (name, refresh rate rounded to Hz)
+    """
+    __slots__ = ('modes', 'by_name', 'by_rate', 'rates')
+    _fields = ('modes',)
+
+    def __init__(self, modes: list = None):
+        self.modes = modes if modes is not None else []
+        self.by_name = dict()
+        self.by_rate = dict()
+        self.rates = set()
+        for mode in self.modes:
+            self.by_name.setdefault(mode.name, []).append(mode)
+            if mode.rate_hz is not None:
+                rate = round(mode.rate_hz)
+                self.by_rate.setdefault((mode.name, rate), mode)
+                self.rates.add(rate)
+
+    @staticmethod
+    def from_names(names: list):
+        """
+        Builds table of modes with unknown refresh rates
+        """
+        return ModeTable([Mode(name) for name in names])
+
+    def names(self) -> list:
+        """
+        :return: names of supported modes in the order reported by xrandr
+        """
+        return list(self.by_name)
+
+    def __contains__(self, name: str):
+        return name in self.by_name
+
+    def supports_rate(self, rate_hz: float, name: str = None) -> bool:
+        """
+        Checks if refresh rate is supported at all or by particular mode. Rates are compared rounded to Hz, so 59.94 and
+        60 are the same
+        """
+        if name is None:
+            return round(rate_hz) in self.rates
+        return (name, round(rate_hz)) in self.by_rate
+
+
+class Display(Model):
     """
     Display (i.e. physical device) connected to graphical adapter output
     """
+    __slots__ = ('_mode', 'mode_size', '_rate', 'rate_hz', 'preferred_mode', 'modes', 'edid')
+    _fields = ('mode', 'rate', 'preferred_mode', 'modes', 'edid')
+
+    mode = Parsed(parse_size, 'mode_size')
+    rate = Parsed(parse_rate, 'rate_hz')
 
     def __init__(self, supported_modes=None, preferred_mode: str = None, current_mode: str = None,
-                 current_rate: str = None, edid: str = None):
-        if supported_modes is None:
-            supported_modes = []
+                 current_rate: str = None, edid: str = None, modes: ModeTable = None):
+        """
+        :param supported_modes: names of supported modes, ignored if modes is passed
+        :param modes: table of supported modes along with their refresh rates
+        """
+        if modes is None:
+            modes = ModeTable.from_names(supported_modes or [])
         self.mode = current_mode
         self.rate = current_rate
         self.preferred_mode = preferred_mode
-        self.supported_modes = supported_modes
+        self.modes = modes
         self.edid = edid
 
+    @property
+    def supported_modes(self) -> list:
+        return self.modes.names()
+
     def is_on(self):
         return self.mode is not None
 
-    def __repr__(self, *args, **kwargs):
-        return str(self.__dict__)
-
 
-class Viewport:
+class Viewport(Model):
     """
     Screen viewport
     """
+    __slots__ = ('_size', 'size_px', '_pos', 'pos_px', 'rotate', '_panning', 'panning_px', '_scale', 'scale_xy')
+    _fields = ('size', 'pos', 'rotate', 'panning', 'scale')
+
+    size = Parsed(parse_size, 'size_px')
+    pos = Parsed(parse_pos, 'pos_px')
+    panning = Parsed(parse_panning, 'panning_px')
+    scale = Parsed(parse_scale, 'scale_xy')
 
     def __init__(self, size: str, pos: str = '0x0', rotate: str = 'normal', panning: str = '0x0', scale: str = '1x1'):
         self.size = size
@@ -32,36 +222,50 @@ class Viewport:
         self.panning = panning if panning else "0x0"
         self.scale = scale if scale else "1x1"
 
-    def __repr__(self, *args, **kwargs):
-        return str(self.__dict__)
-
 
-class XrandrConnection:
+class XrandrConnection(Model):
     """
     Connection between a graphic adapter output and a display with assigned viewport
     """
+    __slots__ = ('name', 'display', 'viewport', 'primary', 'crtc', 'crtcs')
+    _fields = __slots__
 
     def __init__(self, name: str, display: Display = None, current_geometry: Viewport = None, primary: bool = False,
-                 crtc: int = None):
+                 crtc: int = None, crtcs: list = None):
+        """
+        :param crtcs: CRTCs able to drive the output, None if unknown
+        """
         self.name = name
         self.display = display
         self.viewport = current_geometry
         self.primary = primary
         self.crtc = crtc
+        self.crtcs = crtcs
 
     def is_active(self):
         return self.viewport is not None
 
-    def __repr__(self, *args, **kwargs):
-        return str(self.__dict__)
-
 
 class Deserializable(object):
     # TODO implement deserialization
-    pass
+    __slots__ = ()
 
 
 class Serializable(Deserializable):
+    """
+    Object convertible to dict of not empty fields.
+    Subclasses declaring _fields get to_dict() and from_fields() generated from the schema: _fields lists fields in the
+    order of constructor arguments, _nested maps fields holding dicts of serializable objects to their class names,
+    _plain lists fields holding plain dicts and lists (they are copied). The rest of fields are stored as is.
+    """
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '_fields' in cls.__dict__:
+            cls.to_dict = _generate_to_dict(cls)
+            cls.from_fields = classmethod(_generate_from_fields(cls))
+
     def _traverse(self, child):
         if child is None:
             pass
@@ -79,19 +283,76 @@ class Serializable(Deserializable):
         return self._traverse(dict(filter(not_empty, self.__dict__.items())))
 
 
-class Profile(Serializable):
-    def __init__(self, name: str, outputs: dict, match: dict = None, primary: str = None, priority: int = 100):
+def _compile(source: str, name: str):
+    # names in generated code are resolved in this module, so schemas may refer to classes defined later
+    namespace = dict()
+    exec(source, globals(), namespace)
+    return namespace[name]
+
+
+def _generate_to_dict(cls):
+    lines = ['def to_dict(self):', '    d = {}']
+    for field in cls._fields:
+        attribute = getattr(cls, field, None)
+        slot = attribute.name if isinstance(attribute, Parsed) else field
+        lines.append('    v = self.{}'.format(slot))
+        lines.append('    if v is not None:')
+        if field in getattr(cls, '_nested', {}):
+            lines.append('        d[{!r}] = {{k: e.to_dict() if e is not None else None for k, e in v.items()}}'
+                         .format(field))
+        elif field in getattr(cls, '_plain', ()):
+            lines.append('        d[{!r}] = self._traverse(v)'.format(field))
+        else:
+            lines.append('        d[{!r}] = v'.format(field))
+    lines.append('    return d')
+    return _compile('\n'.join(lines), 'to_dict')
+
+
+def _generate_from_fields(cls):
+    code = cls.__init__.__code__
+    params = code.co_varnames[1:code.co_argcount]
+    defaults = cls.__init__.__defaults__ or ()
+    required = params[:len(params) - len(defaults)]
+    nested = getattr(cls, '_nested', {})
+
+    lines = ['def from_fields(cls, d):',
+             '    if not d.keys() <= {!r}:'.format(set(params)),
+             '        raise ValueError("unknown fields {{}}".format(sorted(set(d) - {!r})))'.format(set(params))]
+    args = []
+    for i, param in enumerate(params):
+        value = 'd[{!r}]'.format(param) if param in required else \
+            'd.get({!r}, {!r})'.format(param, defaults[i - len(required)])
+        if param in nested:
+            lines.append('    v = {}'.format(value))
+            value = '{{k: {}.from_dict(e) for k, e in v.items()}} if v else None'.format(nested[param])
+        lines.append('    a{} = {}'.format(i, value))
+        args.append('a{}'.format(i))
+    lines.append('    return cls({})'.format(', '.join(args)))
+    return _compile('\n'.join(lines), 'from_fields')
+
+
+class Profile(Model, Serializable):
+    __slots__ = ('name', 'outputs', 'match', 'primary', 'priority', 'hooks')
+    _fields = __slots__
+    _nested = {'outputs': 'Output', 'match': 'Rule'}
+    _plain = ('hooks',)
+
+    def __init__(self, name: str, outputs: dict, match: dict = None, primary: str = None, priority: int = 100,
+                 hooks: dict = None):
         """
         :param name: name of the profile
         :param outputs: list of Output objects (i.e. settings to apply for each output)
         :param match: dictionary of rules for match section. Keys of the dictionary are outputs names (e.g. "LVDS1"),
         values are Rule instances
+        :param hooks: dictionary of hooks specific to this profile. Keys are hook stages (e.g. "post_switch"), values
+        are hook definitions in the same format as in config
         """
         self.name = name
         self.outputs = outputs
         self.match = match
         self.primary = primary
         self.priority = priority
+        self.hooks = hooks
 
     @staticmethod
     def from_dict(d: dict):
@@ -102,55 +363,57 @@ class Profile(Serializable):
             outputs=dict(map(lambda kv: (kv[0], Output.from_dict(kv[1])), outputs.items())) if outputs else None,
             match=dict(map(lambda kv: (kv[0], Rule.from_dict(kv[1])), match.items())) if match else None,
             primary=d.get('primary'),
-            priority=d.get('priority')
+            priority=d.get('priority'),
+            hooks=d.get('hooks')
         )
 
-    def __repr__(self):
-        return str(self.__dict__)
-
-    def __eq__(self, o: object):
-        return isinstance(o, Profile) and self.__dict__ == o.__dict__
-
     def __hash__(self):
         return hash(self.name)
 
 
-class Rule(Serializable):
+class Rule(Model, Serializable):
     """
     Rule to match profile to xrandr connections.
     Corresponds to a single entry in a match section in profile json.
     """
+    __slots__ = ('edid', 'prefers', 'supports', '_rate', 'rate_hz')
+    _fields = ('edid', 'prefers', 'supports', 'rate')
+
+    rate = Parsed(parse_rate, 'rate_hz')
 
-    def __init__(self, edid: str = None, prefers: str = None, supports: str = None):
+    def __init__(self, edid: str = None, prefers: str = None, supports: str = None, rate: str = None):
         """
-        Rule to match against edid, supported mode, preferred mode or any combination of them.
+        Rule to match against edid, supported mode, preferred mode, refresh rate or any combination of them.
         Rule matches anything if nothing is passed
         :param edid: edid of a display to match
         :param prefers: preferred mode of a display to match
         :param supports: supported mode of a display to match
+        :param rate: refresh rate of a display to match. It must be supported by the mode given in supports (or
+        prefers), or by any mode if neither is set. Rates are compared rounded to Hz
         """
         self.edid = edid
         self.prefers = prefers
         self.supports = supports
+        self.rate = rate
 
     @staticmethod
     def from_dict(d: dict):
-        return Rule(**d)
-
-    def __repr__(self):
-        return str(self.__dict__)
-
-    def __eq__(self, o: object):
-        return isinstance(o, Rule) and self.__dict__ == o.__dict__
-
-    def __hash__(self):
-        return hash((self.edid, self.prefers, self.supports))
+        return Rule.from_fields(d)
 
 
-class Output(Serializable):
+class Output(Model, Serializable):
     """
     Output in randrctl profile.
     """
+    __slots__ = ('_mode', 'mode_size', '_pos', 'pos_px', 'rotate', '_panning', 'panning_px', '_scale', 'scale_xy',
+                 '_rate', 'rate_hz', 'crtc')
+    _fields = ('mode', 'pos', 'rotate', 'panning', 'scale', 'rate', 'crtc')
+
+    mode = Parsed(parse_size, 'mode_size')
+    pos = Parsed(parse_pos, 'pos_px')
+    panning = Parsed(parse_panning, 'panning_px')
+    scale = Parsed(parse_scale, 'scale_xy')
+    rate = Parsed(parse_rate, 'rate_hz')
 
     def __init__(self, mode: str, pos: str = "0x0", rotate: str = "normal", panning: str = "0x0",
                  scale: str = "1x1", rate: str = None, crtc: int = None):
@@ -168,7 +431,7 @@ class Output(Serializable):
         # TODO test how PyYaml handles json with numberic value as rate
         if d.get('rate'):
             d['rate'] = str(d['rate'])
-        return Output(**d)
+        return Output.from_fields(d)
 
     @staticmethod
     def fromconnection(connection: XrandrConnection):
@@ -180,12 +443,4 @@ class Output(Serializable):
                       connection.display.rate,
                       connection.crtc)
 
-    def __repr__(self):
-        return str(self.__dict__)
-
-    def __eq__(self, o: object):
-        return isinstance(o, Output) and self.__dict__ == o.__dict__
-
-    def __hash__(self):
-        return hash(self.mode)
 
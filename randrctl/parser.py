@@ -0,0 +1,232 @@
+# Single-pass parser of xrandr -q and xrandr -q --verbose output.
+#
+# Output is consumed incrementally as it's read from the pipe. Every line is classified by its first characters and
+# tokenized with str.split/partition only, so parsing time is linear in the size of the output regardless of its
+# content. No regular expressions are involved.
+from typing import List, Optional
+
+from randrctl.model import Mode
+
+ROTATIONS = ('normal', 'left', 'inverted', 'right')
+GEOMETRY_CHARS = frozenset('0123456789x+')
+
+# only the first 128 bytes of EDID are taken (profiles store hash of them), extension blocks are ignored
+CONTINUATION_LIMITS = {'EDID': 8}
+
+
+class OutputRecord:
+    """
+    Output as reported by xrandr: header fields, properties (--verbose only) and modes
+    """
+    __slots__ = ('name', 'status', 'details', 'primary', 'geometry', 'rotate', 'panning', 'properties', 'modes')
+
+    def __init__(self, name: str, status: str, details: str):
+        """
+        :param details: the rest of the header line after status
+        """
+        self.name = name
+        self.status = status
+        self.details = details
+        self.primary = False
+        self.geometry = None
+        self.rotate = None
+        self.panning = None
+        self.properties = dict()
+        self.modes: List[Mode] = []
+
+    @property
+    def connected(self) -> bool:
+        return self.status == 'connected'
+
+    def property(self, name: str) -> Optional[str]:
+        """
+        :return: property value along with its continuation lines, None if output doesn't have such property
+        """
+        parts = self.properties.get(name)
+        return ''.join(parts) if parts is not None else None
+
+
+def _is_geometry(token: str) -> bool:
+    return 'x' in token and '+' in token and GEOMETRY_CHARS.issuperset(token)
+
+
+def _header(line: str) -> Optional[OutputRecord]:
+    """
+    Parses output header, e.g.
+    LVDS1 connected primary 1366x768+0+312 (0x48) left (normal left inverted right x axis y axis) 277mm x 156mm
+    """
+    tokens = line.split()
+    if len(tokens) < 2:
+        return None
+    status = tokens[1]
+    rest = 2
+    if status == 'unknown' and len(tokens) > 2 and tokens[2] == 'connection':
+        status = 'unknown connection'
+        rest = 3
+    record = OutputRecord(tokens[0], status, ' '.join(tokens[rest:]))
+
+    in_parens = False
+    capabilities_seen = False
+    i = rest
+    while i < len(tokens):
+        token = tokens[i]
+        if in_parens:
+            in_parens = not token.endswith(')')
+        elif token.startswith('('):
+            if token.startswith('(0x') and token.endswith(')'):
+                # mode id (--verbose only)
+                pass
+            else:
+                # list of supported rotations and reflections
+                capabilities_seen = True
+                in_parens = not token.endswith(')')
+        elif token == 'primary':
+            record.primary = True
+        elif token == 'panning' and i + 1 < len(tokens):
+            i += 1
+            record.panning = tokens[i]
+        elif record.geometry is None and _is_geometry(token):
+            record.geometry = token
+        elif record.rotate is None and not capabilities_seen and token in ROTATIONS:
+            record.rotate = token
+        i += 1
+    return record
+
+
+class XrandrParser:
+    """
+    Incremental parser. Output is fed in chunks of any size, complete records are returned as soon as the next output
+    header is seen
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # position in buffer up to which there are no line breaks
+        self._scanned = 0
+        self._records: List[OutputRecord] = []
+        self._record: Optional[OutputRecord] = None
+        self._property: Optional[list] = None
+        self._property_limit = None
+        self._mode: Optional[list] = None
+
+    def feed(self, data: bytes) -> List[OutputRecord]:
+        """
+        :return: records completed so far
+        """
+        buffer = self._buffer
+        buffer += data
+        end = buffer.rfind(b'\n', self._scanned)
+        if end >= 0:
+            # multibyte characters never span line breaks, so complete lines are decoded at once
+            for line in buffer[:end].decode(errors='replace').split('\n'):
+                self._line(line)
+            del buffer[:end + 1]
+        self._scanned = len(buffer)
+        return self._drain()
+
+    def close(self) -> List[OutputRecord]:
+        """
+        Parses remaining output
+        :return: the rest of records
+        """
+        if self._buffer:
+            self._line(self._buffer.decode(errors='replace'))
+            self._buffer.clear()
+            self._scanned = 0
+        self._finish_record()
+        return self._drain()
+
+    def _drain(self) -> List[OutputRecord]:
+        records, self._records = self._records, []
+        return records
+
+    def _line(self, line: str):
+        if not line:
+            return
+        first = line[0]
+        if first == '\t':
+            self._property_line(line)
+        elif first == ' ':
+            self._mode_line(line)
+        elif line.startswith('Screen '):
+            self._finish_record()
+        else:
+            self._finish_record()
+            self._record = _header(line)
+
+    def _property_line(self, line: str):
+        if self._record is None:
+            return
+        if len(line) > 1 and not line[1].isspace():
+            name, colon, value = line[1:].partition(':')
+            if not colon:
+                self._property = None
+                return
+            self._property = [value.strip()]
+            self._property_limit = CONTINUATION_LIMITS.get(name)
+            self._record.properties[name] = self._property
+        elif self._property is not None:
+            if self._property_limit is not None:
+                if len(self._property) > self._property_limit:
+                    return
+            self._property.append(line.strip())
+
+    def _mode_line(self, line: str):
+        if self._record is None:
+            return
+        self._property = None
+        stripped = line.lstrip()
+        detail = stripped[:2]
+        if detail == 'v:':
+            # --verbose mode details: v: height 1080 start 1084 end 1089 total 1125 clock 60.00Hz
+            clock = stripped.rpartition(' ')[2]
+            if self._mode is not None and clock.endswith('Hz'):
+                self._mode[1] = clock[:-2]
+            return
+        elif detail == 'h:':
+            return
+        tokens = stripped.split()
+        if not tokens:
+            return
+        first = tokens[0]
+        if len(tokens) > 1 and tokens[1].startswith('(0x'):
+            # --verbose mode: 1920x1080 (0x4c) 148.500MHz +HSync +VSync *current +preferred
+            self._finish_mode()
+            self._mode = [first, None, '*current' in tokens, '+preferred' in tokens]
+        else:
+            # mode with all its rates, each is followed by * if current and + if preferred: 1920x1080 60.00*+ 50.00
+            self._finish_mode()
+            modes = self._record.modes
+            for token in tokens[1:]:
+                if token[0].isdigit():
+                    rate = token.rstrip('*+')
+                    modes.append(Mode(first, rate, '*' in token, '+' in token))
+                elif modes and modes[-1].name == first:
+                    # flags separated from rate by space
+                    modes[-1].current = modes[-1].current or '*' in token
+                    modes[-1].preferred = modes[-1].preferred or '+' in token
+
+    def _finish_mode(self):
+        if self._mode is not None:
+            self._record.modes.append(Mode(*self._mode))
+            self._mode = None
+
+    def _finish_record(self):
+        if self._record is not None:
+            self._finish_mode()
+            self._records.append(self._record)
+        self._record = None
+        self._property = None
+
+
+def parse(output) -> List[OutputRecord]:
+    """
+    Parses complete xrandr output given as bytes, str or list of lines
+    """
+    if isinstance(output, list):
+        output = '\n'.join(output)
+    if isinstance(output, str):
+        output = output.encode()
+    parser = XrandrParser()
+    records = parser.feed(output)
+    return records + parser.close()
@@ -0,0 +1,74 @@
+import logging
+from typing import Dict, List, Optional
+
+from randrctl.model import Profile, XrandrConnection
+
+logger = logging.getLogger(__name__)
+
+
+def _cost(name: str, crtc: int, connection: XrandrConnection, owners: dict) -> int:
+    """
+    :param owners: {crtc: name of output it currently drives}, outputs turned off by the profile are omitted
+    :return: number of outputs affected by driving output with crtc
+    """
+    cost = 0
+    if connection.crtc is not None and connection.crtc != crtc:
+        # output is moved to another CRTC
+        cost += 1
+    owner = owners.get(crtc)
+    if owner is not None and owner != name:
+        # CRTC is taken from another output
+        cost += 1
+    return cost
+
+
+def plan_crtcs(profile: Profile, xrandr_connections: List[XrandrConnection]) -> Optional[Dict[str, int]]:
+    """
+    Assigns a CRTC to every output of profile, so that the fewest outputs change CRTC relative to the current state.
+    CRTCs set in profile are kept.
+    :param xrandr_connections: all outputs with current and possible CRTCs (reported by xrandr -q --verbose)
+    :return: {output name: crtc}, None if possible CRTCs are unknown or outputs can't be assigned distinct CRTCs
+    """
+    connections = {c.name: c for c in xrandr_connections}
+    # outputs missing in profile are turned off before the rest are set up, their CRTCs are free to take
+    owners = {c.crtc: c.name for c in xrandr_connections if c.crtc is not None and c.name in profile.outputs}
+
+    names = list(profile.outputs)
+    candidates = []
+    for name in names:
+        connection = connections.get(name)
+        if connection is None or not connection.crtcs:
+            return None
+        pinned = profile.outputs[name].crtc
+        if pinned is not None:
+            if pinned not in connection.crtcs:
+                return None
+            candidates.append([(0, pinned)])
+        else:
+            candidates.append(sorted((_cost(name, crtc, connection, owners), crtc) for crtc in connection.crtcs))
+
+    # branch and bound over outputs with the fewest candidates first, cheapest CRTCs are tried first
+    order = sorted(range(len(names)), key=lambda i: len(candidates[i]))
+    best_cost = None
+    best = None
+    assignment = dict()
+
+    def search(k: int, cost: int):
+        nonlocal best_cost, best
+        if best_cost is not None and cost >= best_cost:
+            return
+        if k == len(order):
+            best_cost, best = cost, dict(assignment)
+            return
+        i = order[k]
+        for c, crtc in candidates[i]:
+            if crtc in assignment.values():
+                continue
+            assignment[names[i]] = crtc
+            search(k + 1, cost + c)
+            del assignment[names[i]]
+
+    search(0, 0)
+    if best is not None:
+        logger.debug("Planned CRTCs %s reassigning %d outputs", best, best_cost)
+    return best
@@ -1,14 +1,34 @@
 import hashlib
 import logging
 import os
-from typing import List, Optional, Tuple
+import heapq
+import stat
+from typing import Iterable, Iterator, List, Optional, Tuple
 import yaml
 
+from randrctl import trace
+from randrctl.cache import CatalogueGeneration, ProfileNameCache, write_atomically
 from randrctl.exception import InvalidProfileException, NoSuchProfileException
-from randrctl.model import Profile, Rule, Output, XrandrConnection
+from randrctl.model import Profile, Rule, Output, XrandrConnection, HOOK_STAGES
+from randrctl.planner import plan_crtcs
 
 logger = logging.getLogger(__name__)
 
+# libyaml emitter produces the same output as the pure python one (representer is shared), but much faster
+Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+
+def _file_mode(path: str) -> int:
+    """
+    :return: permissions of existing file, otherwise permissions open() would create it with
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
 
 def hash(string: str):
     if string:
@@ -18,39 +38,74 @@ def hash(string: str):
 
 
 class ProfileManager:
-    def __init__(self, read_locations: list, write_location: str):
+    def __init__(self, read_locations: list, write_location: str, name_cache: ProfileNameCache = None,
+                 generation: CatalogueGeneration = None):
         self.read_locations = list(filter(lambda location: os.path.isdir(location), read_locations))
         self.write_location = write_location
+        self.name_cache = name_cache
+        self.generation = generation
+        # kept up to date by a watcher in long-running processes, profiles are read from disk if None
+        self.index: Optional[ProfileIndex] = None
 
     def read_all(self) -> List[Profile]:
-        profiles: List[Profile] = []
-        for profile_dir in self.read_locations:
-            for entry in os.listdir(profile_dir):
-                path = os.path.join(profile_dir, entry)
-                if os.path.isfile(path):
-                    try:
-                        with open(path) as profile_file:
-                            profiles.append(self.read_file(profile_file))
-                    except InvalidProfileException as e:
-                        logger.warning(e)
+        with trace.span('read profiles') as span:
+            profiles = list(self.iter_profiles())
+            span.set(count=len(profiles))
         return profiles
 
-    def read_one(self, profile_name: str):
-        # TODO handle missing profile
-        profile = None
+    def iter_profiles(self) -> Iterator[Profile]:
+        """
+        Lazily reads profiles one by one, so only the profile being processed is kept in memory. Invalid profiles and
+        hidden files (e.g. profiles being written) are skipped
+        """
+        if self.index is not None:
+            yield from self.index.profiles()
+            return
+        for path in self.profile_paths():
+            profile = self.read_path(path)
+            if profile is not None:
+                yield profile
+
+    def profile_paths(self) -> Iterator[str]:
+        """
+        :return: paths of all profile files in read locations
+        """
         for profile_dir in self.read_locations:
-            profile_path = os.path.join(profile_dir, profile_name)
-            if not os.path.isfile(profile_path):
-                continue
-            with open(profile_path) as profile_file:
-                profile = self.read_file(profile_file)
-                break
+            with os.scandir(profile_dir) as entries:
+                for entry in entries:
+                    if is_profile_name(entry.name) and entry.is_file():
+                        yield entry.path
+
+    def read_path(self, path: str) -> Optional[Profile]:
+        """
+        :return: profile read from file, None if profile is invalid
+        """
+        with trace.span('read profile', path=path):
+            try:
+                with open(path) as profile_file:
+                    return self.read_file(profile_file)
+            except InvalidProfileException as e:
+                logger.warning(e)
+                return None
+
+    def read_one(self, profile_name: str):
+        with trace.span('read profile', profile=profile_name):
+            profile = self._read_one(profile_name)
 
         if profile:
             return profile
         else:
             raise NoSuchProfileException(profile_name, self.read_locations)
 
+    def _read_one(self, profile_name: str) -> Optional[Profile]:
+        for profile_dir in self.read_locations:
+            profile_path = os.path.join(profile_dir, profile_name)
+            if not os.path.isfile(profile_path):
+                continue
+            with open(profile_path) as profile_file:
+                return self.read_file(profile_file)
+        return None
+
     def read_file(self, profile_file_descriptor) -> Profile:
         try:
             result = yaml.load(profile_file_descriptor, Loader=yaml.FullLoader)
@@ -66,17 +121,21 @@ class ProfileManager:
                                     "\n\tConsider changing to 'supports' or 'prefers'", profile_file_descriptor.name)
                         v['supports'] = v['mode']
                         del v['mode']
-                    rules[k] = Rule(**v)
+                    rules[k] = Rule.from_fields(v)
 
             primary = result.get('primary')
             outputs_raw = result['outputs']
             outputs = {}
             for name, mode_raw in outputs_raw.items():
-                outputs[name] = Output(**mode_raw)
+                outputs[name] = Output.from_fields(mode_raw)
+
+            hooks = result.get('hooks')
+            if hooks is not None and (not isinstance(hooks, dict) or len(set(hooks) - set(HOOK_STAGES)) > 0):
+                raise ValueError("unsupported hooks section")
 
             name = os.path.basename(profile_file_descriptor.name)
 
-            return Profile(name, outputs, rules, primary, priority)
+            return Profile(name, outputs, rules, primary, priority, hooks)
         except (KeyError, ValueError):
             raise InvalidProfileException(profile_file_descriptor.name)
 
@@ -84,19 +143,28 @@ class ProfileManager:
         """
         Write profile to file into configured profile directory.
         Profile name becomes the name of the file. If name contains illegal characters, only safe part is used.
-        For example, if name is my_home_vga/../../passwd, then file will be written as passwd under profile dir
+        For example, if name is my_home_vga/../../passwd, then file will be written as passwd under profile dir.
+        Profile is replaced atomically, concurrent readers see either previous or new version of it. Permissions of the
+        file are kept, if profile is a symlink, the file it points to is replaced
         """
-        os.makedirs(self.write_location, exist_ok=True)
         dict = p.to_dict()
         safename = os.path.basename(p.name)
         fullname = os.path.join(self.write_location, safename)
         if safename != p.name:
             logger.warning("Illegal name provided. Writing as %s", fullname)
-        with open(fullname, 'w+') as fp:
-            yaml.dump(dict, fp, default_flow_style=yaml_flow_style)
+        content = yaml.dump(dict, Dumper=Dumper, default_flow_style=yaml_flow_style)
+        target = os.path.realpath(fullname)
+        write_atomically(target, content, durable=True, mode=_file_mode(target))
+        if self.generation:
+            try:
+                self.generation.bump()
+            except OSError as e:
+                logger.warning("Cannot update profile catalogue generation: %s", e)
+        if self.name_cache:
+            self.name_cache.update()
 
     def print(self, p: Profile, yaml_flow_style: bool=False):
-        print(yaml.dump(p.to_dict(), default_flow_style=yaml_flow_style))
+        print(yaml.dump(p.to_dict(), Dumper=Dumper, default_flow_style=yaml_flow_style))
 
     def profile_from_xrandr(self, xrandr_connections: list, profile_name: str='profile'):
         outputs = {}
@@ -119,6 +187,59 @@ class ProfileManager:
         return Profile(profile_name, outputs, rules, primary)
 
 
+def is_profile_name(name: str) -> bool:
+    """
+    :return: False for hidden files (e.g. temporary files of profiles being written)
+    """
+    return not name.startswith('.')
+
+
+class ProfileIndex:
+    """
+    In-memory set of profiles updated file by file as profile files change, so long-running processes don't rescan
+    profile directories on every switch
+    """
+
+    def __init__(self, profile_manager: ProfileManager):
+        self.profile_manager = profile_manager
+        # {path: profile} in the order files were first seen
+        self._profiles = dict()
+
+    def load(self):
+        """
+        Reads all profiles from scratch
+        """
+        with trace.span('index profiles') as span:
+            self._profiles.clear()
+            for path in self.profile_manager.profile_paths():
+                self.update(path)
+            span.set(count=len(self._profiles))
+
+    def update(self, path: str) -> Optional[Profile]:
+        """
+        Re-reads single profile file. Profile is dropped if file is gone or invalid
+        :return: profile read, None if dropped
+        """
+        try:
+            profile = self.profile_manager.read_path(path)
+        except OSError as e:
+            logger.debug("Cannot read %s: %s", path, e)
+            profile = None
+        if profile is None:
+            self.remove(path)
+        else:
+            logger.debug("Indexed profile %s", path)
+            self._profiles[path] = profile
+        return profile
+
+    def remove(self, path: str):
+        if self._profiles.pop(path, None) is not None:
+            logger.debug("Removed profile %s from index", path)
+
+    def profiles(self) -> List[Profile]:
+        return list(self._profiles.values())
+
+
 class ProfileMatcher:
     """
     Matches profile to xrandr connections
@@ -127,33 +248,60 @@ class ProfileMatcher:
         """
         return a sorted list of matched profiles
         """
-        output_names = set(map(lambda o: o.name, xrandr_outputs))
+        with trace.span('match profiles', profiles=len(available_profiles)):
+            return self._match(available_profiles, xrandr_outputs)
 
-        # remove those with disconnected outputs
-        with_rules = filter(lambda p: p.match and len(p.match) > 0, available_profiles)
-        with_rules_covering_outputs = filter(lambda p: len(set(p.match) - output_names) == 0, with_rules)
-        profiles = list(with_rules_covering_outputs)
-
-        logger.debug("%d/%d profiles match outputs sets", len(profiles), len(available_profiles))
+    def _match(self, available_profiles: List[Profile],
+               xrandr_outputs: List[XrandrConnection]) -> List[Tuple[int, Profile]]:
+        matching = list(self.iter_matches(available_profiles, xrandr_outputs))
+        logger.debug("%d/%d profiles match outputs", len(matching), len(available_profiles))
+        return sorted(matching, key=lambda x: (x[0], x[1].priority), reverse=True)
 
-        matching: List[Tuple[int, Profile]] = []
+    def iter_matches(self, profiles: Iterable[Profile],
+                     xrandr_outputs: List[XrandrConnection]) -> Iterator[Tuple[int, Profile]]:
+        """
+        Lazily scores profiles in the order they are given
+        :return: iterator over (score, profile) of matching profiles
+        """
+        output_names = set(map(lambda o: o.name, xrandr_outputs))
         for p in profiles:
+            # skip those without rules and with disconnected outputs
+            if not p.match or len(set(p.match) - output_names) > 0:
+                continue
             score = self._calculate_profile_score(p, xrandr_outputs)
             if score >= 0:
-                matching.append((score, p))
-        return sorted(matching, key=lambda x: (x[0], x[1].priority), reverse=True)
+                yield score, p
 
-    def find_best(self, available_profiles: List[Profile], xrandr_outputs: List[XrandrConnection]) -> Optional[Profile]:
+    def top(self, profiles: Iterable[Profile], xrandr_outputs: List[XrandrConnection],
+            k: Optional[int]) -> List[Tuple[int, Profile]]:
+        """
+        Streaming counterpart of match. Only k best matches are kept while profiles are consumed
+        :param k: keep all matches if None
+        :return: sorted list of at most k best matches, ordered the same way as by match
+        """
+        heap = []
+        # profiles being streamed are read within the span, see 'read profile' spans nested in it
+        with trace.span('match profiles', k=k):
+            for i, (score, p) in enumerate(self.iter_matches(profiles, xrandr_outputs)):
+                # earlier profile wins a tie, index also guarantees profiles are never compared
+                item = (score, p.priority, -i, p)
+                if k is None or len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        return [(score, p) for score, _, _, p in sorted(heap, reverse=True)]
+
+    def find_best(self, available_profiles: Iterable[Profile],
+                  xrandr_outputs: List[XrandrConnection]) -> Optional[Profile]:
         """
         Find first matching profile across availableProfiles for actualConnections
         """
-        matching = self.match(available_profiles, xrandr_outputs)
+        best = self.top(available_profiles, xrandr_outputs, 1)
 
-        if not matching:
+        if not best:
             return None
 
-        max_score, p = matching[0]
-        logger.debug("Found %d profiles with maximum score %d", len(matching), max_score)
+        max_score, p = best[0]
         logger.debug("Selected profile %s with score %d and priority %d", p.name, max_score, p.priority)
         return p
 
@@ -197,8 +345,72 @@ class ProfileMatcher:
                 return -1
 
         if rule.supports:
-            if xrandr_output.display.supported_modes.count(rule.supports) > 0:
+            if rule.supports in xrandr_output.display.modes:
+                score += 1
+            else:
+                return -1
+
+        if rule.rate_hz is not None:
+            if xrandr_output.display.modes.supports_rate(rule.rate_hz, rule.supports or rule.prefers):
                 score += 1
             else:
                 return -1
         return score
+
+
+class ProfileChecker:
+    """
+    Finds settings of profiles that connected hardware can't apply. Facts about outputs are collected once, so a whole
+    catalogue can be checked cheaply
+    """
+
+    def __init__(self, xrandr_outputs: List[XrandrConnection]):
+        """
+        :param xrandr_outputs: all outputs, not only connected ones
+        """
+        self.outputs = {o.name: o for o in xrandr_outputs}
+        crtcs = [o.crtcs for o in xrandr_outputs if o.crtcs is not None]
+        # CRTCs are not reported by xrandr -q
+        self.crtcs = set().union(*crtcs) if crtcs else None
+
+    def check_all(self, profiles: List[Profile]) -> List[Tuple[Profile, List[str]]]:
+        """
+        :return: list of (profile, problems) for every profile
+        """
+        with trace.span('check profiles', profiles=len(profiles)):
+            return [(p, self.check(p)) for p in profiles]
+
+    def check(self, profile: Profile) -> List[str]:
+        """
+        :return: human readable descriptions of settings that can't be applied, empty list if profile is applicable
+        """
+        problems = []
+        assigned = dict()
+        for name, output in profile.outputs.items():
+            connection = self.outputs.get(name)
+            if connection is None:
+                problems.append("{} doesn't exist".format(name))
+                continue
+            display = connection.display
+            if display is None:
+                problems.append("{} is not connected".format(name))
+                continue
+            if output.mode not in display.modes:
+                problems.append("{} doesn't support mode {}".format(name, output.mode))
+            elif output.rate_hz is not None and not display.modes.supports_rate(output.rate_hz, output.mode):
+                problems.append("{} doesn't support {} at {}Hz".format(name, output.mode, output.rate))
+            if output.crtc is not None:
+                if connection.crtcs is not None and output.crtc not in connection.crtcs:
+                    problems.append("{} can't be driven by CRTC {}".format(name, output.crtc))
+                elif output.crtc in assigned:
+                    problems.append("{} and {} are assigned to the same CRTC {}".format(
+                        assigned[output.crtc], name, output.crtc))
+                assigned[output.crtc] = name
+
+        if self.crtcs is not None:
+            if len(profile.outputs) > len(self.crtcs):
+                problems.append("{} outputs are enabled, but only {} CRTCs are available".format(
+                    len(profile.outputs), len(self.crtcs)))
+            elif not problems and plan_crtcs(profile, list(self.outputs.values())) is None:
+                problems.append("outputs can't be driven by distinct CRTCs")
+        return problems
@@ -0,0 +1,345 @@
+# Minimal X11 client receiving RandR output change events.
+#
+# Speaks X11 wire protocol over the X server socket directly, so neither xrandr nor libX11 is needed. Only the requests
+# necessary to learn current state of outputs and to subscribe to RRNotify events are implemented. Client byte order is
+# little-endian, X server replies and sends events in the byte order of the client.
+import logging
+import os
+import socket
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from randrctl.exception import XConnectionException
+
+logger = logging.getLogger(__name__)
+
+X_TCP_PORT = 6000
+UNIX_SOCKET = '/tmp/.X11-unix/X{}'
+DEFAULT_CONNECT_TIMEOUT = 5
+
+MIT_MAGIC_COOKIE = b'MIT-MAGIC-COOKIE-1'
+FAMILY_LOCAL = 256
+FAMILY_WILD = 65535
+
+# core protocol
+X_QUERY_EXTENSION = 98
+X_ERROR = 0
+X_REPLY = 1
+X_GENERIC_EVENT = 35
+
+# RandR extension
+RR_QUERY_VERSION = 0
+RR_SELECT_INPUT = 4
+RR_GET_SCREEN_RESOURCES = 8
+RR_GET_OUTPUT_INFO = 9
+RR_GET_SCREEN_RESOURCES_CURRENT = 25
+RR_OUTPUT_CHANGE_NOTIFY_MASK = 1 << 2
+# RRNotify event is first event of the extension + 1, its subcode tells what changed
+RR_NOTIFY = 1
+RR_NOTIFY_OUTPUT_CHANGE = 1
+
+CONNECTED = 0
+DISCONNECTED = 1
+UNKNOWN_CONNECTION = 2
+CONNECTION_NAMES = {CONNECTED: 'connected', DISCONNECTED: 'disconnected', UNKNOWN_CONNECTION: 'unknown connection'}
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b'\0' * (-len(data) % 4)
+
+
+def parse_display(display: str) -> Tuple[str, int, int]:
+    """
+    :param display: X display name, e.g. :0, :1.0, unix:0 or host:0
+    :return: (host, display number, screen), host is empty for local displays
+    """
+    host, colon, rest = (display or '').rpartition(':')
+    number, _, screen = rest.partition('.')
+    if not colon or not number.isdigit() or (screen and not screen.isdigit()):
+        raise XConnectionException("Invalid display '{}'".format(display))
+    if host == 'unix':
+        host = ''
+    return host, int(number), int(screen or 0)
+
+
+def read_xauthority(path: str) -> List[Tuple[int, bytes, bytes, bytes, bytes]]:
+    """
+    :return: list of (family, address, display number, auth name, auth data)
+    """
+    entries = []
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.debug("Cannot read %s: %s", path, e)
+        return entries
+
+    offset = 0
+    try:
+        while offset < len(data):
+            family, = struct.unpack_from('>H', data, offset)
+            offset += 2
+            fields = []
+            for _ in range(4):
+                length, = struct.unpack_from('>H', data, offset)
+                offset += 2
+                fields.append(data[offset:offset + length])
+                offset += length
+            entries.append((family, *fields))
+    except struct.error:
+        logger.debug("%s is truncated", path)
+    return entries
+
+
+def _cookie(xauthority: Optional[str], host: str, number: int) -> Tuple[bytes, bytes]:
+    """
+    :return: (auth name, auth data), empty if no cookie is found
+    """
+    if not xauthority:
+        xauthority = os.environ.get('XAUTHORITY') or os.path.expanduser('~/.Xauthority')
+    hostname = socket.gethostname().encode()
+    number = str(number).encode()
+    fallback = None
+    for family, address, entry_number, name, data in read_xauthority(xauthority):
+        if name != MIT_MAGIC_COOKIE or entry_number not in (number, b''):
+            continue
+        if family == FAMILY_WILD or (not host and family == FAMILY_LOCAL and address == hostname):
+            return name, data
+        if fallback is None:
+            # e.g. container with hostname different from the one cookie was issued for
+            fallback = (name, data)
+    return fallback or (b'', b'')
+
+
+def _connect(host: str, number: int, timeout: float) -> socket.socket:
+    if host:
+        return socket.create_connection((host, X_TCP_PORT + number), timeout)
+
+    path = UNIX_SOCKET.format(number)
+    error = None
+    # abstract socket is the only one reachable from some containers
+    for address in (path, '\0' + path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error
+
+
+class RandrEvents:
+    """
+    Connection to X server reporting outputs being connected or disconnected. Changes are detected by comparing output
+    connection status carried by RRNotify events with the last known one, so reconfiguration of outputs (including the
+    one made by randrctl itself) is not reported
+    """
+
+    def __init__(self, display: str, xauthority: str = None, timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        host, number, screen = parse_display(display)
+        try:
+            self._socket = _connect(host, number, timeout)
+        except OSError as e:
+            raise XConnectionException("Cannot connect to X display '{}': {}".format(display, e))
+        self._buffer = bytearray()
+        self._sequence = 0
+        # events received while waiting for replies
+        self._pending: List[bytes] = []
+        try:
+            root = self._setup(*_cookie(xauthority, host, number), screen)
+            self._major, self._first_event = self._query_extension(b'RANDR')
+            version = self._query_version()
+            if version < (1, 2):
+                raise XConnectionException("RandR {}.{} is too old, 1.2 is required".format(*version))
+            self._names, self._connections = self._outputs(root, version)
+            logger.debug("Outputs: %s", {self._names[o]: CONNECTION_NAMES.get(c) for o, c in self._connections.items()})
+            self._request(self._major, RR_SELECT_INPUT, struct.pack('<IHxx', root, RR_OUTPUT_CHANGE_NOTIFY_MASK))
+        except OSError as e:
+            self.close()
+            raise XConnectionException("X display '{}' failed: {}".format(display, e))
+        except BaseException:
+            self.close()
+            raise
+        self._socket.setblocking(False)
+
+    def fileno(self) -> int:
+        return self._socket.fileno()
+
+    def close(self):
+        self._socket.close()
+
+    def connections(self) -> Dict[str, int]:
+        """
+        :return: {output name: connection status} as last reported by X server
+        """
+        return {self._names.get(o, str(o)): c for o, c in self._connections.items()}
+
+    def read(self) -> List[Tuple[str, int]]:
+        """
+        Reads events available without blocking
+        :return: list of (output name, new connection status) of outputs which connection status changed
+        """
+        try:
+            data = self._socket.recv(65536)
+        except BlockingIOError:
+            data = None
+        if data == b'':
+            raise XConnectionException("X server closed connection")
+        if data:
+            self._buffer += data
+
+        changes = []
+        packets, self._pending = self._pending, []
+        packet = self._take()
+        while packet is not None:
+            packets.append(packet)
+            packet = self._take()
+        for packet in packets:
+            change = self._output_change(packet)
+            if change is not None:
+                changes.append(change)
+        return changes
+
+    def _output_change(self, event: bytes) -> Optional[Tuple[str, int]]:
+        code = event[0] & 0x7f
+        if code != self._first_event + RR_NOTIFY or event[1] != RR_NOTIFY_OUTPUT_CHANGE:
+            return None
+        output, = struct.unpack_from('<I', event, 16)
+        connection = event[30]
+        previous = self._connections.get(output)
+        self._connections[output] = connection
+        if previous == connection:
+            return None
+        name = self._names.get(output, str(output))
+        logger.debug("%s is %s", name, CONNECTION_NAMES.get(connection, connection))
+        return name, connection
+
+    # wire protocol
+
+    def _send(self, data: bytes):
+        self._socket.sendall(data)
+
+    def _recv(self, size: int) -> bytes:
+        """
+        Blocks until size bytes are received
+        """
+        while len(self._buffer) < size:
+            data = self._socket.recv(65536)
+            if not data:
+                raise XConnectionException("X server closed connection")
+            self._buffer += data
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _take(self) -> Optional[bytes]:
+        """
+        :return: next complete reply, error or event from buffer, None if there's none
+        """
+        if len(self._buffer) < 32:
+            return None
+        size = 32
+        if self._buffer[0] == X_REPLY or self._buffer[0] & 0x7f == X_GENERIC_EVENT:
+            size += 4 * struct.unpack_from('<I', self._buffer, 4)[0]
+        if len(self._buffer) < size:
+            return None
+        packet = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return packet
+
+    def _packet(self) -> bytes:
+        """
+        Blocks until next reply, error or event is received
+        """
+        header = self._recv(32)
+        if header[0] == X_REPLY or header[0] & 0x7f == X_GENERIC_EVENT:
+            return header + self._recv(4 * struct.unpack_from('<I', header, 4)[0])
+        return header
+
+    def _request(self, major: int, minor: int, body: bytes = b'') -> int:
+        """
+        :return: sequence number of request
+        """
+        body = _pad(body)
+        self._send(struct.pack('<BBH', major, minor, 1 + len(body) // 4) + body)
+        self._sequence = (self._sequence + 1) & 0xffff
+        return self._sequence
+
+    def _reply(self, sequence: int) -> bytes:
+        while True:
+            packet = self._packet()
+            packet_sequence, = struct.unpack_from('<H', packet, 2)
+            if packet[0] == X_ERROR and packet_sequence == sequence:
+                raise XConnectionException("X request failed with error {}".format(packet[1]))
+            if packet[0] == X_REPLY and packet_sequence == sequence:
+                return packet
+            if packet[0] != X_REPLY and packet[0] != X_ERROR:
+                self._pending.append(packet)
+
+    def _setup(self, auth_name: bytes, auth_data: bytes, screen: int) -> int:
+        """
+        :return: root window of screen
+        """
+        self._send(struct.pack('<BxHHHHxx', ord('l'), 11, 0, len(auth_name), len(auth_data)) +
+                   _pad(auth_name) + _pad(auth_data))
+        status, reason_length, _, _, length = struct.unpack('<BBHHH', self._recv(8))
+        data = self._recv(4 * length)
+        if status != 1:
+            reason = data[:reason_length] if status == 0 else data
+            raise XConnectionException("X server refused connection: {}".format(
+                reason.decode(errors='replace').strip('\0 \n')))
+
+        vendor_length, = struct.unpack_from('<H', data, 16)
+        screens, formats = data[20], data[21]
+        offset = 32 + len(_pad(b'\0' * vendor_length)) + 8 * formats
+        if screen >= screens:
+            raise XConnectionException("X server has no screen {}".format(screen))
+        for _ in range(screen):
+            # skip SCREEN with its DEPTHs and VISUALTYPEs
+            depths = data[offset + 39]
+            offset += 40
+            for _ in range(depths):
+                visuals, = struct.unpack_from('<H', data, offset + 2)
+                offset += 8 + 24 * visuals
+        root, = struct.unpack_from('<I', data, offset)
+        return root
+
+    def _query_extension(self, name: bytes) -> Tuple[int, int]:
+        """
+        :return: (major opcode, first event) of extension
+        """
+        reply = self._reply(self._request(X_QUERY_EXTENSION, 0, struct.pack('<Hxx', len(name)) + name))
+        present, major, first_event = struct.unpack_from('<BBB', reply, 8)
+        if not present:
+            raise XConnectionException("X server doesn't support {}".format(name.decode()))
+        return major, first_event
+
+    def _query_version(self) -> Tuple[int, int]:
+        reply = self._reply(self._request(self._major, RR_QUERY_VERSION, struct.pack('<II', 1, 5)))
+        return struct.unpack_from('<II', reply, 8)
+
+    def _outputs(self, root: int, version: Tuple[int, int]) -> Tuple[Dict[int, str], Dict[int, int]]:
+        """
+        :return: ({output: name}, {output: connection status})
+        """
+        # current resources don't make X server probe hardware
+        minor = RR_GET_SCREEN_RESOURCES_CURRENT if version >= (1, 3) else RR_GET_SCREEN_RESOURCES
+        reply = self._reply(self._request(self._major, minor, struct.pack('<I', root)))
+        config_timestamp, crtcs, outputs = struct.unpack_from('<IHH', reply, 12)
+        ids = struct.unpack_from('<{}I'.format(outputs), reply, 32 + 4 * crtcs)
+
+        # requests are pipelined, replies come in the same order
+        sequences = [self._request(self._major, RR_GET_OUTPUT_INFO, struct.pack('<II', output, config_timestamp))
+                     for output in ids]
+        names = dict()
+        connections = dict()
+        for output, sequence in zip(ids, sequences):
+            reply = self._reply(sequence)
+            connection = reply[24]
+            crtcs, modes, _, clones, name_length = struct.unpack_from('<HHHHH', reply, 26)
+            name_offset = 36 + 4 * (crtcs + modes + clones)
+            names[output] = reply[name_offset:name_offset + name_length].decode(errors='replace')
+            connections[output] = connection
+        return names, connections
@@ -0,0 +1,54 @@
+# randrctl completion
+#
+# Profile names are read from the cache maintained by randrctl, so no python interpreter is started on TAB.
+# Everything else, as well as profile names when the cache is missing or stale, is completed by argcomplete.
+
+@ARGCOMPLETE@
+
+_randrctl_fallback="$(complete -p randrctl 2>/dev/null | sed -n 's/.* -F \([^ ]*\) .*/\1/p')"
+
+_randrctl_cached_profiles() {
+    local cache="${XDG_CACHE_HOME:-$HOME/.cache}/randrctl"
+    local names="$cache/@PROFILE_CACHE@" dirs="$cache/@PROFILE_DIRS_CACHE@" dir
+    local recorded="$cache/@PROFILE_GENERATION_CACHE@" generation=0 built
+    [ -r "$names" ] && [ -r "$dirs" ] && [ -r "$recorded" ] || return 1
+    # profiles written by randrctl bump the generation
+    [ -r "$cache/@GENERATION@" ] && read -r generation < "$cache/@GENERATION@"
+    read -r built < "$recorded"
+    [ "$generation" = "$built" ] || return 1
+    while IFS= read -r dir; do
+        [ "$dir" -nt "$names" ] && return 1
+    done < "$dirs"
+    cat "$names"
+}
+
+_randrctl() {
+    local cur="${COMP_WORDS[COMP_CWORD]}" command="" i profiles
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        case "${COMP_WORDS[i]}" in
+            -*) ;;
+            *) command="${COMP_WORDS[i]}"; break ;;
+        esac
+    done
+
+    if [ -z "$command" ] && [[ "$cur" != -* ]]; then
+        COMPREPLY=($(compgen -W "@COMMANDS@" -- "$cur"))
+        return 0
+    fi
+
+    case " @PROFILE_COMMANDS@ " in
+        *" $command "*)
+            if [[ "$cur" != -* ]] && profiles="$(_randrctl_cached_profiles)"; then
+                local IFS=$'\n'
+                COMPREPLY=($(compgen -W "$profiles" -- "$cur"))
+                return 0
+            fi
+            ;;
+    esac
+
+    if [ -n "$_randrctl_fallback" ]; then
+        "$_randrctl_fallback" "$@"
+    fi
+}
+
+complete -o nospace -o default -o bashdefault -F _randrctl randrctl
@@ -0,0 +1,28 @@
+# randrctl completion
+#
+# Profile names are read from the cache maintained by randrctl, so no python interpreter is started on TAB.
+# If the cache is missing or stale, randrctl itself is asked for the list of profiles.
+
+function __randrctl_cached_profiles
+    set -l cache $HOME/.cache/randrctl
+    set -q XDG_CACHE_HOME; and set cache $XDG_CACHE_HOME/randrctl
+    set -l names $cache/@PROFILE_CACHE@
+    test -r $names; and test -r $cache/@PROFILE_DIRS_CACHE@; and test -r $cache/@PROFILE_GENERATION_CACHE@; or return 1
+    # profiles written by randrctl bump the generation
+    set -l generation 0
+    test -r $cache/@GENERATION@; and read generation < $cache/@GENERATION@
+    read -l built < $cache/@PROFILE_GENERATION_CACHE@
+    test "$generation" = "$built"; or return 1
+    for dir in (cat $cache/@PROFILE_DIRS_CACHE@)
+        command test $dir -nt $names; and return 1
+    end
+    cat $names
+end
+
+function __randrctl_profiles
+    __randrctl_cached_profiles; or randrctl list 2>/dev/null
+end
+
+complete -c randrctl -f
+complete -c randrctl -n __fish_use_subcommand -a "@COMMANDS@"
+complete -c randrctl -n "__fish_seen_subcommand_from @PROFILE_COMMANDS@" -a "(__randrctl_profiles)"
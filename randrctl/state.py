@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+
+from randrctl.cache import write_atomically
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "state{}.json"
+DRM_DIR = "/sys/class/drm"
+
+
+def fingerprint(xrandr_connections: list) -> str:
+    """
+    Identifies set of connected displays: output names along with displays' EDIDs
+    """
+    connected = sorted((c.name, c.display.edid or '') for c in xrandr_connections if c.display is not None)
+    return hashlib.md5(json.dumps(connected).encode()).hexdigest()
+
+
+def drm_connectors(drm_dir: str = DRM_DIR) -> dict:
+    """
+    Reads connection status of every DRM connector from sysfs. This is much cheaper than querying X server
+    :return: {connector: status}, e.g. {"card0-eDP-1": "connected"}
+    """
+    connectors = dict()
+    try:
+        entries = os.listdir(drm_dir)
+    except OSError:
+        return connectors
+    for entry in entries:
+        if '-' not in entry:
+            continue
+        try:
+            with open(os.path.join(drm_dir, entry, 'status')) as f:
+                connectors[entry] = f.read().strip()
+        except OSError:
+            continue
+    return connectors
+
+
+class AppliedState:
+    """
+    Last applied profile persisted by successful switches, so it can be reported without calling xrandr
+    """
+
+    def __init__(self, cache_dir: str, display: Optional[str] = None, drm_dir: str = DRM_DIR):
+        """
+        :param display: state is kept per X display, e.g. state-0.json for :0
+        """
+        suffix = '-' + display.lstrip(':') if display else ''
+        self.path = os.path.join(cache_dir, STATE_NAME.format(suffix))
+        self.drm_dir = drm_dir
+
+    def save(self, profile, xrandr_connections: List):
+        state = {
+            'profile': profile.name,
+            'applied_at': time.time(),
+            'primary': profile.primary,
+            'outputs': dict(map(lambda kv: (kv[0], kv[1].to_dict()), profile.outputs.items())),
+            'fingerprint': fingerprint(xrandr_connections),
+            'connectors': drm_connectors(self.drm_dir),
+        }
+        try:
+            write_atomically(self.path, json.dumps(state))
+        except OSError as e:
+            logger.warning("Cannot save state to %s: %s", self.path, e)
+
+    def load(self) -> Optional[dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot read state from %s: %s", self.path, e)
+            return None
+
+    def status(self) -> Optional[dict]:
+        """
+        :return: last applied state with 'stale' flag added. stale is True if connected displays might have changed
+        since, None if it can't be determined. None is returned if nothing was applied yet
+        """
+        state = self.load()
+        if state is None:
+            return None
+        saved = state.get('connectors')
+        if not saved:
+            state['stale'] = None
+        else:
+            state['stale'] = drm_connectors(self.drm_dir) != saved
+        return state
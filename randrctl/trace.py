@@ -0,0 +1,141 @@
+# Phase-level tracing in Chrome trace-event format (can be opened in Perfetto or chrome://tracing).
+#
+# Tracing is enabled by setting RANDRCTL_TRACE to the path of the output file (%p in the path is replaced with pid).
+# When it's not set, span() returns a shared no-op context manager, so instrumented code pays only for a function call.
+import os
+import time
+
+TRACE_ENV = 'RANDRCTL_TRACE'
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, tracer: 'Tracer', name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = repr(exc)
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), **self.args)
+        return False
+
+    def set(self, **args):
+        """
+        Adds arguments known only inside the span
+        """
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    Collects trace events in memory and writes them to a file on exit
+    """
+
+    def __init__(self, path: str):
+        import _thread
+        self.path = path.replace('%p', str(os.getpid()))
+        self.pid = os.getpid()
+        self.events = []
+        self._get_ident = _thread.get_ident
+
+    def record(self, name: str, start_ns: int, end_ns: int, tid: int = None, **args):
+        """
+        Records complete event. Timestamps are in perf_counter_ns() clock
+        """
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': start_ns / 1000,
+            'dur': (end_ns - start_ns) / 1000,
+            'pid': self.pid,
+            'tid': self._get_ident() if tid is None else tid,
+            'args': args,
+        })
+
+    def name_thread(self, tid: int, name: str):
+        self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+
+    def write(self):
+        import json
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def _process_start_ns():
+    """
+    :return: start time of the current process in perf_counter_ns() clock or None if it can't be determined
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # command name may contain spaces, fields after it are space separated
+            fields = f.read().rsplit(')', 1)[1].split()
+        started_after_boot = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        since_start = time.clock_gettime(time.CLOCK_BOOTTIME) - started_after_boot
+        return time.perf_counter_ns() - int(since_start * 1e9)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+_tracer = None
+
+
+def _init():
+    global _tracer
+    path = os.environ.get(TRACE_ENV)
+    if not path:
+        return
+    import atexit
+    _tracer = Tracer(path)
+    start = _process_start_ns()
+    if start is not None:
+        _tracer.record('interpreter startup', start, time.perf_counter_ns())
+    atexit.register(_tracer.write)
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **args):
+    """
+    Context manager measuring enclosed block
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _Span(_tracer, name, args)
+
+
+def record(name: str, start_ns: int, end_ns: int, tid: int = None, **args):
+    """
+    Records event with known start and end (e.g. processes running concurrently)
+    """
+    if _tracer is not None:
+        _tracer.record(name, start_ns, end_ns, tid, **args)
+
+
+def name_thread(tid: int, name: str):
+    if _tracer is not None:
+        _tracer.name_thread(tid, name)
+
+
+_init()
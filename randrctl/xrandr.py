@@ -1,17 +1,64 @@
 import os
 
-from functools import reduce, lru_cache
 import logging
+import random
 import re
 import subprocess
+import threading
+import time
 from typing import List, Optional
 
-from randrctl import DISPLAY, XAUTHORITY
-from randrctl.exception import XrandrException, ParseException
-from randrctl.model import Profile, Viewport, XrandrConnection, Display
+from randrctl import DISPLAY, XAUTHORITY, trace
+from randrctl.exception import XrandrException, XrandrTimeoutException, ParseException
+from randrctl.model import Profile, Viewport, XrandrConnection, Display, ModeTable
+from randrctl.parser import OutputRecord, XrandrParser, parse
+from randrctl.planner import plan_crtcs
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 65536
+
+DEFAULT_XRANDR_TIMEOUT = 20
+DEFAULT_XRANDR_RETRIES = 2
+DEFAULT_XRANDR_BACKOFF = 0.5
+# errors reported by some docks on the first modeset, which succeeds if repeated a moment later
+DEFAULT_RETRY_ON = [r"Configure crtc \d+ failed"]
+
+
+class XrandrPolicy:
+    """
+    How xrandr is executed: deadline of a single call, which failures are transient and how they are retried
+    """
+
+    def __init__(self, timeout: Optional[float] = DEFAULT_XRANDR_TIMEOUT, retries: int = DEFAULT_XRANDR_RETRIES,
+                 backoff: float = DEFAULT_XRANDR_BACKOFF, retry_on: list = None):
+        """
+        :param timeout: seconds to wait for a single xrandr call before it's killed, wait forever if None
+        :param retries: how many times a call failed with transient error is repeated
+        :param backoff: delay before the first retry in seconds, doubled with every subsequent retry
+        :param retry_on: regular expressions matching transient errors reported by xrandr
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = [re.compile(pattern) for pattern in (DEFAULT_RETRY_ON if retry_on is None else retry_on)]
+
+    def retryable(self, e: XrandrException, attempt: int) -> bool:
+        """
+        :param attempt: number of the failed attempt, starting with 0
+        :return: True if call is worth repeating. Timeouts are never retried, X server is likely to be wedged
+        """
+        if attempt >= self.retries or isinstance(e, XrandrTimeoutException):
+            return False
+        err = str(e)
+        return any(pattern.search(err) for pattern in self.retry_on)
+
+    def delay(self, attempt: int) -> float:
+        """
+        :return: seconds to wait before the next attempt, exponential backoff with full jitter around it
+        """
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
 
 class Xrandr:
     """
@@ -30,18 +77,22 @@ class Xrandr:
     QUERY_KEY = "-q"
     VERBOSE_KEY = "--verbose"
     OFF_KEY = "--off"
-    OUTPUT_DETAILS_REGEX = re.compile(
-        r'(?P<primary>primary )?(?P<geometry>[\dx\+]+) (?:(?P<rotate>\w+) )?.*?(?:panning (?P<panning>[\dx\+]+))?$')
     MODE_REGEX = re.compile(r"(\d+x\d+)\+(\d+\+\d+)")
-    CURRENT_MODE_REGEX = re.compile(r"\s*(\S+)\s+([0-9\.]+)(.*$)")
 
-    def __init__(self, display: Optional[str], xauthority: Optional[str]):
+    def __init__(self, display: Optional[str], xauthority: Optional[str], policy: XrandrPolicy = None):
+        """
+        :param policy: deadline and retries of xrandr calls, defaults are used if None
+        """
+        self.policy = policy or XrandrPolicy()
         env = dict(os.environ)
         if display:
             env[DISPLAY] = display
         if xauthority:
             env[XAUTHORITY] = xauthority
         self.env = env
+        # results of xrandr calls by arguments and parsed query, kept until refresh
+        self._results = dict()
+        self._records: Optional[List[OutputRecord]] = None
 
     def apply(self, profile: Profile):
         """
@@ -52,35 +103,88 @@ class Xrandr:
         args = self._compose_mode_args(profile, self.get_all_outputs())
         self._xrandr(*args)
 
-    @lru_cache()
+    def restore_args(self, snapshot: Profile, xrandr_connections: List[XrandrConnection]) -> list:
+        """
+        Precomputes arguments of xrandr call restoring layout captured in snapshot
+        """
+        return self._compose_mode_args(snapshot, xrandr_connections)
+
+    def restore(self, args: list):
+        """
+        Restores layout in a single xrandr call, which is neither cached nor retried
+        """
+        logger.debug("Restoring previous layout")
+        self._run(self._command(args))
+
+    def refresh(self):
+        """
+        Forgets results of previous xrandr calls of this instance, so that the next query reports current state.
+        Long-running processes call it before every switch
+        """
+        self._results.clear()
+        self._records = None
+
     def _xrandr(self, *args):
         """
-        Perform call to xrandr executable with passed arguments.
-        Returns subprocess.Popen object
+        Perform call to xrandr executable with passed arguments. Transient failures are retried according to policy.
+        Returns list of output lines. Result is reused until refresh
         """
+        if args not in self._results:
+            self._results[args] = self._retrying(self._run, self._command(args))
+        return self._results[args]
+
+    def _run(self, args: list) -> list:
+        with trace.span('xrandr', argv=args):
+            try:
+                p = subprocess.run(args, capture_output=True, shell=False, env=self.env, timeout=self.policy.timeout)
+            except subprocess.TimeoutExpired:
+                # subprocess.run kills xrandr before raising
+                raise XrandrTimeoutException(self.policy.timeout, args)
+        return self._output_lines(args, p.stdout, p.stderr)
+
+    def _retrying(self, call, args: list):
+        attempt = 0
+        while True:
+            try:
+                return call(args)
+            except XrandrException as e:
+                if not self.policy.retryable(e, attempt):
+                    raise
+                delay = self.policy.delay(attempt)
+                logger.warning("xrandr failed: %s. Retrying in %.2fs", str(e).strip(), delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _command(self, args: tuple) -> list:
         args = list(args)
         logger.debug("Calling xrandr with args %s", args)
         args.insert(0, "xrandr")
+        return args
 
-        p = subprocess.run(args, capture_output=True, shell=False, env=self.env)
-        err = p.stderr
-        if err:
-            err_str = err.decode()
+    def _output_lines(self, args: list, stdout: bytes, stderr: bytes) -> list:
+        """
+        Checks result of xrandr execution and splits its output into lines
+        """
+        if stderr:
+            err_str = stderr.decode()
             raise XrandrException(err_str, args)
-        out = list(map(lambda x: x.decode(), p.stdout.splitlines()))
+        out = list(map(lambda x: x.decode(), stdout.splitlines()))
         if out:
             out.pop(0)  # remove first line. It describes Screen
         return out
 
     def _compose_mode_args(self, profile: Profile, xrandr_connections: list):
         """
-        Composes list of arguments to xrandr to apply profile settings and disable the other outputs
+        Composes list of arguments to xrandr to apply profile settings and disable the other outputs.
+        If CRTCs can be planned, outputs are disabled first to free their CRTCs and every enabled output is given one
         """
+        plan = plan_crtcs(profile, xrandr_connections)
+
         args = []
-        active_names = []
+        if plan is not None:
+            args.extend(self._off_args(profile, xrandr_connections))
 
         for name, o in profile.outputs.items():
-            active_names.append(name)
             args.append(self.OUTPUT_KEY)
             args.append(name)
             args.append(self.MODE_KEY)
@@ -98,194 +202,171 @@ class Xrandr:
                 args.append(str(o.rate))
             if name == profile.primary:
                 args.append(self.PRIMARY_KEY)
-            if o.crtc is not None:
+            crtc = plan[name] if plan is not None else o.crtc
+            if crtc is not None:
                 args.append(self.CRTC_KEY)
-                args.append(str(o.crtc))
+                args.append(str(crtc))
+
+        if plan is None:
+            args.extend(self._off_args(profile, xrandr_connections))
 
-        # turn off the others
+        return args
+
+    def _off_args(self, profile: Profile, xrandr_connections: list):
+        """
+        Composes arguments to turn off outputs not used by profile
+        """
+        args = []
         for c in xrandr_connections:
-            if active_names.count(c.name) == 0:
+            if c.name not in profile.outputs:
                 args.append(self.OUTPUT_KEY)
                 args.append(c.name)
                 args.append(self.OFF_KEY)
-
         return args
 
     def get_all_outputs(self) -> List[XrandrConnection]:
         """
         Query xrandr for all supported outputs.
-        Performs call to xrandr with -q key and parses output.
+        Performs call to xrandr with -q and --verbose keys and parses output.
         Returns list of outputs with some properties missing (only name and status are guaranteed)
         """
-        outputs = []
-
-        items = self._xrandr(self.QUERY_KEY)
-        items = self._group_query_result(items)
-        logger.debug("Detected total %d outputs", len(items))
-        crtcs = self._get_verbose_fields('CRTC')
-
-        for i in items:
-            o = self._parse_xrandr_connection(i)
-            o.crtc = int(crtcs[o.name]) if o.name in crtcs and len(crtcs[o.name]) else None
-            outputs.append(o)
-
-        return outputs
+        return self._outputs(self._query())
 
     def get_connected_outputs(self) -> List[XrandrConnection]:
         """
         Query xrandr and return list of connected outputs.
-        Performs call to xrandr with -q and --verbose keys.
         Returns list of connected outputs with all properties set
         """
         outputs = list(filter(lambda o: o.display is not None, self.get_all_outputs()))
-        edids = self._get_verbose_fields('EDID')
-        for o in outputs:
-            o.display.edid = edids[o.name]
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug("Connected outputs: %s", list(map(lambda o: o.name, outputs)))
         return outputs
 
-    def _get_verbose_fields(self, field: str) -> dict:
+    def _query(self) -> List[OutputRecord]:
         """
-        Get particular field of all connected displays.
-        Return dictionary of {"connection_name": field_value}
+        Runs xrandr -q --verbose once until refresh, its output is parsed while it's read
         """
-        ret = dict()
+        if self._records is None:
+            self._records = self._retrying(self._stream, self._command((self.QUERY_KEY, self.VERBOSE_KEY)))
+        return self._records
 
-        items = self._xrandr(self.QUERY_KEY, self.VERBOSE_KEY)
-        items = self._group_query_result(items)
-        items = filter(lambda x: x[0].find(' connected') > 0, items)
-
-        for i in items:
-            name_idx = i[0].find(' ')
-            name = i[0][:name_idx]
-            ret[name] = self._field_from_query_item(i, field)
-
-        return ret
-
-    def _field_from_query_item(self, item_lines: list, field: str) -> str:
+    def _stream(self, args: list) -> List[OutputRecord]:
+        """
+        Perform call to xrandr executable with passed arguments, feeding its output to the parser as it arrives.
+        Returns list of parsed output records
         """
-        Extracts display field from xrandr --verbose output
+        parser = XrandrParser()
+        records = []
+        with trace.span('xrandr', argv=args):
+            with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False,
+                                  env=self.env) as p:
+                timed_out = threading.Event()
+
+                def kill():
+                    timed_out.set()
+                    p.kill()
+
+                killer = None
+                if self.policy.timeout is not None:
+                    killer = threading.Timer(self.policy.timeout, kill)
+                    killer.start()
+                try:
+                    fd = p.stdout.fileno()
+                    chunk = os.read(fd, CHUNK_SIZE)
+                    while chunk:
+                        records.extend(parser.feed(chunk))
+                        chunk = os.read(fd, CHUNK_SIZE)
+                    stderr = p.stderr.read()
+                    p.wait()
+                finally:
+                    if killer is not None:
+                        killer.cancel()
+        if timed_out.is_set():
+            raise XrandrTimeoutException(self.policy.timeout, args)
+        records.extend(parser.close())
+        if stderr:
+            raise XrandrException(stderr.decode(errors='replace'), args)
+        return records
+
+    def recorded_outputs(self, path: str) -> List[XrandrConnection]:
         """
-        val = ''
-        indent = ''
-        in_field = False
-        lines_collected = 0
-        for i, line in enumerate(item_lines):
-            m = re.match(r'(\s+)(.*):\s*(.*)$', line)
-            if m and m.group(2).lower() == field.lower():
-                indent = m.group(1)
-                in_field = True
-                val = m.group(3).strip()
-            elif in_field and m and (len(indent) >= len(m.group(1)) or m.group(1) == indent):
-                return val
-            elif in_field and not line.startswith(indent):
-                return val
-            elif in_field:
-                val += line.strip()
-                lines_collected += 1
-                if field == 'EDID' and lines_collected >= 8:
-                    return val
+        Parses output of xrandr -q --verbose (or xrandr -q) saved to a file
+        """
+        with open(path, 'rb') as f:
+            return self._outputs(parse(f.read()))
 
-        return val
+    def _outputs(self, records: List[OutputRecord]) -> List[XrandrConnection]:
+        """
+        Creates XrandrConnections from parsed output of xrandr -q or xrandr -q --verbose
+        """
+        with trace.span('parse outputs'):
+            logger.debug("Detected total %d outputs", len(records))
+            return list(map(self._connection, records))
 
-    def _parse_xrandr_connection(self, item_lines: list):
+    def _connection(self, record: OutputRecord) -> XrandrConnection:
         """
-        Creates XrandrConnection from lines returned by xrandr --query.
-        Example:
+        Creates XrandrConnection from output record. Example of output reported by xrandr --query:
         LVDS1 connected primary 1366x768+0+312 (normal left inverted right x axis y axis) 277mm x 156mm
            1366x768      60.02*+
            1024x768      60.00
         """
-        connection_info = item_lines[0]
+        crtc = record.property('CRTC')
+        crtc = int(crtc) if crtc else None
+        crtcs = record.property('CRTCs')
+        crtcs = [int(c) for c in crtcs.split() if c.isdigit()] if crtcs is not None else None
 
-        name, status, state = connection_info.split(' ', 2)
-
-        if status != 'connected':
+        if not record.connected:
             # We are not connected, do not parse the rest.
-            return XrandrConnection(name)
+            return XrandrConnection(record.name, crtc=crtc, crtcs=crtcs)
 
         # We are connected parse connected display.
-        display = self._parse_display(item_lines[1:])
+        display = self._display(record)
 
         if not display.is_on():
             # inactive output
-            return XrandrConnection(name, display)
+            return XrandrConnection(record.name, display, crtc=crtc, crtcs=crtcs)
 
-        parsed = self.OUTPUT_DETAILS_REGEX.match(state)
-        if parsed is None:
-            raise ParseException(name, status, state)
+        if record.geometry is None:
+            raise ParseException(record.name, record.status, record.details)
 
-        primary = parsed.group('primary') is not None
-        rotate = parsed.group('rotate')
-        panning = parsed.group('panning')
-        geometry = parsed.group('geometry')
-        size, pos = self._parse_geometry(geometry)
+        size, pos = self._parse_geometry(record.geometry)
+        rotate = record.rotate
+        viewport = Viewport(size, pos, rotate, record.panning)
 
+        vw, vh = viewport.size_px
         is_rotated = rotate in ['left', 'right']
         if is_rotated:
-            size = 'x'.join(size.split('x')[::-1])
+            vw, vh = vh, vw
+            viewport.size = "{}x{}".format(vw, vh)
 
-        scale = '1x1'
-        if size != display.mode:
-            dw, dh = map(lambda s: int(s), display.mode.split('x'))
-            vw, vh = map(lambda s: int(s), size.split('x'))
+        if display.mode_size is not None and (vw, vh) != display.mode_size:
+            dw, dh = display.mode_size
             sw, sh = vw / dw, vh / dh
             if is_rotated:
                 sw, sh = sh, sw
-            scale = "{}x{}".format(sw, sh)
-
-        viewport = Viewport(size, pos, rotate, panning, scale)
+            viewport.scale = "{}x{}".format(sw, sh)
 
-        return XrandrConnection(name, display, viewport, primary)
+        return XrandrConnection(record.name, display, viewport, record.primary, crtc, crtcs)
 
-    def _parse_display(self, lines: list):
-        supported_modes = []
+    def _display(self, record: OutputRecord) -> Display:
         preferred_mode = None
         current_mode = None
         current_rate = None
-        for mode_line in lines:
-            mode_line = mode_line.strip()
-            (mode, rate, extra) = self.CURRENT_MODE_REGEX.match(mode_line).groups()
-            current = (extra.find("*") >= 0)
-            preferred = (extra.find("+") >= 0)
-            supported_modes.append(mode)
-            if current:
-                current_mode = mode
-                current_rate = rate
-            if preferred:
-                preferred_mode = mode
-
-        return Display(supported_modes, preferred_mode, current_mode, current_rate)
-
-    def _group_query_result(self, query_result: list):
-        """
-        Group input list of lines such that every line starting with a non-whitespace character is a start of a
-        group, and every subsequent line starting with whitespace is a member of that group.
-        :param query_result: list of lines
-        :return: list of lists of lines
-        """
-
-        def group_fn(result, line):
-            # We append
-            if type(result) is str:
-                if line.startswith(' ') or line.startswith('\t'):
-                    return [[result, line]]
-                else:
-                    return [[result], [line]]
-            else:
-                if line.startswith(' ') or line.startswith('\t'):
-                    last = result[len(result) - 1]
-                    last.append(line)
-                    return result
-                else:
-                    result.append([line])
-                    return result
-
-        # TODO rewrite in imperative code
-        grouped = reduce(lambda result, line: group_fn(result, line), query_result)
-
-        return grouped
+        for mode in record.modes:
+            if mode.current:
+                current_mode = mode.name
+                current_rate = mode.rate
+            if mode.preferred:
+                preferred_mode = mode.name
+
+        return Display(preferred_mode=preferred_mode, current_mode=current_mode, current_rate=current_rate,
+                       edid=record.property('EDID') or '', modes=ModeTable(record.modes))
+
+    def _parse_xrandr_connection(self, item_lines: list) -> XrandrConnection:
+        """
+        Creates XrandrConnection from lines of a single output returned by xrandr --query
+        """
+        return self._connection(parse(item_lines)[0])
 
     def _parse_geometry(self, s: str):
         """
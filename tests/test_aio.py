@@ -0,0 +1,99 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from randrctl.aio import AsyncHooks, AsyncRandrCtl, AsyncXrandr
+from randrctl.exception import XrandrException, XrandrTimeoutException
+from randrctl.model import Profile, Output, Rule
+from randrctl.profile import ProfileManager
+from tests.xrandr_stub import XrandrStub
+
+
+class TestAsyncRandrCtl(TestCase):
+
+    def setUp(self):
+        self.stub = XrandrStub()
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.manager = ProfileManager([self.tmpdir], self.tmpdir)
+
+    def tearDown(self):
+        self.stub.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def xrandr(self, timeout: float = None):
+        xrandr = AsyncXrandr(":0", None, timeout)
+        xrandr.env = self.stub.env(xrandr.env)
+        return xrandr
+
+    def test_should_query_connected_outputs(self):
+        outputs = asyncio.run(self.xrandr().get_connected_outputs())
+
+        self.assertEqual(["LVDS1", "DP1"], [o.name for o in outputs])
+        self.assertEqual(1, outputs[1].crtc)
+        self.assertTrue(outputs[1].display.edid.startswith("00ffffffffffff0010acb8a0"))
+
+    def test_should_switch_to_best_matching_profile(self):
+        self.manager.write(Profile("home", {"LVDS1": Output("1366x768")}, {"LVDS1": Rule()}))
+        self.manager.write(Profile("office", {"LVDS1": Output("1366x768"), "DP1": Output("1920x1080", pos="1366x0")},
+                                   {"LVDS1": Rule(), "DP1": Rule(prefers="1920x1080")}))
+        randrctl = AsyncRandrCtl(self.manager, self.xrandr(), AsyncHooks())
+
+        applied = asyncio.run(randrctl.switch_auto())
+
+        self.assertEqual("office", applied.name)
+        apply_calls = [c for c in self.stub.calls() if "-q" not in c]
+        self.assertEqual(1, len(apply_calls))
+        self.assertIn("--output", apply_calls[0])
+        self.assertIn("HDMI1", apply_calls[0])
+
+    def test_should_kill_xrandr_on_timeout(self):
+        self.stub.delay(10)
+
+        start = time.monotonic()
+        with self.assertRaises(XrandrTimeoutException):
+            asyncio.run(self.xrandr(timeout=0.2).apply(Profile("home", {"LVDS1": Output("1366x768")})))
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_should_retry_transient_failure(self):
+        self.stub.fail_with("xrandr: Configure crtc 1 failed", times=1)
+        xrandr = self.xrandr()
+        xrandr.policy.backoff = 0.01
+
+        asyncio.run(xrandr.apply(Profile("home", {"LVDS1": Output("1366x768")})))
+
+        self.assertEqual(2, len([c for c in self.stub.calls() if "-q" not in c]))
+
+    def test_should_run_post_fail_hooks(self):
+        self.stub.fail_with("xrandr: cannot find crtc for output DP1")
+        out = os.path.join(self.tmpdir, "error")
+        randrctl = AsyncRandrCtl(self.manager, self.xrandr(), AsyncHooks(post_fail='echo "$randr_error" > ' + out))
+        self.manager.write(Profile("home", {"LVDS1": Output("1366x768")}))
+
+        with self.assertRaises(XrandrException):
+            asyncio.run(randrctl.switch_to("home"))
+
+        with open(out) as f:
+            self.assertEqual("xrandr: cannot find crtc for output DP1\n", f.read())
+
+    def test_should_restore_previous_layout_on_failure(self):
+        self.stub.fail_with("xrandr: cannot find crtc for output DP1", times=1)
+        randrctl = AsyncRandrCtl(self.manager, self.xrandr(), AsyncHooks())
+        self.manager.write(Profile("office", {"DP1": Output("1920x1080")}))
+
+        with self.assertRaises(XrandrException):
+            asyncio.run(randrctl.switch_to("office"))
+
+        rollback = self.stub.calls()[-1]
+        lvds = rollback.index("LVDS1")
+        self.assertEqual(["LVDS1", "--mode", "1366x768", "--pos", "0x312"], rollback[lvds:lvds + 5])
+
+    def test_should_await_hooks_concurrently(self):
+        hooks = AsyncHooks(post_switch=["sleep 0.5", "sleep 0.5", "sleep 0.5"])
+
+        start = time.monotonic()
+        asyncio.run(hooks.post_switch(Profile("home", {})))
+
+        self.assertLess(time.monotonic() - start, 1.4)
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from randrctl import bench
+from randrctl.model import Output, Profile, Rule
+from randrctl.profile import ProfileManager
+from tests.xrandr_stub import XrandrStub
+
+
+class TestBench(TestCase):
+
+    def setUp(self):
+        self.stub = XrandrStub()
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        profile_dir = os.path.join(self.tmpdir, "profiles")
+        os.mkdir(profile_dir)
+        ProfileManager([profile_dir], profile_dir).write(Profile("home", {"LVDS1": Output("1366x768")},
+                                                                 {"LVDS1": Rule()}))
+
+    def tearDown(self):
+        self.stub.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def run_bench(self, env: dict = None) -> dict:
+        with mock.patch.dict(os.environ, env or self.stub.env(os.environ)):
+            return bench.run(":0", None, 2, config_dirs=[self.tmpdir], cache_dir=self.tmpdir)
+
+    def test_should_time_every_phase(self):
+        result = self.run_bench()
+
+        self.assertEqual(bench.PHASES, list(result['phases']))
+        for phase in result['phases'].values():
+            self.assertLessEqual(phase['min_ms'], phase['median_ms'])
+            self.assertLessEqual(phase['median_ms'], phase['max_ms'])
+        self.assertEqual(1, result['profiles'])
+        self.assertEqual(2, result['outputs'])
+        # json serializable
+        self.assertEqual(result, json.loads(json.dumps(result)))
+        # nothing is applied
+        self.assertTrue(all(call[:1] == ["-q"] for call in self.stub.calls()))
+        self.assertEqual(4, len(self.stub.calls()))
+
+    def test_should_skip_phases_after_failure(self):
+        os.remove(self.stub.executable)
+
+        result = self.run_bench(env={'PATH': self.stub.dir})
+
+        self.assertIn('error', result['phases']['xrandr -q'])
+        self.assertNotIn('parse', result['phases'])
+        self.assertIsNone(result['outputs'])
+        table = bench.format_table(result).splitlines()
+        self.assertTrue(table[4].startswith("xrandr -q           failed: "))
+        self.assertEqual("compose             skipped", table[-2])
@@ -0,0 +1,53 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from benchmarks.generators import edid, output_name, profile_catalogue, xrandr_outputs
+from randrctl.parser import parse
+from randrctl.profile import ProfileManager, ProfileMatcher
+from randrctl.xrandr import Xrandr
+
+
+class TestGenerators(TestCase):
+
+    def setUp(self):
+        self.xrandr = Xrandr(None, None)
+        query, verbose = xrandr_outputs(8, 20)
+        self.assertEqual([o.name for o in self.xrandr._outputs(parse(query))],
+                         [o.name for o in self.xrandr._outputs(parse(verbose))])
+        self.outputs = [o for o in self.xrandr._outputs(parse(verbose)) if o.display is not None]
+
+    def test_should_generate_parseable_xrandr_output(self):
+        self.assertEqual([output_name(i) for i in (0, 1, 2, 4, 5, 6)], [o.name for o in self.outputs])
+        for i, o in zip((0, 1, 2, 4, 5, 6), self.outputs):
+            self.assertEqual(edid(i), o.display.edid)
+            self.assertEqual(20, len(o.display.supported_modes))
+            self.assertEqual(o.display.supported_modes[0], o.display.mode)
+            self.assertEqual(i, o.crtc)
+
+    def test_should_generate_matching_profiles(self):
+        directory = tempfile.mkdtemp(prefix="randrctl-test-")
+        try:
+            profile_catalogue(directory, 50, n_outputs=8, n_modes=20)
+            profiles = ProfileManager([directory], directory).read_all()
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(50, len(profiles))
+        self.assertTrue(ProfileMatcher().match(profiles, self.outputs))
+
+
+class TestHotplug(TestCase):
+
+    def test_should_switch_profile_in_sandbox(self):
+        from benchmarks.hotplug import Sandbox, run_once
+        sandbox = Sandbox(n_outputs=4, n_modes=8, n_profiles=10)
+        try:
+            result = run_once(sandbox, ['-d', 'auto'])
+        finally:
+            sandbox.cleanup()
+
+        self.assertIsNotNone(result['first xrandr'])
+        self.assertIsNotNone(result['modeset'])
+        self.assertLessEqual(result['first xrandr'], result['modeset'])
+        self.assertLessEqual(result['modeset'], result['total'])
@@ -0,0 +1,135 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipUnless
+
+from randrctl.cache import CatalogueGeneration, ProfileNameCache, write_atomically
+
+
+class TestProfileNameCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.cache_dir = os.path.join(self.tmpdir, "cache")
+        self.profile_dirs = [os.path.join(self.tmpdir, "home"), os.path.join(self.tmpdir, "etc")]
+        os.makedirs(self.profile_dirs[0])
+        self.touch(self.profile_dirs[0], "office")
+        self.touch(self.profile_dirs[0], "home")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, directory: str, name: str):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name), 'w'):
+            pass
+
+    def test_should_be_stale_if_missing(self):
+        self.assertFalse(ProfileNameCache(self.cache_dir, self.profile_dirs).is_fresh())
+
+    def test_should_list_profiles_in_plain_text(self):
+        cache = ProfileNameCache(self.cache_dir, self.profile_dirs)
+
+        self.assertEqual(["home", "office"], cache.names())
+        self.assertTrue(cache.is_fresh())
+        with open(os.path.join(self.cache_dir, "profiles")) as f:
+            self.assertEqual("home\noffice\n", f.read())
+
+    def test_should_be_stale_if_profile_dir_changes(self):
+        cache = ProfileNameCache(self.cache_dir, self.profile_dirs)
+        cache.update()
+        time.sleep(0.01)
+
+        self.touch(self.profile_dirs[1], "default")
+
+        self.assertFalse(cache.is_fresh())
+        self.assertEqual(["default", "home", "office"], cache.names())
+
+    def test_should_be_stale_after_profiles_are_written(self):
+        generation = CatalogueGeneration(self.cache_dir)
+        cache = ProfileNameCache(self.cache_dir, self.profile_dirs, generation)
+        cache.update()
+        self.assertTrue(cache.is_fresh())
+
+        # directories are left untouched, e.g. change is within mtime granularity
+        generation.bump()
+
+        self.assertFalse(cache.is_fresh())
+        cache.names()
+        self.assertTrue(cache.is_fresh())
+
+    def test_should_be_stale_if_profile_dirs_differ(self):
+        ProfileNameCache(self.cache_dir, self.profile_dirs).update()
+
+        self.assertFalse(ProfileNameCache(self.cache_dir, self.profile_dirs[:1]).is_fresh())
+
+    def test_should_skip_hidden_files(self):
+        self.touch(self.profile_dirs[0], ".home1234")
+
+        self.assertEqual(["home", "office"], ProfileNameCache(self.cache_dir, self.profile_dirs).update())
+
+
+class TestWriteAtomically(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_should_replace_file_without_leaving_temporary_files(self):
+        path = os.path.join(self.tmpdir, "dir", "file")
+
+        write_atomically(path, "old")
+        write_atomically(path, "new", durable=True, mode=0o644)
+
+        with open(path) as f:
+            self.assertEqual("new", f.read())
+        self.assertEqual(0o644, stat.S_IMODE(os.stat(path).st_mode))
+        self.assertEqual(["file"], os.listdir(os.path.dirname(path)))
+
+    @skipUnless(os.geteuid() == 0, "requires root")
+    def test_should_give_files_to_parent_directory_owner_when_root(self):
+        home = os.path.join(self.tmpdir, "home")
+        os.mkdir(home)
+        os.chown(home, 65534, 65534)
+        path = os.path.join(home, ".cache", "randrctl", "state-0.json")
+
+        write_atomically(path, "{}")
+        CatalogueGeneration(os.path.dirname(path)).bump()
+
+        for created in [os.path.join(home, ".cache"), os.path.dirname(path), path,
+                        os.path.join(os.path.dirname(path), "generation"),
+                        os.path.join(os.path.dirname(path), "generation.lock")]:
+            st = os.stat(created)
+            self.assertEqual((65534, 65534), (st.st_uid, st.st_gid), created)
+
+
+class TestCatalogueGeneration(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_should_start_from_zero(self):
+        self.assertEqual(0, CatalogueGeneration(os.path.join(self.tmpdir, "cache")).current())
+
+    def test_should_not_lose_concurrent_bumps(self):
+        generation = CatalogueGeneration(os.path.join(self.tmpdir, "cache"))
+
+        def bump():
+            for _ in range(20):
+                generation.bump()
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(80, generation.current())
@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import io
+import os
+import pwd
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+
+from randrctl.cli import args_parser, run_on_displays, read_resource
+from randrctl.exception import RandrCtlException
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the only application modules needed to print version
+VERSION_MODULES = {'randrctl', 'randrctl.cli', 'randrctl.exception', 'randrctl.trace'}
+
+# standard modules version can't do without. Time spent importing anything else (randrctl itself and whatever it pulls
+# in) is budgeted relative to their import time measured in the same run, so the budget holds on slow and loaded
+# machines
+REFERENCE_IMPORTS = 'import argparse, logging, runpy, importlib.metadata'
+IMPORT_TIME_BUDGET_RATIO = 0.3
+
+# modules that must not be imported on the hot path
+HEAVY_MODULES = ['yaml', 'argcomplete', 'pkg_resources', 'subprocess', 'randrctl.ctl', 'randrctl.context']
+
+
+def import_times(*args, env: dict = None):
+    """
+    Runs randrctl with -X importtime and returns a dict {module: self_time_us}
+    """
+    return python_import_times(['-m', 'randrctl'] + list(args), env)
+
+
+def python_import_times(args: list, env: dict = None):
+    """
+    Runs python with -X importtime and returns a dict {module: self_time_us}
+    """
+    p = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                       cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+    times = {}
+    for line in p.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(self_us)
+    return times
+
+
+class TestStartup(TestCase):
+
+    def test_version_should_not_import_heavy_modules(self):
+        times = import_times('version')
+
+        self.assertIn('randrctl.cli', times)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_status_should_not_import_heavy_modules(self):
+        with tempfile.TemporaryDirectory(prefix="randrctl-test-") as cache_home:
+            times = import_times('status', env=dict(os.environ, XDG_CACHE_HOME=cache_home))
+
+        self.assertIn('randrctl.state', times)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_version_should_fit_import_time_budget(self):
+        # best of several runs to reduce noise
+        overheads = []
+        for _ in range(3):
+            times = import_times('version')
+            reference = python_import_times(['-c', REFERENCE_IMPORTS])
+            own = sum(t for module, t in times.items() if module not in reference)
+            overheads.append(own / sum(reference.values()))
+
+        self.assertLess(min(overheads), IMPORT_TIME_BUDGET_RATIO)
+
+    def test_version_should_import_only_cli_modules(self):
+        times = import_times('version')
+
+        self.assertEqual(VERSION_MODULES, {module for module in times if module.split('.')[0] == 'randrctl'})
+
+
+class TestArgsParser(TestCase):
+
+    def test_bench_should_require_at_least_one_iteration(self):
+        for iterations in ['0', '-1', 'x']:
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                args_parser().parse_args(['bench', '-n', iterations])
+
+        self.assertEqual(3, args_parser().parse_args(['bench', '-n', '3']).iterations)
+
+
+class TestSetupCompletion(TestCase):
+
+    def test_zsh_should_reuse_bash_script(self):
+        p = subprocess.run([sys.executable, '-m', 'randrctl', 'setup', 'completion', '-s', 'zsh'],
+                           cwd=PROJECT_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        script = p.stdout.decode()
+
+        self.assertIn('bashcompinit', script)
+        self.assertIn('_randrctl_cached_profiles()', script)
+        self.assertNotIn('_randrctl_cached_profiles', read_resource('setup/completion.zsh'))
+
+
+class TestRunOnDisplays(TestCase):
+
+    def test_should_run_on_every_display_concurrently(self):
+        owner = pwd.getpwuid(os.getuid())
+        barrier = threading.Barrier(2, timeout=5)
+
+        def cmd(randrctl, args):
+            # both workers must be running at the same time to pass the barrier
+            barrier.wait()
+            if randrctl.xrandr.env['DISPLAY'] == ':1':
+                raise RandrCtlException("no luck")
+            return 0
+
+        results = run_on_displays(cmd, argparse.Namespace(), [':0', ':1', ':2'], {':0': owner, ':1': owner})
+
+        self.assertEqual((0, None), results[':0'])
+        self.assertEqual((1, "no luck"), results[':1'])
+        self.assertEqual(1, results[':2'][0])
@@ -0,0 +1,264 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from randrctl import trace
+from randrctl.ctl import Hook, Hooks, RandrCtl
+from randrctl.exception import ImpossibleProfileException, ValidationException, XrandrException
+from randrctl.metrics import TextfileMetrics
+from randrctl.model import Profile, Output, Rule
+from randrctl.profile import ProfileManager
+from randrctl.xrandr import Xrandr
+from tests.xrandr_stub import XrandrStub
+
+
+class TestHook(TestCase):
+
+    def test_should_parse_shell_command(self):
+        hooks = Hook.from_config("echo 42", timeout=5)
+
+        self.assertEqual(1, len(hooks))
+        self.assertEqual("echo 42", hooks[0].command)
+        self.assertTrue(hooks[0].shell)
+        self.assertEqual(5, hooks[0].timeout)
+        self.assertTrue(hooks[0].wait)
+
+    def test_should_skip_empty_definitions(self):
+        self.assertEqual([], Hook.from_config(None))
+        self.assertEqual([], Hook.from_config(" "))
+        self.assertEqual([], Hook.from_config({}))
+
+    def test_should_parse_list_of_hooks(self):
+        hooks = Hook.from_config([
+            "echo 42",
+            ["/usr/bin/feh", "--bg-fill", "wallpaper.png"],
+            {"command": ["polybar", "top"], "timeout": 1, "wait": False}
+        ], timeout=5)
+
+        self.assertEqual(3, len(hooks))
+        self.assertTrue(hooks[0].shell)
+        self.assertFalse(hooks[1].shell)
+        self.assertEqual(["/usr/bin/feh", "--bg-fill", "wallpaper.png"], hooks[1].command)
+        self.assertFalse(hooks[2].shell)
+        self.assertEqual(1, hooks[2].timeout)
+        self.assertFalse(hooks[2].wait)
+
+    def test_should_reject_invalid_definition(self):
+        with self.assertRaises(ValidationException):
+            Hook.from_config(42)
+
+
+class TestHooks(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.profile = Profile("home", {})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_should_run_hooks_concurrently(self):
+        hooks = Hooks(post_switch=["sleep 0.5", "sleep 0.5", "sleep 0.5"])
+
+        start = time.monotonic()
+        hooks.post_switch(self.profile)
+
+        self.assertLess(time.monotonic() - start, 1.4)
+
+    def test_should_kill_hook_on_timeout(self):
+        hooks = Hooks(post_switch="sleep 10", timeout=0.2)
+
+        start = time.monotonic()
+        hooks.post_switch(self.profile)
+
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_should_not_wait_for_background_hook(self):
+        hooks = Hooks(post_switch={"command": "sleep 10", "wait": False})
+
+        start = time.monotonic()
+        hooks.post_switch(self.profile)
+
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_should_pass_profile_to_argv_hook(self):
+        out = os.path.join(self.tmpdir, "out")
+        hooks = Hooks(prior_switch=[["sh", "-c", 'echo "$randr_profile" > ' + out]])
+
+        hooks.prior_switch(self.profile)
+
+        with open(out) as f:
+            self.assertEqual("home\n", f.read())
+
+    def test_should_run_global_and_profile_hooks(self):
+        global_out = os.path.join(self.tmpdir, "global")
+        profile_out = os.path.join(self.tmpdir, "profile")
+        hooks = Hooks(post_switch="touch " + global_out)
+        p = Profile("home", {"LVDS1": Output("1366x768")}, hooks={"post_switch": "touch " + profile_out})
+
+        hooks.post_switch(p)
+
+        self.assertTrue(os.path.isfile(global_out))
+        self.assertTrue(os.path.isfile(profile_out))
+
+    def test_should_pass_context_to_hook(self):
+        out = os.path.join(self.tmpdir, "out")
+        hooks = Hooks(post_switch="cat > " + out)
+        p = Profile("home", {"LVDS1": Output("1366x768"), "DP1": Output("1920x1080", pos="1366x0")}, primary="DP1")
+
+        hooks.post_switch(p)
+
+        with open(out) as f:
+            context = json.load(f)
+        self.assertEqual("home", context['profile'])
+        self.assertEqual("DP1", context['primary'])
+        self.assertEqual("1366x0", context['outputs']['DP1']['pos'])
+
+
+class TestRollback(TestCase):
+
+    def setUp(self):
+        self.stub = XrandrStub()
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.manager = ProfileManager([self.tmpdir], self.tmpdir)
+        self.manager.write(Profile("office", {"DP1": Output("1920x1080")}))
+        self.metrics_file = os.path.join(self.tmpdir, "randrctl.prom")
+
+    def tearDown(self):
+        self.stub.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def randrctl(self, hooks: Hooks = None):
+        xrandr = Xrandr(":0", None)
+        xrandr.env = self.stub.env(xrandr.env)
+        return RandrCtl(self.manager, xrandr, hooks or Hooks(), TextfileMetrics(self.metrics_file))
+
+    def test_should_restore_previous_layout_before_post_fail(self):
+        self.stub.fail_with("xrandr: cannot find crtc for output DP1", times=1)
+        calls_before_post_fail = os.path.join(self.tmpdir, "calls")
+        hooks = Hooks(post_fail="wc -l < {} > {}".format(os.path.join(self.stub.dir, "calls"), calls_before_post_fail))
+
+        with self.assertRaises(XrandrException):
+            self.randrctl(hooks).switch_to("office")
+
+        query, switch, rollback = self.stub.calls()
+        self.assertIn("--verbose", query)
+        self.assertEqual(["--output", "LVDS1", "--off"], switch[:3])
+        self.assertEqual(["DP1", "--mode", "1920x1080"], switch[switch.index("DP1"):][:3])
+        lvds, dp = rollback.index("LVDS1"), rollback.index("DP1")
+        self.assertEqual(["LVDS1", "--mode", "1366x768", "--pos", "0x312"], rollback[lvds:lvds + 5])
+        self.assertEqual(["DP1", "--mode", "1920x1080", "--pos", "1366x0"], rollback[dp:dp + 5])
+        self.assertEqual(["--primary", "--crtc", "0"], rollback[dp - 4:dp - 1])
+        self.assertEqual(["--crtc", "1"], rollback[-2:])
+        with open(calls_before_post_fail) as f:
+            self.assertEqual(3, int(f.read()))
+        with open(self.metrics_file) as f:
+            self.assertIn('randrctl_rollbacks_total{outcome="success"} 1', f.read())
+
+    def test_should_report_original_error_if_rollback_fails(self):
+        self.stub.fail_with("xrandr: cannot find crtc for output DP1")
+
+        with self.assertRaises(XrandrException) as e:
+            self.randrctl().switch_to("office")
+
+        self.assertEqual("xrandr: cannot find crtc for output DP1", str(e.exception))
+        self.assertEqual(3, len(self.stub.calls()))
+        with open(self.metrics_file) as f:
+            self.assertIn('randrctl_rollbacks_total{outcome="failure"} 1', f.read())
+
+    def test_should_not_rollback_successful_switch(self):
+        self.randrctl().switch_to("office")
+
+        self.assertEqual(2, len(self.stub.calls()))
+
+
+class TestCheck(TestCase):
+
+    def setUp(self):
+        self.stub = XrandrStub()
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.manager = ProfileManager([self.tmpdir], self.tmpdir)
+        self.manager.write(Profile("home", {"LVDS1": Output("1366x768")}, {"LVDS1": Rule()}))
+        self.manager.write(Profile("office", {"LVDS1": Output("1366x768"), "DP1": Output("1920x1080", rate="75")},
+                                   {"LVDS1": Rule(), "DP1": Rule()}))
+        xrandr = Xrandr(":0", None)
+        xrandr.env = self.stub.env(xrandr.env)
+        self.randrctl = RandrCtl(self.manager, xrandr, Hooks())
+
+    def tearDown(self):
+        self.stub.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def test_should_report_impossible_profiles(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            impossible = self.randrctl.check()
+
+        self.assertEqual(1, impossible)
+        self.assertEqual(["home: ok", "office: DP1 doesn't support 1920x1080 at 75Hz"],
+                         sorted(out.getvalue().splitlines()))
+
+    def test_should_check_against_recorded_output(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            impossible = self.randrctl.check(["home"], os.path.join(os.path.dirname(__file__), "xrandr_query_example"))
+
+        self.assertEqual(0, impossible)
+        self.assertEqual("home: ok\n", out.getvalue())
+        self.assertEqual([], self.stub.calls())
+
+    def test_should_refuse_impossible_profile(self):
+        with self.assertRaises(ImpossibleProfileException):
+            self.randrctl.switch_to("office", check=True)
+
+        self.assertEqual(1, len(self.stub.calls()))
+
+    def test_should_skip_impossible_profile_when_switching_automatically(self):
+        self.randrctl.switch_auto(check=True)
+
+        switch = self.stub.calls()[-1]
+        self.assertEqual(["--output", "DP1", "--off"], switch[:3])
+        self.assertEqual(["LVDS1", "--mode", "1366x768"], switch[switch.index("LVDS1"):][:3])
+
+    def test_should_stream_profiles_when_switching_automatically(self):
+        def read_all():
+            raise AssertionError("profiles must not be read into a list")
+        self.manager.read_all = read_all
+
+        self.randrctl.switch_auto(check=True)
+
+        self.assertIn("LVDS1", self.stub.calls()[-1])
+
+    def test_should_trace_and_measure_reading_apart_from_matching(self):
+        metrics_file = os.path.join(self.tmpdir, "randrctl.prom")
+        self.randrctl.metrics = TextfileMetrics(metrics_file)
+        saved, trace._tracer = trace._tracer, trace.Tracer(os.path.join(self.tmpdir, "trace.json"))
+        try:
+            self.randrctl.switch_auto(check=True)
+            events = trace._tracer.events
+        finally:
+            trace._tracer = saved
+
+        names = [e['name'] for e in events]
+        self.assertEqual(2, names.count('read profile'))
+        self.assertEqual(1, names.count('match profiles'))
+        with open(metrics_file) as f:
+            samples = f.read()
+        self.assertIn('randrctl_match_duration_seconds_count 1', samples)
+        self.assertIn('randrctl_read_profiles_duration_seconds_count 1', samples)
+
+    def test_should_list_profiles_as_jsonl(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.randrctl.list_all(jsonl=True)
+            self.randrctl.list_all_scored(jsonl=True)
+
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([{"name": "home"}, {"name": "office"}], sorted(lines[:2], key=lambda x: x["name"]))
+        self.assertEqual(["home", "office"], sorted(line["name"] for line in lines[2:]))
+        self.assertTrue(all(isinstance(line["score"], int) for line in lines[2:]))
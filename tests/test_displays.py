@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from randrctl.displays import LOGIND_SESSIONS_DIR_ENV, UTMP_FILE_ENV, UTMP_STRUCT, USER_PROCESS, X11_SOCKET_DIR_ENV, \
+    DisplayOwners, logind_display_users, utmp_display_users, x_displays
+
+
+def utmp_record(type: int, user: str, line: str, host: str = ''):
+    return UTMP_STRUCT.pack(type, 1, line.encode(), b'', user.encode(), host.encode(), 0, 0, 0, 0, 0, b'', b'')
+
+
+class TestDisplays(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.socket_dir = os.path.join(self.tmpdir, "X11-unix")
+        self.sessions_dir = os.path.join(self.tmpdir, "sessions")
+        self.utmp = os.path.join(self.tmpdir, "utmp")
+        os.makedirs(self.socket_dir)
+        os.makedirs(self.sessions_dir)
+        for socket in ["X0", "X1"]:
+            open(os.path.join(self.socket_dir, socket), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_utmp(self, *records):
+        with open(self.utmp, 'wb') as f:
+            f.write(b''.join(records))
+
+    def test_x_displays(self):
+        self.assertEqual([":0", ":1"], x_displays(self.socket_dir))
+        self.assertEqual([], x_displays(os.path.join(self.tmpdir, "missing")))
+
+    def test_locations_should_be_overridden_by_environment(self):
+        self.write_utmp(utmp_record(USER_PROCESS, "alice", "tty7", ":1"))
+        env = {X11_SOCKET_DIR_ENV: self.socket_dir, UTMP_FILE_ENV: self.utmp,
+               LOGIND_SESSIONS_DIR_ENV: self.sessions_dir}
+
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual([":0", ":1"], x_displays())
+            self.assertEqual({":1": "alice"}, DisplayOwners(self.tmpdir).usernames(x_displays()))
+
+    def test_utmp_display_users(self):
+        self.write_utmp(
+            utmp_record(2, "reboot", "~"),
+            utmp_record(USER_PROCESS, "alice", "tty7", ":0"),
+            utmp_record(USER_PROCESS, "bob", ":1"),
+            utmp_record(USER_PROCESS, "carol", "pts/0", ":1.0"),
+            utmp_record(USER_PROCESS, "dave", "pts/1", "192.168.0.1"),
+        )
+
+        self.assertEqual({":0": "alice", ":1": "carol"}, utmp_display_users(self.utmp))
+
+    def test_logind_display_users(self):
+        with open(os.path.join(self.sessions_dir, "2"), 'w') as f:
+            f.write("# This is private data. Do not parse.\nUID=1000\nUSER=alice\nDISPLAY=:0\n")
+        with open(os.path.join(self.sessions_dir, "3"), 'w') as f:
+            f.write("UID=1001\nUSER=bob\nTTY=tty3\n")
+
+        self.assertEqual({":0": "alice"}, logind_display_users(self.sessions_dir))
+
+    def test_should_cache_display_owners(self):
+        self.write_utmp(utmp_record(USER_PROCESS, "alice", "tty7", ":0"))
+        owners = DisplayOwners(self.tmpdir, self.socket_dir, self.utmp, self.sessions_dir)
+        self.assertEqual({":0": "alice"}, owners.usernames([":0", ":1"]))
+
+        # cached mapping is used as long as sockets and login records are the same
+        with open(owners.cache_file) as f:
+            cached = json.load(f)
+        cached['owners'] = {":0": "cached"}
+        with open(owners.cache_file, 'w') as f:
+            json.dump(cached, f)
+        self.assertEqual({":0": "cached"}, owners.usernames([":0", ":1"]))
+
+        # and is invalidated when login records change
+        os.unlink(self.utmp)
+        self.write_utmp(utmp_record(USER_PROCESS, "bob", "tty7", ":0"))
+        self.assertEqual({":0": "bob"}, owners.usernames([":0", ":1"]))
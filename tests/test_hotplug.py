@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from randrctl.ctl import Hooks, RandrCtl
+from randrctl.hotplug import watch
+from randrctl.model import Output, Profile, Rule
+from randrctl.profile import ProfileManager
+from randrctl.randr import CONNECTED, DISCONNECTED, RandrEvents
+from randrctl.xrandr import Xrandr
+from tests.x_server_stub import XServerStub
+from tests.xrandr_stub import XrandrStub
+
+
+class TestWatch(TestCase):
+
+    def setUp(self):
+        self.stub = XrandrStub()
+        self.server = XServerStub({"LVDS1": CONNECTED, "DP1": DISCONNECTED})
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        manager = ProfileManager([self.tmpdir], self.tmpdir)
+        manager.write(Profile("home", {"LVDS1": Output("1366x768")}, {"LVDS1": Rule()}))
+        xrandr = Xrandr(":0", None)
+        xrandr.env = self.stub.env(xrandr.env)
+        self.randrctl = RandrCtl(manager, xrandr, Hooks())
+
+    def tearDown(self):
+        self.server.close()
+        self.stub.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def switches(self) -> list:
+        return [call for call in self.stub.calls() if "-q" not in call]
+
+    def wait_for_switches(self, count: int):
+        deadline = time.monotonic() + 5
+        while len(self.switches()) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_should_switch_on_start_and_after_hotplug_settles(self):
+        events = RandrEvents(self.server.display)
+        watcher = threading.Thread(target=watch, args=(self.randrctl, events), kwargs={'debounce': 0.1})
+        watcher.start()
+        try:
+            self.wait_for_switches(1)
+
+            # burst of events results in a single switch
+            self.server.output_change("DP1", CONNECTED)
+            self.server.output_change("DP1", DISCONNECTED)
+            self.server.output_change("DP1", CONNECTED)
+            self.wait_for_switches(2)
+            time.sleep(0.2)
+        finally:
+            self.server.disconnect()
+            watcher.join(5)
+            events.close()
+
+        self.assertFalse(watcher.is_alive())
+        self.assertEqual(2, len(self.switches()))
+        # outputs are queried again before every switch
+        self.assertEqual(2, self.stub.calls().count(["-q", "--verbose"]))
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from randrctl import context
+from randrctl.model import Output, Profile
+
+
+class TestCatalogueWatcher(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.profile_dir = os.path.join(self.tmpdir, "profiles")
+        os.mkdir(self.profile_dir)
+        self.write_text(os.path.join(self.profile_dir, "home"), "outputs:\n  LVDS1: {mode: 1366x768}\n")
+        config_dirs = [self.tmpdir]
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        self.randrctl = context.build(":0", config_dirs=config_dirs, cache_dir=cache_dir)
+        self.watcher = context.watch_catalogue(self.randrctl, ":0", config_dirs=config_dirs, cache_dir=cache_dir)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write_text(self, path: str, content: str):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def names(self) -> list:
+        return sorted(p.name for p in self.randrctl.profile_manager.read_all())
+
+    def test_should_read_only_changed_profiles(self):
+        manager = self.randrctl.profile_manager
+        self.assertEqual(["home"], self.names())
+
+        with mock.patch.object(manager, 'read_path', wraps=manager.read_path) as read_path:
+            manager.write(Profile("office", {"DP1": Output(mode="1920x1080")}))
+            self.write_text(os.path.join(self.profile_dir, "home"), "outputs:\n  LVDS1: {mode: 1024x768}\n")
+            # nothing is read until changes are processed
+            self.assertEqual(["home"], self.names())
+
+            self.assertTrue(self.watcher.process())
+
+            self.assertEqual(2, read_path.call_count)
+        self.assertEqual(["home", "office"], self.names())
+        self.assertEqual("1024x768", manager.read_all()[0].outputs["LVDS1"].mode)
+        self.assertEqual(["home", "office"], manager.name_cache.names())
+
+    def test_should_drop_deleted_and_invalid_profiles(self):
+        os.rename(os.path.join(self.profile_dir, "home"), os.path.join(self.tmpdir, "home"))
+        self.write_text(os.path.join(self.profile_dir, "invalid"), "primary: LVDS1\n")
+        self.write_text(os.path.join(self.profile_dir, ".hidden"), "outputs:\n  LVDS1: {mode: 1366x768}\n")
+
+        self.watcher.process()
+
+        self.assertEqual([], self.names())
+        self.assertFalse(self.watcher.process())
+
+    def test_should_rebuild_hooks_when_config_changes(self):
+        self.write_text(os.path.join(self.tmpdir, "config.yaml"), "hooks:\n  post_switch: /bin/true\n")
+
+        self.assertTrue(self.watcher.process())
+
+        self.assertEqual("/bin/true", self.randrctl.hooks._global["post_switch"][0].command)
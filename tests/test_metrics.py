@@ -0,0 +1,67 @@
+import os
+import shutil
+import stat
+import tempfile
+from unittest import TestCase
+
+from randrctl.metrics import TextfileMetrics, SWITCHES, APPLY_DURATION, LAST_SWITCH
+
+
+class TestTextfileMetrics(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.path = os.path.join(self.tmpdir, "randrctl.prom")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_should_accumulate_counters_across_processes(self):
+        for outcome in ['success', 'success', 'failure']:
+            metrics = TextfileMetrics(self.path)
+            metrics.inc(SWITCHES, profile='home "sweet" home', outcome=outcome)
+            metrics.flush()
+
+        lines = self.read()
+        self.assertEqual([
+            '# HELP randrctl_switches_total Profile switches by profile and outcome',
+            '# TYPE randrctl_switches_total counter',
+            'randrctl_switches_total{outcome="failure",profile="home \\"sweet\\" home"} 1',
+            'randrctl_switches_total{outcome="success",profile="home \\"sweet\\" home"} 2',
+        ], lines)
+
+    def test_should_write_histogram(self):
+        metrics = TextfileMetrics(self.path)
+        metrics.observe(APPLY_DURATION, 0.3)
+        metrics.observe(APPLY_DURATION, 0.02)
+        metrics.set(LAST_SWITCH, 1700000000)
+        metrics.flush()
+
+        lines = self.read()
+        self.assertIn('randrctl_xrandr_apply_duration_seconds_bucket{le="0.01"} 0', lines)
+        self.assertIn('randrctl_xrandr_apply_duration_seconds_bucket{le="0.025"} 1', lines)
+        self.assertIn('randrctl_xrandr_apply_duration_seconds_bucket{le="0.5"} 2', lines)
+        self.assertIn('randrctl_xrandr_apply_duration_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('randrctl_xrandr_apply_duration_seconds_count 2', lines)
+        self.assertIn('randrctl_xrandr_apply_duration_seconds_sum 0.32', lines)
+        self.assertIn('randrctl_last_switch_timestamp_seconds 1700000000', lines)
+        # buckets are ordered numerically
+        buckets = [line for line in lines if '_bucket' in line]
+        self.assertTrue(buckets[0].startswith('randrctl_xrandr_apply_duration_seconds_bucket{le="0.005"}'))
+        self.assertTrue(buckets[-1].startswith('randrctl_xrandr_apply_duration_seconds_bucket{le="+Inf"}'))
+
+    def test_should_not_write_without_updates(self):
+        TextfileMetrics(self.path).flush()
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_should_be_readable_by_collector(self):
+        metrics = TextfileMetrics(self.path)
+        metrics.inc(SWITCHES, profile='home', outcome='success')
+        metrics.flush()
+
+        self.assertEqual(0o644, stat.S_IMODE(os.stat(self.path).st_mode))
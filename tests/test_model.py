@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from randrctl.model import Serializable, Profile, Output, Rule
+from randrctl.model import Serializable, Profile, Output, Rule, Viewport, Display
 
 
 class Node(Serializable):
@@ -117,3 +117,41 @@ class TestProfile(TestCase):
             # then
             self.assertEqual(expected_profile, p)
             self.assertDictEqual(dict, p.to_dict())
+
+
+class TestOutput(TestCase):
+
+    def test_should_parse_geometry(self):
+        o = Output("1920x1080", pos="1366x0", panning="1920x1080+10+20", scale="1.5x1.25", rate="59.94")
+
+        self.assertEqual((1920, 1080), o.mode_size)
+        self.assertEqual((1366, 0), o.pos_px)
+        self.assertEqual((1920, 1080, 10, 20), o.panning_px)
+        self.assertEqual((1.5, 1.25), o.scale_xy)
+        self.assertEqual(59.94, o.rate_hz)
+
+    def test_should_keep_unparseable_values(self):
+        o = Output("custom_mode", scale="auto")
+
+        self.assertEqual("custom_mode", o.mode)
+        self.assertIsNone(o.mode_size)
+        self.assertEqual("auto", o.scale)
+        self.assertIsNone(o.scale_xy)
+
+    def test_should_reparse_on_assignment(self):
+        o = Output("1920x1080", rate="60")
+
+        o.rate = None
+
+        self.assertIsNone(o.rate_hz)
+        self.assertNotIn('rate', o.to_dict())
+
+    def test_should_compare_by_fields(self):
+        self.assertEqual(Output("1920x1080", rate="60"), Output("1920x1080", rate="60"))
+        self.assertEqual(hash(Output("1920x1080", rate="60")), hash(Output("1920x1080", rate="60")))
+        self.assertNotEqual(Output("1920x1080", rate="60"), Output("1920x1080", rate="50"))
+
+    def test_should_not_have_dict(self):
+        self.assertFalse(hasattr(Output("1920x1080"), '__dict__'))
+        self.assertFalse(hasattr(Viewport("1920x1080"), '__dict__'))
+        self.assertFalse(hasattr(Display(), '__dict__'))
@@ -0,0 +1,127 @@
+import os
+import random
+import time
+from unittest import TestCase
+
+from randrctl.parser import XrandrParser, parse
+
+EXAMPLES_DIR = os.path.dirname(__file__)
+
+
+def example(name: str) -> bytes:
+    with open(os.path.join(EXAMPLES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class TestXrandrParser(TestCase):
+
+    def test_should_group_lines_by_output(self):
+        records = parse([
+            "Screen 0: minimum 320 x 200, current 3286 x 1080, maximum 8192 x 8192",
+            "LVDS1 connected",
+            "  1920x1080 60.00*+",
+            "  1366x768 60.00",
+            "  1280x800 60.00",
+            "DP1 connected",
+            "  1920x1080 60.00*+",
+            "HDMI1 disconnected",
+            "VGA1 disconnected"])
+
+        self.assertEqual(["LVDS1", "DP1", "HDMI1", "VGA1"], [r.name for r in records])
+        self.assertEqual([3, 1, 0, 0], [len(r.modes) for r in records])
+        self.assertEqual([True, True, False, False], [r.connected for r in records])
+
+    def test_should_parse_header(self):
+        record = parse("eDP1 connected primary 1920x1080+1280+800 (0x48) left (normal left inverted right x axis "
+                       "y axis) 270mm x 150mm panning 1920x1080+1280+800")[0]
+
+        self.assertEqual("eDP1", record.name)
+        self.assertTrue(record.primary)
+        self.assertEqual("1920x1080+1280+800", record.geometry)
+        self.assertEqual("left", record.rotate)
+        self.assertEqual("1920x1080+1280+800", record.panning)
+
+    def test_should_collect_edid_lines(self):
+        record = parse(["LVDS1 connected foo bar",
+                        "\tIdentifier: 0x45",
+                        "\tTimestamp: 123456789",
+                        "\tEDID:",
+                        "\t\t0",
+                        "\t\t1",
+                        "\t\t2",
+                        "\t\t3",
+                        "\t\t4",
+                        "\t\t5",
+                        "\t\t6",
+                        "\t\t7",
+                        "\t\t8",
+                        "\t\t9",
+                        "\t\t10",
+                        "\tBroadcast RGB: Automatic",
+                        "\t\tsupported: Automatic, Full",
+                        "\taudio: auto",
+                        "\t\tsupported: auto, on"])[0]
+
+        self.assertEqual("01234567", record.property('EDID'))
+        self.assertEqual("0x45", record.property('Identifier'))
+        self.assertEqual("Automaticsupported: Automatic, Full", record.property('Broadcast RGB'))
+        self.assertIsNone(record.property('CRTC'))
+
+    def test_should_parse_verbose_modes(self):
+        records = parse(example('xrandr_verbose_example'))
+
+        dp = records[1]
+        self.assertEqual("1", dp.property('CRTC'))
+        self.assertEqual([("1920x1080", "60.00", True, True), ("1920x1080", "50.00", False, False)],
+                         [(m.name, m.rate, m.current, m.preferred) for m in dp.modes])
+
+    def test_should_parse_same_records_regardless_of_chunking(self):
+        data = example('xrandr_verbose_example')
+        expected = parse(data)
+
+        for size in (1, 7, 64):
+            parser = XrandrParser()
+            records = []
+            for i in range(0, len(data), size):
+                records.extend(parser.feed(data[i:i + size]))
+            records.extend(parser.close())
+
+            self.assertEqual([r.name for r in expected], [r.name for r in records])
+            self.assertEqual([r.properties for r in expected], [r.properties for r in records])
+            self.assertEqual([r.modes for r in expected], [r.modes for r in records])
+
+    def test_should_survive_garbage(self):
+        rnd = random.Random(42)
+        data = example('xrandr_verbose_example') + example('xrandr_query_example')
+        alphabet = b' \t\n\r:+*x()0123456789.abcHDMI\xff\x00'
+        for _ in range(300):
+            mutated = bytearray(data)
+            for _ in range(rnd.randint(1, 50)):
+                mutated[rnd.randrange(len(mutated))] = rnd.choice(alphabet)
+            parse(bytes(mutated))
+        for _ in range(100):
+            parse(bytes(rnd.choice(alphabet) for _ in range(rnd.randint(0, 2000))))
+
+    def test_should_parse_in_linear_time(self):
+        def timed(data: bytes) -> float:
+            best = float('inf')
+            for _ in range(3):
+                start = time.perf_counter()
+                parser = XrandrParser()
+                for i in range(0, len(data), 4096):
+                    parser.feed(data[i:i + 4096])
+                parser.close()
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        inputs = {
+            'outputs': lambda n: example('xrandr_verbose_example') * n,
+            'long line': lambda n: b'DP1 connected ' + b'1x1+0+0 ' * (2000 * n),
+            'no line breaks': lambda n: b'\t' * (200000 * n),
+            'continuations': lambda n: b'DP1 connected\n\tEDID:\n' + b'\t\t00ff\n' * (2000 * n),
+            'rates': lambda n: b'DP1 connected\n  1920x1080 ' + b'60.00 + ' * (2000 * n) + b'\n',
+        }
+        for name, generate in inputs.items():
+            small, large = timed(generate(10)), timed(generate(40))
+            # 4 times larger input, quadratic parser would be 16 times slower
+            self.assertLess(large, small * 8, name)
@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+from randrctl.model import Profile, Output, XrandrConnection, Display, Viewport
+from randrctl.planner import plan_crtcs
+from randrctl.xrandr import Xrandr
+
+
+def connection(name: str, crtcs: list, crtc: int = None, connected: bool = True):
+    display = Display(["1920x1080"]) if connected else None
+    viewport = Viewport("1920x1080") if crtc is not None else None
+    return XrandrConnection(name, display, viewport, crtc=crtc, crtcs=crtcs)
+
+
+class TestPlanCrtcs(TestCase):
+
+    def test_should_keep_current_crtcs(self):
+        connections = [connection("LVDS1", [0, 1], 1), connection("DP1", [0, 1], 0)]
+        p = Profile("p", {"LVDS1": Output("1920x1080"), "DP1": Output("1920x1080")})
+
+        self.assertEqual({"LVDS1": 1, "DP1": 0}, plan_crtcs(p, connections))
+
+    def test_should_move_output_to_free_crtc_needed_by_another_output(self):
+        # HDMI1 can only be driven by CRTC 0, which is currently used by LVDS1
+        connections = [connection("LVDS1", [0, 1], 0), connection("HDMI1", [0]), connection("DP1", [0, 1, 2], 2)]
+        p = Profile("p", {"LVDS1": Output("1920x1080"), "HDMI1": Output("1920x1080"), "DP1": Output("1920x1080")})
+
+        self.assertEqual({"LVDS1": 1, "HDMI1": 0, "DP1": 2}, plan_crtcs(p, connections))
+
+    def test_should_prefer_crtcs_not_used_by_other_outputs(self):
+        connections = [connection("LVDS1", [0, 1, 2], 0), connection("DP1", [0, 1, 2]),
+                       connection("HDMI1", [0, 1, 2], 1)]
+        p = Profile("p", {"LVDS1": Output("1920x1080"), "DP1": Output("1920x1080"), "HDMI1": Output("1920x1080")})
+
+        self.assertEqual({"LVDS1": 0, "DP1": 2, "HDMI1": 1}, plan_crtcs(p, connections))
+
+    def test_should_take_crtcs_of_outputs_turned_off(self):
+        # VGA1 is turned off first, so its CRTC is as good as a free one
+        connections = [connection("LVDS1", [0, 1], 0), connection("VGA1", [0, 1], 1), connection("DP1", [1, 2])]
+        p = Profile("p", {"LVDS1": Output("1920x1080"), "DP1": Output("1920x1080")})
+
+        self.assertEqual({"LVDS1": 0, "DP1": 1}, plan_crtcs(p, connections))
+
+    def test_should_keep_crtcs_of_profile(self):
+        connections = [connection("LVDS1", [0, 1], 0), connection("DP1", [0, 1], 1)]
+        p = Profile("p", {"LVDS1": Output("1920x1080", crtc=1), "DP1": Output("1920x1080")})
+
+        self.assertEqual({"LVDS1": 1, "DP1": 0}, plan_crtcs(p, connections))
+
+    def test_should_not_plan_impossible_assignment(self):
+        connections = [connection("LVDS1", [0], 0), connection("DP1", [0])]
+        p = Profile("p", {"LVDS1": Output("1920x1080"), "DP1": Output("1920x1080")})
+
+        self.assertIsNone(plan_crtcs(p, connections))
+        self.assertIsNone(plan_crtcs(Profile("p", {"LVDS1": Output("1920x1080", crtc=1)}), connections))
+
+    def test_should_not_plan_without_possible_crtcs(self):
+        connections = [XrandrConnection("LVDS1", Display(["1920x1080"]))]
+
+        self.assertIsNone(plan_crtcs(Profile("p", {"LVDS1": Output("1920x1080")}), connections))
+
+    def test_should_turn_outputs_off_before_enabling_others(self):
+        connections = [connection("LVDS1", [0, 1], 0), connection("HDMI1", [0]), connection("VGA1", [0, 1], 1)]
+        p = Profile("p", {"HDMI1": Output("1920x1080")}, primary="HDMI1")
+
+        args = Xrandr(":0", None)._compose_mode_args(p, connections)
+
+        self.assertEqual([
+            '--output', 'LVDS1', '--off', '--output', 'VGA1', '--off',
+            '--output', 'HDMI1', '--mode', '1920x1080', '--pos', '0x0', '--rotate', 'normal', '--panning', '0x0',
+            '--scale', '1x1', '--primary', '--crtc', '0'
+        ], args)
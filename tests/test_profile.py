@@ -1,9 +1,16 @@
+import io
 import logging
 import os
+import shutil
+import stat
+import tempfile
+import threading
 from unittest import TestCase
 
-from randrctl.model import Profile, Rule, Viewport, Output, XrandrConnection, Display
-from randrctl.profile import ProfileManager, ProfileMatcher, hash
+from randrctl.cache import CatalogueGeneration
+from randrctl.exception import InvalidProfileException
+from randrctl.model import Profile, Rule, Viewport, Output, XrandrConnection, Display, Mode, ModeTable
+from randrctl.profile import ProfileChecker, ProfileManager, ProfileMatcher, hash
 
 
 class ProfileManagerTest(TestCase):
@@ -25,9 +32,8 @@ class ProfileManagerTest(TestCase):
             }
             # self.assertDictEqual(expected, p.outputs)
             self.assertEqual(expected["LVDS1"], p.outputs["LVDS1"])
-            self.assertDictEqual(Rule("d8578edf8458ce06fbc5bb76a58c5ca4", "1920x1200", "1920x1080").__dict__,
-                             p.match["DP1"].__dict__)
-            self.assertDictEqual(Rule().__dict__, p.match["LVDS1"].__dict__)
+            self.assertEqual(Rule("d8578edf8458ce06fbc5bb76a58c5ca4", "1920x1200", "1920x1080"), p.match["DP1"])
+            self.assertEqual(Rule(), p.match["LVDS1"])
 
     def test_simple_read(self):
         with open(self.TEST_SIMPLE_PROFILE_FILE) as f:
@@ -37,6 +43,61 @@ class ProfileManagerTest(TestCase):
             self.assertDictEqual({"LVDS1": Output(mode="1366x768")}, p.outputs)
             self.assertIsNone(p.match)
 
+    def test_should_write_same_yaml(self):
+        # output of pure python yaml.dump of generic to_dict, before serialization was generated from schemas
+        expected = {
+            False: "hooks:\n  post_switch:\n  - echo 1\n  - command:\n    - a\n    - b\n    wait: false\nmatch:\n"
+                   "  DP1:\n    edid: d8578edf8458ce06fbc5bb76a58c5ca4\n    prefers: 1920x1200\n    supports: 1920x1080\n"
+                   "  LVDS1: {}\n  VGA1:\n    rate: 75\n    supports: 800x600\nname: profile_example\noutputs:\n"
+                   "  DP1:\n    mode: 1920x1080\n    panning: '0x0'\n    pos: 1366x0\n    rotate: normal\n"
+                   "    scale: 1x1\n  LVDS1:\n    mode: 1366x768\n    panning: '0x0'\n    pos: '0x0'\n"
+                   "    rotate: normal\n    scale: 1x1\n  VGA1:\n    mode: 800x600\n    panning: 800x1080\n"
+                   "    pos: 3286x0\n    rate: 80\n    rotate: inverted\n    scale: 1x1\nprimary: LVDS1\n"
+                   "priority: 100\n",
+            True: "{hooks: {post_switch: [echo 1, {command: [a, b], wait: false}]}, match: {DP1: {edid: "
+                  "d8578edf8458ce06fbc5bb76a58c5ca4,\n      prefers: 1920x1200, supports: 1920x1080}, LVDS1: {}, VGA1: "
+                  "{rate: 75, supports: 800x600}},\n  name: profile_example, outputs: {DP1: {mode: 1920x1080, panning: "
+                  "'0x0', pos: 1366x0,\n      rotate: normal, scale: 1x1}, LVDS1: {mode: 1366x768, panning: '0x0', "
+                  "pos: '0x0',\n      rotate: normal, scale: 1x1}, VGA1: {mode: 800x600, panning: 800x1080, pos: "
+                  "3286x0,\n      rate: 80, rotate: inverted, scale: 1x1}}, primary: LVDS1, priority: 100}\n",
+        }
+        with open(self.TEST_PROFILE_FILE) as f:
+            p = self.manager.read_file(f)
+        p.hooks = {"post_switch": ["echo 1", {"command": ["a", "b"], "wait": False}]}
+        p.match["VGA1"] = Rule(supports="800x600", rate=75)
+
+        tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        try:
+            manager = ProfileManager([tmpdir], tmpdir)
+            for flow_style in (False, True):
+                manager.write(p, yaml_flow_style=flow_style)
+                with open(os.path.join(tmpdir, p.name)) as f:
+                    self.assertEqual(expected[flow_style], f.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_unknown_fields(self):
+        f = io.StringIO("outputs:\n  LVDS1:\n    mode: 1366x768\n    brightness: 1\n")
+        f.name = "with_unknown_fields"
+
+        with self.assertRaises(InvalidProfileException):
+            self.manager.read_file(f)
+
+    def test_read_hooks(self):
+        f = io.StringIO("outputs:\n  LVDS1:\n    mode: 1366x768\nhooks:\n  post_switch: echo 42\n")
+        f.name = "with_hooks"
+
+        p = self.manager.read_file(f)
+
+        self.assertDictEqual({"post_switch": "echo 42"}, p.hooks)
+
+    def test_read_invalid_hooks(self):
+        f = io.StringIO("outputs:\n  LVDS1:\n    mode: 1366x768\nhooks:\n  on_coffee: echo 42\n")
+        f.name = "with_invalid_hooks"
+
+        with self.assertRaises(InvalidProfileException):
+            self.manager.read_file(f)
+
     def test_profile_from_xrandr(self):
         xc = [XrandrConnection("LVDS1", Display(), Viewport("1366x768"), False),
               XrandrConnection("DP1", Display(), Viewport("1920x1080", pos="1366x0"), True),
@@ -124,6 +185,43 @@ class ProfileMatcherTest(TestCase):
         # then
         self.assertEqual(expected, best)
 
+    def test_should_match_rate_of_supported_mode(self):
+        # given
+        profiles = [
+            profile("60hz", {"DP1": Rule(supports="2560x1440", rate=60)}),
+            profile("144hz", {"DP1": Rule(supports="2560x1440", rate="144")})
+        ]
+        modes = ModeTable([Mode("2560x1440", "143.91", preferred=True), Mode("2560x1440", "59.95"),
+                           Mode("1920x1080", "60.00")])
+        outputs = [
+            XrandrConnection("DP1", Display(modes=modes))
+        ]
+        lower_rate_outputs = [
+            XrandrConnection("DP1", Display(modes=ModeTable([Mode("2560x1440", "59.95")])))
+        ]
+
+        # when
+        matches = self.matcher.match(profiles, outputs)
+        lower_rate_matches = self.matcher.match(profiles, lower_rate_outputs)
+
+        # then
+        self.assertEqual({"60hz", "144hz"}, {p.name for _, p in matches})
+        self.assertEqual(["60hz"], [p.name for _, p in lower_rate_matches])
+
+    def test_should_not_match_rate_of_other_mode(self):
+        # given
+        profiles = [profile("144hz", {"DP1": Rule(supports="1920x1080", rate="144")})]
+        modes = ModeTable([Mode("2560x1440", "144.00"), Mode("1920x1080", "60.00")])
+        outputs = [
+            XrandrConnection("DP1", Display(modes=modes))
+        ]
+
+        # when
+        best = self.matcher.find_best(profiles, outputs)
+
+        # then
+        self.assertIsNone(best)
+
     # TODO use-case of this is frankly not clear. We can set priority by file name. Clarify
     def test_should_pick_profile_with_higher_prio_if_same_score(self):
         # given
@@ -191,6 +289,157 @@ class ProfileMatcherTest(TestCase):
         self.assertEqual("match5", matches[4][1].name)
 
 
+    def test_top_should_keep_order_of_match(self):
+        # given
+        edid = "office"
+        profiles = [profile("p{}".format(i), {"LVDS1": Rule(), "DP1": Rule(hash(edid) if i % 3 else None)},
+                            prio=100 + i % 2) for i in range(20)]
+        outputs = [
+            XrandrConnection("LVDS1", Display()),
+            XrandrConnection("DP1", Display(["1920x1080"], "1920x1080", edid=edid))
+        ]
+
+        # when
+        matches = self.matcher.match(profiles, outputs)
+
+        # then
+        self.assertEqual(matches, self.matcher.top(profiles, outputs, None))
+        self.assertEqual(matches[:5], self.matcher.top(iter(profiles), outputs, 5))
+        self.assertEqual(matches[:1], self.matcher.top(iter(profiles), outputs, 1))
+
+
+class ProfileManagerIterTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.manager = ProfileManager([self.tmpdir], self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_should_read_profiles_lazily(self):
+        for name in ("p1", "p2"):
+            self.manager.write(Profile(name, {"LVDS1": Output(mode="1366x768")}))
+        with open(os.path.join(self.tmpdir, "invalid"), "w") as f:
+            f.write("primary: LVDS1")
+
+        profiles = self.manager.iter_profiles()
+        # nothing is read until iteration starts
+        self.manager.write(Profile("p3", {"LVDS1": Output(mode="1366x768")}))
+
+        self.assertEqual(["p1", "p2", "p3"], sorted(p.name for p in profiles))
+
+    def test_should_skip_hidden_files(self):
+        self.manager.write(Profile("p1", {"LVDS1": Output(mode="1366x768")}))
+        with open(os.path.join(self.tmpdir, ".p2"), "w") as f:
+            f.write("outputs:\n  LVDS1: {mode: 1366x768}\n")
+
+        self.assertEqual(["p1"], [p.name for p in self.manager.iter_profiles()])
+
+    def test_should_write_atomically_and_bump_generation(self):
+        generation = CatalogueGeneration(os.path.join(self.tmpdir, "cache"))
+        manager = ProfileManager([self.tmpdir], self.tmpdir, generation=generation)
+        small = Profile("p", {"LVDS1": Output(mode="1366x768")})
+        large = Profile("p", {"DP{}".format(i): Output(mode="1920x1080") for i in range(500)})
+        manager.write(small)
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                try:
+                    with open(os.path.join(self.tmpdir, "p")) as f:
+                        manager.read_file(f)
+                except Exception as e:
+                    errors.append(e)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            for i in range(50):
+                manager.write(large if i % 2 else small)
+        finally:
+            done.set()
+            reader.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(51, generation.current())
+        self.assertEqual(["cache", "p"], sorted(os.listdir(self.tmpdir)))
+
+    def test_should_keep_permissions_and_symlinks(self):
+        stowed = os.path.join(self.tmpdir, "dotfiles")
+        os.mkdir(stowed)
+        self.manager.write(Profile("p", {"LVDS1": Output(mode="1366x768")}))
+        os.rename(os.path.join(self.tmpdir, "p"), os.path.join(stowed, "p"))
+        os.chmod(os.path.join(stowed, "p"), 0o600)
+        os.symlink(os.path.join("dotfiles", "p"), os.path.join(self.tmpdir, "p"))
+
+        self.manager.write(Profile("p", {"LVDS1": Output(mode="1024x768")}))
+
+        self.assertTrue(os.path.islink(os.path.join(self.tmpdir, "p")))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(os.path.join(stowed, "p")).st_mode))
+        self.assertEqual("1024x768", self.manager.read_one("p").outputs["LVDS1"].mode)
+
+    def test_should_create_profile_with_umask_permissions(self):
+        umask = os.umask(0o027)
+        try:
+            self.manager.write(Profile("p", {"LVDS1": Output(mode="1366x768")}))
+        finally:
+            os.umask(umask)
+
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(os.path.join(self.tmpdir, "p")).st_mode))
+
+
+class ProfileCheckerTest(TestCase):
+    modes = ModeTable([Mode("1920x1080", "60.00", current=True), Mode("1920x1080", "50.00"), Mode("1280x720", "60.00")])
+    outputs = [
+        XrandrConnection("LVDS1", Display(["1366x768"]), crtcs=[0, 1]),
+        XrandrConnection("DP1", Display(modes=modes), crtcs=[0, 1]),
+        XrandrConnection("HDMI1", crtcs=[1]),
+    ]
+    checker = ProfileChecker(outputs)
+
+    def test_should_accept_supported_profile(self):
+        p = Profile("ok", {"LVDS1": Output("1366x768", crtc=0), "DP1": Output("1920x1080", rate="50", crtc=1)})
+
+        self.assertEqual([], self.checker.check(p))
+
+    def test_should_report_missing_and_disconnected_outputs(self):
+        p = Profile("away", {"HDMI1": Output("1920x1080"), "VGA1": Output("800x600")})
+
+        self.assertEqual(["HDMI1 is not connected", "VGA1 doesn't exist"], self.checker.check(p))
+
+    def test_should_report_unsupported_modes_and_rates(self):
+        p = Profile("fast", {"LVDS1": Output("1920x1080"), "DP1": Output("1280x720", rate="50")})
+
+        self.assertEqual(["LVDS1 doesn't support mode 1920x1080", "DP1 doesn't support 1280x720 at 50Hz"],
+                         self.checker.check(p))
+
+    def test_should_report_impossible_crtcs(self):
+        p = Profile("crtcs", {"LVDS1": Output("1366x768", crtc=2), "DP1": Output("1920x1080", crtc=0)})
+        shared = Profile("shared", {"LVDS1": Output("1366x768", crtc=0), "DP1": Output("1920x1080", crtc=0)})
+        checker = ProfileChecker(self.outputs[:2] + [XrandrConnection("HDMI1", Display(["1920x1080"]), crtcs=[1])])
+        too_many = Profile("too_many", {"LVDS1": Output("1366x768"), "DP1": Output("1920x1080"),
+                                        "HDMI1": Output("1920x1080")})
+
+        self.assertEqual(["LVDS1 can't be driven by CRTC 2"], self.checker.check(p))
+        self.assertEqual(["LVDS1 and DP1 are assigned to the same CRTC 0"], self.checker.check(shared))
+        self.assertEqual(["3 outputs are enabled, but only 2 CRTCs are available"], checker.check(too_many))
+
+    def test_should_report_outputs_sharing_the_only_crtc(self):
+        checker = ProfileChecker([XrandrConnection("LVDS1", Display(["1366x768"]), crtcs=[0]),
+                                  XrandrConnection("DP1", Display(["1920x1080"]), crtcs=[0]),
+                                  XrandrConnection("HDMI1", crtcs=[1])])
+        p = Profile("p", {"LVDS1": Output("1366x768"), "DP1": Output("1920x1080")})
+
+        self.assertEqual(["outputs can't be driven by distinct CRTCs"], checker.check(p))
+
+    def test_should_skip_crtc_checks_if_crtcs_unknown(self):
+        checker = ProfileChecker([XrandrConnection("LVDS1", Display(["1366x768"]))])
+
+        self.assertEqual([], checker.check(Profile("p", {"LVDS1": Output("1366x768", crtc=3)})))
+
+
 def profile(name: str, match: dict = None, prio: int = 100):
     # we do not care about actual outputs in these tests, only rules matters
     return Profile(name, {}, match, priority=prio)
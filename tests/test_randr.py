@@ -0,0 +1,68 @@
+import os
+import select
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+
+from randrctl.exception import XConnectionException
+from randrctl.randr import CONNECTED, DISCONNECTED, FAMILY_WILD, RandrEvents, parse_display
+from tests.x_server_stub import XServerStub
+
+
+def xauthority_entry(family: int, address: bytes, number: bytes, name: bytes, data: bytes) -> bytes:
+    entry = struct.pack('>H', family)
+    for field in (address, number, name, data):
+        entry += struct.pack('>H', len(field)) + field
+    return entry
+
+
+class TestRandrEvents(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.xauthority = os.path.join(self.tmpdir, "Xauthority")
+        self.server = XServerStub({"LVDS1": CONNECTED, "DP1": DISCONNECTED}, cookie=b'secret')
+        number = self.server.display.rpartition(':')[2].encode()
+        with open(self.xauthority, 'wb') as f:
+            f.write(xauthority_entry(FAMILY_WILD, b'', b'99', b'MIT-MAGIC-COOKIE-1', b'wrong'))
+            f.write(xauthority_entry(FAMILY_WILD, b'', number, b'MIT-MAGIC-COOKIE-1', b'secret'))
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, events: RandrEvents) -> list:
+        select.select([events], [], [], 5)
+        return events.read()
+
+    def test_should_parse_display(self):
+        self.assertEqual(('', 0, 0), parse_display(':0'))
+        self.assertEqual(('', 1, 2), parse_display('unix:1.2'))
+        self.assertEqual(('remote', 10, 0), parse_display('remote:10.0'))
+        for display in (None, '', '0', ':x', ':0.x'):
+            with self.assertRaises(XConnectionException):
+                parse_display(display)
+
+    def test_should_report_connection_changes(self):
+        events = RandrEvents(self.server.display, self.xauthority)
+        try:
+            self.assertEqual({"LVDS1": CONNECTED, "DP1": DISCONNECTED}, events.connections())
+
+            self.server.output_change("DP1", CONNECTED)
+            self.assertEqual([("DP1", CONNECTED)], self.read(events))
+
+            # reconfiguration of connected output isn't a hotplug
+            self.server.output_change("LVDS1", CONNECTED)
+            self.server.output_change("DP1", DISCONNECTED)
+            self.assertEqual([("DP1", DISCONNECTED)], self.read(events))
+
+            self.server.disconnect()
+            with self.assertRaises(XConnectionException):
+                self.read(events)
+        finally:
+            events.close()
+
+    def test_should_fail_if_not_authorized(self):
+        with self.assertRaisesRegex(XConnectionException, "Authorization required"):
+            RandrEvents(self.server.display, os.path.join(self.tmpdir, "missing"))
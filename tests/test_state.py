@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from randrctl.ctl import Hooks, RandrCtl
+from randrctl.model import Display, Output, Profile, XrandrConnection
+from randrctl.profile import ProfileManager
+from randrctl.state import AppliedState
+from randrctl.xrandr import Xrandr
+from tests.xrandr_stub import XrandrStub
+
+
+class TestAppliedState(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.drm_dir = os.path.join(self.tmpdir, "drm")
+        self.set_connector("card0-eDP-1", "connected")
+        self.set_connector("card0-HDMI-A-1", "disconnected")
+        self.profile = Profile("home", {"eDP1": Output("1920x1080")}, primary="eDP1")
+        self.connected = [XrandrConnection("eDP1", Display(edid="00ff"))]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def set_connector(self, connector: str, status: str):
+        os.makedirs(os.path.join(self.drm_dir, connector), exist_ok=True)
+        with open(os.path.join(self.drm_dir, connector, "status"), "w") as f:
+            f.write(status + "\n")
+
+    def state(self, display: str = ":0"):
+        return AppliedState(self.tmpdir, display, self.drm_dir)
+
+    def test_should_have_no_status_until_applied(self):
+        self.assertIsNone(self.state().status())
+
+    def test_should_report_saved_profile(self):
+        self.state().save(self.profile, self.connected)
+
+        status = self.state().status()
+        self.assertEqual("home", status["profile"])
+        self.assertEqual("eDP1", status["primary"])
+        self.assertEqual("1920x1080", status["outputs"]["eDP1"]["mode"])
+        self.assertFalse(status["stale"])
+
+    def test_should_be_stale_after_hotplug(self):
+        self.state().save(self.profile, self.connected)
+
+        self.set_connector("card0-HDMI-A-1", "connected")
+
+        self.assertTrue(self.state().status()["stale"])
+
+    def test_should_not_know_staleness_without_drm(self):
+        shutil.rmtree(self.drm_dir)
+        self.state().save(self.profile, self.connected)
+
+        self.assertIsNone(self.state().status()["stale"])
+
+    def test_should_keep_state_per_display(self):
+        self.state(":0").save(self.profile, self.connected)
+
+        self.assertIsNone(self.state(":1").status())
+
+    def test_should_fingerprint_displays(self):
+        self.state().save(self.profile, self.connected)
+        self.state(":1").save(self.profile, [XrandrConnection("eDP1", Display(edid="00aa"))])
+
+        self.assertNotEqual(self.state().status()["fingerprint"], self.state(":1").status()["fingerprint"])
+
+
+class TestRandrCtlState(TestCase):
+
+    def setUp(self):
+        self.stub = XrandrStub()
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.manager = ProfileManager([self.tmpdir], self.tmpdir)
+
+    def tearDown(self):
+        self.stub.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def test_should_save_state_without_querying_xrandr_again(self):
+        self.manager.write(Profile("home", {"LVDS1": Output("1366x768")}))
+        xrandr = Xrandr(":0", None)
+        xrandr.env = self.stub.env(xrandr.env)
+        state = AppliedState(os.path.join(self.tmpdir, "cache"), ":0")
+
+        RandrCtl(self.manager, xrandr, Hooks(), state=state).switch_to("home")
+
+        with open(state.path) as f:
+            saved = json.load(f)
+        self.assertEqual("home", saved["profile"])
+        # -q --verbose and the switch itself
+        self.assertEqual(2, len(self.stub.calls()))
@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from randrctl import trace
+
+
+class TestTrace(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="randrctl-test-")
+        self.saved = trace._tracer
+
+    def tearDown(self):
+        trace._tracer = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_should_not_record_when_disabled(self):
+        trace._tracer = None
+
+        self.assertIs(trace.span("foo"), trace.span("bar"))
+        with trace.span("foo") as span:
+            span.set(bar=42)
+        self.assertFalse(trace.enabled())
+
+    def test_should_write_chrome_trace(self):
+        path = os.path.join(self.tmpdir, "trace-%p.json")
+        trace._tracer = trace.Tracer(path)
+
+        with trace.span("outer", command="auto"):
+            with trace.span("inner") as span:
+                span.set(count=3)
+        trace.record("hook", 1000, 3000, tid=42, command="sleep 1")
+        trace._tracer.write()
+
+        with open(path.replace('%p', str(os.getpid()))) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(["inner", "outer", "hook"], [e['name'] for e in events])
+        self.assertEqual({'count': 3}, events[0]['args'])
+        self.assertEqual({'command': "auto"}, events[1]['args'])
+        self.assertLessEqual(events[1]['ts'], events[0]['ts'])
+        self.assertGreaterEqual(events[1]['dur'], events[0]['dur'])
+        self.assertEqual({'name': "hook", 'ph': 'X', 'ts': 1.0, 'dur': 2.0, 'pid': os.getpid(), 'tid': 42,
+                          'args': {'command': "sleep 1"}}, events[2])
@@ -1,8 +1,12 @@
+import os
+import time
 from unittest import TestCase
 
-from randrctl.exception import XrandrException, ParseException
+from randrctl.exception import XrandrException, XrandrTimeoutException, ParseException
 from randrctl.model import Profile, Output, XrandrConnection
-from randrctl.xrandr import Xrandr
+from randrctl.parser import parse
+from randrctl.xrandr import Xrandr, XrandrPolicy
+from tests.xrandr_stub import XrandrStub
 
 
 class TestXrandr(TestCase):
@@ -88,6 +92,25 @@ class TestXrandr(TestCase):
         self.assertIsNone(connection.viewport)
         self.assertFalse(connection.primary)
 
+    def test_parse_display_modes(self):
+        display = self.xrandr._parse_xrandr_connection([
+            "DP1 connected 1920x1080+0+0 (normal left inverted right x axis y axis) 510mm x 290mm",
+            "   1920x1080     60.00 +  50.00    59.94*",
+            "   1920x1080i    60.00    50.00",
+            "   1280x1024     75.02",
+        ]).display
+
+        self.assertEqual("1920x1080", display.mode)
+        self.assertEqual("59.94", display.rate)
+        self.assertEqual("1920x1080", display.preferred_mode)
+        self.assertEqual(["1920x1080", "1920x1080i", "1280x1024"], display.supported_modes)
+        self.assertEqual(6, len(display.modes.modes))
+        self.assertTrue(display.modes.by_rate[("1920x1080", 60)].preferred)
+        self.assertTrue(display.modes.by_rate[("1920x1080i", 50)].interlaced)
+        self.assertEqual((1280, 1024), display.modes.by_name["1280x1024"][0].size)
+        self.assertTrue(display.modes.supports_rate(75))
+        self.assertFalse(display.modes.supports_rate(75, "1920x1080"))
+
     def test_parse_xrandr_connection_invalid(self):
         query_result = [
             "HDMI1 connected (normal left inverted right x axis y axis)",
@@ -230,46 +253,98 @@ class TestXrandr(TestCase):
         except XrandrException:
             pass
 
-    def test_group_query_result(self):
-        query_result = [
-            "LVDS1 connected",
-            "  1920x1080+*",
-            "  1366x768",
-            "  1280x800",
-            "DP1 connected",
-            "  1920x1080+*",
-            "HDMI1 disconnected",
-            "VGA1 disconnected"]
-
-        grouped = self.xrandr._group_query_result(query_result)
-
-        self.assertEqual(4, len(grouped))
-        self.assertListEqual(query_result[0:4], grouped[0])
-        self.assertListEqual(query_result[4:6], grouped[1])
-        self.assertListEqual(query_result[6:7], grouped[2])
-        self.assertListEqual(query_result[7:], grouped[3])
-
-    def test_edid_from_query_item(self):
-        query_result = ["LVDS1 connected foo bar",
-                        "\tIdentifier: 0x45",
-                        "\tTimestamp: 123456789",
-                        "\tEDID:",
-                        "\t\t0",
-                        "\t\t1",
-                        "\t\t2",
-                        "\t\t3",
-                        "\t\t4",
-                        "\t\t5",
-                        "\t\t6",
-                        "\t\t7",
-                        "\t\t8",
-                        "\t\t9",
-                        "\t\t10",
-                        "\tBroadcast RGB: Automatic",
-                        "\t\tsupported: Automatic, Full",
-                        "\taudio: auto",
-                        "\t\tsupported: auto, on"
-                        ]
-
-        edid = self.xrandr._field_from_query_item(query_result, 'EDID')
-        self.assertEqual("01234567", edid)
+    def test_get_connected_outputs_verbose(self):
+        with open(os.path.join(os.path.dirname(__file__), 'xrandr_verbose_example'), 'rb') as f:
+            outputs = self.xrandr._outputs(parse(f.read()))
+
+        self.assertEqual(["LVDS1", "DP1", "HDMI1", "VGA1"], [o.name for o in outputs])
+        lvds, dp = outputs[0], outputs[1]
+        self.assertTrue(lvds.primary)
+        self.assertEqual(0, lvds.crtc)
+        self.assertEqual("1366x768", lvds.display.mode)
+        self.assertEqual("60.02", lvds.display.rate)
+        self.assertEqual("1366x768", lvds.viewport.size)
+        self.assertEqual("0x312", lvds.viewport.pos)
+        self.assertTrue(lvds.display.edid.startswith("00ffffffffffff0030e4d802"))
+        self.assertTrue(lvds.display.edid.endswith("004c503132355748322d534c42330059"))
+        self.assertEqual(1, dp.crtc)
+        self.assertEqual([0, 1], dp.crtcs)
+        self.assertEqual("1366x0", dp.viewport.pos)
+        self.assertTrue(dp.display.modes.supports_rate(50, "1920x1080"))
+        self.assertIsNone(outputs[2].display)
+
+
+class TestXrandrPolicy(TestCase):
+    profile = Profile("home", {"LVDS1": Output("1366x768")})
+
+    def setUp(self):
+        self.stub = XrandrStub()
+
+    def tearDown(self):
+        self.stub.cleanup()
+
+    def xrandr(self, **policy):
+        xrandr = Xrandr(":0", None, XrandrPolicy(backoff=0.01, **policy))
+        xrandr.env = self.stub.env(xrandr.env)
+        return xrandr
+
+    def apply_calls(self) -> list:
+        return [c for c in self.stub.calls() if "-q" not in c]
+
+    def test_refresh_should_forget_results_of_one_instance_only(self):
+        refreshed, other = self.xrandr(), self.xrandr()
+        for xrandr in (refreshed, other):
+            xrandr.get_all_outputs()
+
+        refreshed.refresh()
+        for xrandr in (refreshed, other):
+            xrandr.get_all_outputs()
+
+        self.assertEqual(3, len(self.stub.calls()))
+
+    def test_should_retry_transient_failure(self):
+        self.stub.fail_with("xrandr: Configure crtc 1 failed", times=2)
+
+        self.xrandr(retries=2).apply(self.profile)
+
+        self.assertEqual(3, len(self.apply_calls()))
+
+    def test_should_give_up_after_retries(self):
+        self.stub.fail_with("xrandr: Configure crtc 1 failed", times=5)
+
+        with self.assertRaises(XrandrException):
+            self.xrandr(retries=1).apply(self.profile)
+        self.assertEqual(2, len(self.apply_calls()))
+
+    def test_should_not_retry_permanent_failure(self):
+        self.stub.fail_with("warning: output LVDS1 not found; ignoring")
+
+        with self.assertRaises(XrandrException):
+            self.xrandr().apply(self.profile)
+        self.assertEqual(1, len(self.apply_calls()))
+
+    def test_should_retry_configured_failures(self):
+        self.stub.fail_with("xrandr: cannot find crtc for output DP1", times=1)
+
+        self.xrandr(retry_on=["cannot find crtc"]).apply(self.profile)
+
+        self.assertEqual(2, len(self.apply_calls()))
+
+    def test_should_kill_xrandr_on_timeout(self):
+        self.stub.fail_with("xrandr: Configure crtc 1 failed")
+        self.stub.delay(10)
+
+        start = time.monotonic()
+        with self.assertRaises(XrandrTimeoutException):
+            self.xrandr(timeout=0.2).apply(self.profile)
+        self.assertLess(time.monotonic() - start, 5)
+        # timeouts are not retried
+        self.assertEqual(1, len(self.apply_calls()))
+
+    def test_should_jitter_backoff(self):
+        policy = XrandrPolicy(backoff=1)
+
+        for attempt in range(3):
+            delays = [policy.delay(attempt) for _ in range(20)]
+            self.assertTrue(all(0.5 * 2 ** attempt <= d <= 1.5 * 2 ** attempt for d in delays))
+            self.assertGreater(len(set(delays)), 1)
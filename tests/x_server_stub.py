@@ -0,0 +1,111 @@
+import socket
+import struct
+import threading
+
+RANDR_MAJOR = 140
+RANDR_FIRST_EVENT = 89
+ROOT = 0x2a
+
+
+class XServerStub:
+    """
+    Fake X server listening on TCP, implementing just enough of the protocol for RandrEvents
+    """
+
+    def __init__(self, outputs: dict, cookie: bytes = None):
+        """
+        :param outputs: {output name: connection status}
+        :param cookie: MIT-MAGIC-COOKIE-1 clients must present, no authorization if None
+        """
+        self.outputs = list(outputs.items())
+        self.cookie = cookie
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        # displays are served on 6000 + display number
+        self.display = '127.0.0.1:{}'.format(self.listener.getsockname()[1] - 6000)
+        self.selected = threading.Event()
+        self.connection = None
+        self.sequence = 0
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def output_change(self, name: str, connection: int):
+        """
+        Sends RRNotify OutputChange event
+        """
+        output = [n for n, _ in self.outputs].index(name) + 1
+        self.selected.wait(5)
+        self.connection.sendall(struct.pack('<BBHIIIIIIHBB', RANDR_FIRST_EVENT + 1, 1, self.sequence, 0, 0, ROOT,
+                                            output, 0, 0, 1, connection, 0))
+
+    def disconnect(self):
+        self.selected.wait(5)
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+    def close(self):
+        self.listener.close()
+        if self.connection is not None:
+            self.connection.close()
+
+    def _recv(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _reply(self, data: bytes = b'', extra: bytes = b'', detail: int = 0):
+        payload = data.ljust(24, b'\0') + extra
+        payload += b'\0' * (-len(payload) % 4)
+        self.connection.sendall(struct.pack('<BBHI', 1, detail, self.sequence, (len(payload) - 24) // 4) + payload)
+
+    def _serve(self):
+        try:
+            self.connection, _ = self.listener.accept()
+            self._setup()
+            while True:
+                major, minor, length = struct.unpack('<BBH', self._recv(4))
+                body = self._recv(4 * length - 4)
+                self.sequence += 1
+                self._request(major, minor, body)
+        except (EOFError, OSError):
+            pass
+
+    def _setup(self):
+        _, _, _, name_length, data_length = struct.unpack('<BxHHHHxx', self._recv(12))
+        name = self._recv(name_length + -name_length % 4)[:name_length]
+        data = self._recv(data_length + -data_length % 4)[:data_length]
+        if self.cookie is not None and (name, data) != (b'MIT-MAGIC-COOKIE-1', self.cookie):
+            reason = b'Authorization required'
+            padded = reason + b'\0' * (-len(reason) % 4)
+            self.connection.sendall(struct.pack('<BBHHH', 0, len(reason), 11, 0, len(padded) // 4) + padded)
+            raise EOFError()
+        vendor = b'stub'
+        screen = struct.pack('<I', ROOT).ljust(40, b'\0')
+        info = struct.pack('<IIIIHHBB', 0, 0, 0, 0, len(vendor), 65535, 1, 0).ljust(32, b'\0') + vendor + screen
+        self.connection.sendall(struct.pack('<BxHHH', 1, 11, 0, len(info) // 4) + info)
+
+    def _request(self, major: int, minor: int, body: bytes):
+        if major == 98:
+            # QueryExtension
+            length, = struct.unpack_from('<H', body)
+            present = body[4:4 + length] == b'RANDR'
+            self._reply(struct.pack('<BBBB', present, RANDR_MAJOR, RANDR_FIRST_EVENT, 147))
+        elif major == RANDR_MAJOR and minor == 0:
+            self._reply(struct.pack('<II', 1, 6))
+        elif major == RANDR_MAJOR and minor == 25:
+            # GetScreenResourcesCurrent
+            ids = struct.pack('<{}I'.format(len(self.outputs)), *range(1, len(self.outputs) + 1))
+            self._reply(struct.pack('<IIHHHH', 0, 7, 0, len(self.outputs), 0, 0), ids)
+        elif major == RANDR_MAJOR and minor == 9:
+            # GetOutputInfo
+            output, _ = struct.unpack('<II', body)
+            name, connection = self.outputs[output - 1]
+            self._reply(struct.pack('<IIIIBBHHHHH', 0, 0, 0, 0, connection, 0, 0, 0, 0, 0, len(name)),
+                        name.encode())
+        elif major == RANDR_MAJOR and minor == 4:
+            # SelectInput
+            self.selected.set()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import stat
+import tempfile
+
+EXAMPLES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPT = '''#!/bin/sh
+dir="$(dirname "$0")"
+echo "$*" >> "$dir/calls"
+case " $* " in
+    *" --verbose "*) cat "$dir/verbose" ;;
+    *" -q "*) cat "$dir/query" ;;
+    *)
+        [ -f "$dir/delay" ] && sleep "$(cat "$dir/delay")"
+        if [ -f "$dir/failures" ]; then
+            failures="$(cat "$dir/failures")"
+            [ "$failures" -gt 0 ] && echo $((failures - 1)) > "$dir/failures" && cat "$dir/error" >&2
+        elif [ -f "$dir/error" ]; then
+            cat "$dir/error" >&2
+        fi
+        ;;
+esac
+exit 0
+'''
+
+
+class XrandrStub:
+    """
+    Fake xrandr executable replaying canned query output and recording arguments of every call
+    """
+
+    def __init__(self, query: str = 'xrandr_query_example', verbose: str = 'xrandr_verbose_example'):
+        self.dir = tempfile.mkdtemp(prefix="randrctl-xrandr-")
+        self.executable = os.path.join(self.dir, 'xrandr')
+        with open(self.executable, 'w') as f:
+            f.write(SCRIPT)
+        os.chmod(self.executable, stat.S_IRWXU)
+        shutil.copy(os.path.join(EXAMPLES_DIR, query), os.path.join(self.dir, 'query'))
+        shutil.copy(os.path.join(EXAMPLES_DIR, verbose), os.path.join(self.dir, 'verbose'))
+
+    def env(self, env: dict) -> dict:
+        """
+        :return: copy of env with the stub first on PATH
+        """
+        env = dict(env)
+        env['PATH'] = self.dir + os.pathsep + env.get('PATH', '')
+        return env
+
+    def fail_with(self, error: str, times: int = None):
+        """
+        :param times: fail only this many times and succeed after, always fail if None
+        """
+        with open(os.path.join(self.dir, 'error'), 'w') as f:
+            f.write(error)
+        if times is not None:
+            with open(os.path.join(self.dir, 'failures'), 'w') as f:
+                f.write(str(times))
+
+    def delay(self, seconds: float):
+        with open(os.path.join(self.dir, 'delay'), 'w') as f:
+            f.write(str(seconds))
+
+    def calls(self) -> list:
+        try:
+            with open(os.path.join(self.dir, 'calls')) as f:
+                return [line.split() for line in f.read().splitlines()]
+        except FileNotFoundError:
+            return []
+
+    def cleanup(self):
+        shutil.rmtree(self.dir)